@@ -0,0 +1,264 @@
+import os
+import sqlite3
+import glob
+import gzip
+import shutil
+import logging
+import argparse
+from datetime import datetime, timezone, timedelta
+
+# Importamos nuestros módulos
+import database
+from process_raw_battles import load_season_data
+
+# --- Configuración de Logging ---
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler() # Log to console
+    ]
+)
+
+# --- Configuración ---
+# Días de espera tras el fin de la temporada antes de archivar, para que el
+# procesador termine de volcar las batallas tardías que aún estén en raw_battles.db.
+DEFAULT_GRACE_DAYS = 3
+
+# Índices de lectura que se crean en cada archivo compactado
+ARCHIVE_INDEXES = {
+    'idx_battles_player_1': 'battles (player_1, created_date)',
+    'idx_battles_player_2': 'battles (player_2, created_date)',
+    'idx_battles_winner': 'battles (winner)',
+    'idx_battles_created_date': 'battles (created_date)',
+}
+
+def parse_iso_date(date_str):
+    return datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+
+def get_closed_seasons(seasons_data, grace_days, now=None):
+    """Retorna los IDs de temporadas cuyo fin (más el periodo de gracia) ya pasó."""
+    now = now or datetime.now(timezone.utc)
+    limit = now - timedelta(days=grace_days)
+    return [season['id'] for season in seasons_data if parse_iso_date(season['ends']) <= limit]
+
+def get_source_watermark(conn):
+    """Cantidad de filas y rowid máximo: si cambian durante el archivado, abortamos."""
+    return conn.execute("SELECT COUNT(*), MAX(rowid) FROM battles").fetchone()
+
+def build_sorted_copy(db_path, staging_path):
+    """
+    Copia el contenido de db_path a staging_path ordenado por fecha de creación,
+    con todos los índices de lectura y estadísticas del planificador.
+    """
+    if os.path.exists(staging_path):
+        os.remove(staging_path)
+
+    conn = sqlite3.connect(f'file:{staging_path}', uri=True)
+    conn.execute('PRAGMA journal_mode=OFF') # Archivo temporal: no necesitamos journal
+    conn.execute('PRAGMA synchronous=OFF')
+    database.initialize_structured_battle_table(conn)
+
+    conn.execute("ATTACH DATABASE ? AS src", (f'file:{db_path}?mode=ro',))
+    columns = ', '.join(database.STRUCTURED_BATTLE_COLUMNS)
+    conn.execute(f"INSERT INTO battles ({columns}) SELECT {columns} FROM src.battles ORDER BY created_date, battle_id")
+
+    # Copiar cualquier otra tabla auxiliar de la temporada (y sus índices) tal cual
+    existing_tables = {row[0] for row in conn.execute("SELECT name FROM main.sqlite_master WHERE type = 'table'")}
+    aux_tables = conn.execute(
+        "SELECT name, sql FROM src.sqlite_master WHERE type = 'table' AND name != 'battles' AND name NOT LIKE 'sqlite_%'"
+    ).fetchall()
+    for table_name, table_sql in aux_tables:
+        if table_name not in existing_tables:
+            conn.execute(table_sql)
+        conn.execute(f'INSERT OR IGNORE INTO main."{table_name}" SELECT * FROM src."{table_name}"')
+
+    index_sqls = conn.execute(
+        "SELECT sql FROM src.sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+    ).fetchall()
+    conn.commit()
+    conn.execute("DETACH DATABASE src")
+
+    for (index_sql,) in index_sqls:
+        conn.execute(index_sql.replace('CREATE INDEX', 'CREATE INDEX IF NOT EXISTS', 1)
+                              .replace('CREATE UNIQUE INDEX', 'CREATE UNIQUE INDEX IF NOT EXISTS', 1))
+    for index_name, index_def in ARCHIVE_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {index_def}")
+    conn.execute("ANALYZE")
+    conn.commit()
+    return conn
+
+def remove_staged_files(tmp_path, gz_path):
+    for path in (tmp_path, f"{gz_path}.tmp"):
+        if os.path.exists(path):
+            os.remove(path)
+
+def archive_db_file(db_path, compress=False, dry_run=False):
+    """
+    Compacta un archivo de temporada/formato cerrado y lo reemplaza de forma atómica.
+    Retorna la entrada del manifiesto, o None si no se archivó.
+    """
+    key = database.get_archive_key(db_path)
+    staging_path = f"{db_path}.sorting"
+    tmp_path = f"{db_path}.archive.tmp"
+
+    source_conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        source_conn.execute("SELECT 1 FROM battles LIMIT 1")
+    except sqlite3.Error as e:
+        logging.warning(f"{key} no tiene una tabla 'battles' válida ({e}). Saltando.")
+        source_conn.close()
+        return None
+
+    # Volcar el WAL al archivo principal antes de copiar
+    source_conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    rows_before, max_rowid_before = get_source_watermark(source_conn)
+    original_size = os.path.getsize(db_path)
+    logging.info(f"Archivando {key}: {rows_before} batallas, {original_size / 1024 / 1024:.1f} MB.")
+
+    if dry_run:
+        source_conn.close()
+        return None
+
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    staging_conn = build_sorted_copy(db_path, staging_path)
+    staging_conn.execute("VACUUM INTO ?", (tmp_path,))
+    staging_conn.close()
+    os.remove(staging_path)
+
+    archive_conn = sqlite3.connect(tmp_path)
+    archive_conn.execute('PRAGMA journal_mode=DELETE')
+    check_result = archive_conn.execute('PRAGMA quick_check').fetchone()[0]
+    archived_rows = archive_conn.execute("SELECT COUNT(*) FROM battles").fetchone()[0]
+    archive_conn.close()
+
+    if check_result != 'ok' or archived_rows != rows_before:
+        logging.error(f"Verificación fallida para {key} (quick_check={check_result}, filas {archived_rows}/{rows_before}). Se conserva el original.")
+        os.remove(tmp_path)
+        source_conn.close()
+        return None
+
+    entry = {
+        'season_id': os.path.basename(os.path.dirname(db_path)),
+        'format': os.path.splitext(os.path.basename(db_path))[0],
+        'rows': archived_rows,
+        'original_size': original_size,
+        'size': os.path.getsize(tmp_path),
+        'sha256': database.file_sha256(tmp_path),
+        'archived_at': datetime.now(timezone.utc).isoformat(),
+        'compressed': compress,
+    }
+
+    gz_path = f"{db_path}.gz"
+    if compress: # La compresión se hace fuera del bloqueo
+        with open(tmp_path, 'rb') as src, gzip.open(f"{gz_path}.tmp", 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.chmod(f"{gz_path}.tmp", 0o444)
+
+    # Bloqueo de escritura sobre el original hasta terminar el reemplazo: ningún escritor
+    # (procesador, backfill) puede confirmar filas en el inodo que va a quedar huérfano.
+    # Los escritores comprueban el inodo tras obtener el bloqueo (write_destination_batch).
+    try:
+        source_conn.execute('BEGIN IMMEDIATE')
+    except sqlite3.OperationalError as e:
+        logging.warning(f"{key} tiene un escritor activo ({e}). Se reintentará en la próxima ejecución.")
+        remove_staged_files(tmp_path, gz_path)
+        source_conn.close()
+        return None
+
+    # Si llegaron batallas tardías mientras copiábamos, no reemplazamos nada
+    if get_source_watermark(source_conn) != (rows_before, max_rowid_before):
+        logging.warning(f"{key} recibió escrituras durante el archivado. Se reintentará en la próxima ejecución.")
+        remove_staged_files(tmp_path, gz_path)
+        source_conn.rollback()
+        source_conn.close()
+        return None
+
+    if compress:
+        os.replace(f"{gz_path}.tmp", gz_path)
+        os.remove(tmp_path)
+        os.remove(db_path)
+        entry['compressed_size'] = os.path.getsize(gz_path)
+    else:
+        os.chmod(tmp_path, 0o444) # Solo lectura: el archivo ya no debe cambiar
+        os.replace(tmp_path, db_path)
+    source_conn.rollback() # Libera el bloqueo: el original ya no es accesible por su ruta
+    source_conn.close()
+
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+    logging.info(f"{key} archivado: {entry['rows']} batallas, {entry['original_size'] / 1024 / 1024:.1f} MB -> {entry['size'] / 1024 / 1024:.1f} MB.")
+    return entry
+
+def restore_compressed(key):
+    """Descomprime un archivo archivado con --compress a su ubicación original."""
+    manifest = database.load_archive_manifest()
+    entry = manifest.get(key)
+    if not entry or not entry.get('compressed'):
+        logging.error(f"{key} no es un archivo comprimido del manifiesto.")
+        return False
+
+    db_path = os.path.join(database.STRUCTURED_BATTLES_ROOT, key)
+    with gzip.open(f"{db_path}.gz", 'rb') as src, open(f"{db_path}.archive.tmp", 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    if database.file_sha256(f"{db_path}.archive.tmp") != entry['sha256']:
+        logging.error(f"El checksum de {key} no coincide con el manifiesto. Abortando.")
+        os.remove(f"{db_path}.archive.tmp")
+        return False
+
+    os.chmod(f"{db_path}.archive.tmp", 0o444)
+    os.replace(f"{db_path}.archive.tmp", db_path)
+    os.remove(f"{db_path}.gz")
+    entry['compressed'] = False
+    database.save_archive_manifest(manifest)
+    logging.info(f"{key} restaurado.")
+    return True
+
+def archive_closed_seasons(grace_days=DEFAULT_GRACE_DAYS, season_id=None, compress=False, dry_run=False):
+    seasons_data = load_season_data()
+    if not seasons_data:
+        logging.error("No se pudieron cargar los datos de las temporadas. Abortando.")
+        return
+
+    closed_seasons = get_closed_seasons(seasons_data, grace_days)
+    if season_id is not None:
+        if season_id not in closed_seasons:
+            logging.error(f"La temporada {season_id} no ha cerrado (o está dentro del periodo de gracia de {grace_days} días).")
+            return
+        closed_seasons = [season_id]
+
+    manifest = database.load_archive_manifest()
+    archived_count = 0
+    for closed_season in sorted(closed_seasons):
+        season_folder = os.path.join(database.STRUCTURED_BATTLES_ROOT, str(closed_season))
+        for db_path in sorted(glob.glob(os.path.join(season_folder, '*.db'))):
+            if database.get_archive_key(db_path) in manifest:
+                continue
+            try:
+                entry = archive_db_file(db_path, compress=compress, dry_run=dry_run)
+            except sqlite3.Error as e:
+                logging.error(f"Error de SQLite al archivar {db_path}: {e}")
+                continue
+            if entry:
+                manifest[database.get_archive_key(db_path)] = entry
+                database.save_archive_manifest(manifest)
+                archived_count += 1
+
+    logging.info(f"Archivado completado. Archivos nuevos en el manifiesto: {archived_count}.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compacta las temporadas cerradas en archivos inmutables de solo lectura.")
+    parser.add_argument('--grace-days', type=int, default=DEFAULT_GRACE_DAYS, help="Días a esperar tras el fin de la temporada.")
+    parser.add_argument('--season', type=int, help="Archivar solo esta temporada.")
+    parser.add_argument('--compress', action='store_true', help="Guardar el archivo comprimido con gzip (almacenamiento en frío).")
+    parser.add_argument('--dry-run', action='store_true', help="Mostrar qué se archivaría sin modificar nada.")
+    parser.add_argument('--restore', metavar='TEMPORADA/FORMATO.db', help="Descomprimir un archivo archivado con --compress.")
+    args = parser.parse_args()
+
+    if args.restore:
+        restore_compressed(args.restore)
+    else:
+        archive_closed_seasons(args.grace_days, args.season, args.compress, args.dry_run)
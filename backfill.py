@@ -0,0 +1,419 @@
+import os
+import json
+import hashlib
+import time
+import logging
+import argparse
+from datetime import datetime, timezone, timedelta
+
+# Importamos nuestros módulos
+import database
+import metrics
+import profiling
+from federated_query import parse_season_range, parse_formats
+from process_raw_battles import (
+    load_season_data, build_structured_row, write_destination_batch, extract_card_usage, EXTRACT_CARD_USAGE
+)
+
+# --- Configuración de Logging ---
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler() # Log to console
+    ]
+)
+
+# Carga masiva de historiales para una temporada/formato recién seguidos o tras una
+# caída del crawler más larga que la ventana de 50 batallas de un jugador activo.
+# Consulta el API a una tasa acotada (el crawler sigue corriendo en paralelo), escribe
+# directamente en las bases de datos de temporada en lotes grandes sin pasar por
+# raw_battles.db, deduplica con processed_battles y guarda un checkpoint tras cada
+# lote para poder reanudar.
+
+# --- Configuración ---
+DEFAULT_CHECKPOINT_FILE = os.path.join(database.DB_FOLDER, "backfill_checkpoint.json")
+# Peticiones por segundo al API. El crawler usa ~1-2 req/s; el backfill toma una fracción.
+DEFAULT_MAX_RPS = float(os.getenv("BACKFILL_MAX_RPS", "0.5"))
+DEFAULT_BATCH_ROWS = 20000 # Filas acumuladas antes de escribir (una transacción por destino)
+DEFAULT_PROGRESS_EVERY = 25 # Jugadores entre dos reportes de progreso
+DEFAULT_RETRY_PASSES = 2 # Pasadas extra sobre los jugadores cuyo historial falló
+RETRY_PASS_DELAY_SECONDS = 30
+
+# --- Métricas ---
+BACKFILL_PLAYERS = metrics.counter('backfill_players_total', 'Jugadores cuyo historial se cargó.')
+BACKFILL_BATTLES = metrics.counter('backfill_battles_total', 'Batallas del backfill por resultado.', ['result'])
+BACKFILL_FLUSH_SECONDS = metrics.histogram('backfill_flush_seconds', 'Duración de la escritura de un lote del backfill.')
+BACKFILL_FETCH_FAILURES = metrics.counter('backfill_fetch_failures_total', 'Historiales que no se pudieron obtener (el jugador queda pendiente).')
+BACKFILL_PENDING_PLAYERS = metrics.gauge('backfill_pending_players', 'Jugadores pendientes en el checkpoint.')
+
+class RateLimiter:
+    """Token bucket: como máximo `rate` peticiones por segundo, con ráfagas de `burst`."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            time.sleep((1 - self.tokens) / self.rate)
+            self.last = time.monotonic()
+            self.tokens = 1
+        self.tokens -= 1
+
+# --- Checkpoint ---
+
+def load_checkpoint(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError as e:
+        raise ValueError(f"El checkpoint {path} está corrupto: {e}") from e
+
+def save_checkpoint(path, checkpoint):
+    """Escribe el checkpoint de forma atómica (tmp + rename)."""
+    checkpoint['updated_at'] = datetime.now(timezone.utc).isoformat()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def players_digest(players):
+    """Huella del conjunto de jugadores, para detectar un --players/--players-file distinto al reanudar."""
+    return hashlib.sha256('\n'.join(sorted(players)).encode('utf-8')).hexdigest()
+
+def new_checkpoint(players, season_range, formats, tiers=None):
+    """
+    `tiers` (solo si los jugadores salen de players.db) forma parte del alcance: el
+    crawler cambia activity_tier constantemente, así que al reanudar se comparan los
+    niveles pedidos y no la consulta, que ya devolvería otros jugadores.
+    """
+    return {
+        'scope': {
+            'seasons': list(season_range) if season_range else None,
+            'formats': sorted(formats) if formats else None,
+            'tiers': sorted(tiers) if tiers else None,
+        },
+        'players_digest': players_digest(players),
+        'pending': players,
+        'total_players': len(players),
+        'stats': {'fetched': 0, 'written': 0, 'duplicate': 0, 'out_of_scope': 0, 'archived': 0, 'skipped': 0},
+        'started_at': datetime.now(timezone.utc).isoformat(),
+    }
+
+def resume_mismatch(checkpoint, season_range, formats, tiers=None, requested_players=None):
+    """
+    Motivo por el que el checkpoint no corresponde a los argumentos al reanudar, o None.
+    Sin --tiers se reanuda con los niveles del checkpoint; una lista explícita de
+    jugadores se compara por su huella (reanudar usa los pendientes del checkpoint,
+    así que una lista distinta se ignoraría en silencio).
+    """
+    scope = new_checkpoint([], season_range, formats, tiers or checkpoint['scope'].get('tiers'))['scope']
+    if {key: checkpoint['scope'].get(key) for key in scope} != scope:
+        return f"El checkpoint es de otro alcance ({checkpoint['scope']}). Usar --reset o otro --checkpoint."
+    if requested_players is not None and players_digest(requested_players) != checkpoint.get('players_digest'):
+        return (f"Los jugadores indicados no coinciden con los del checkpoint ({checkpoint['total_players']} jugadores). "
+                "Omitir --players/--players-file para reanudar, o usar --reset.")
+    return None
+
+# --- Jugadores ---
+
+def load_players(players=None, players_file=None, tiers=None):
+    """
+    Conjunto de jugadores del backfill: lista explícita, archivo (uno por línea) o,
+    si no se indica ninguno, players.db filtrado por nivel de actividad.
+    """
+    names = []
+    if players:
+        names.extend(p.strip() for p in players.split(','))
+    if players_file:
+        with open(players_file, 'r') as f:
+            names.extend(line.strip() for line in f)
+    if not players and not players_file:
+        conn = database.get_players_db_connection()
+        try:
+            database.initialize_players_table(conn)
+            query = "SELECT player_name FROM players"
+            params = []
+            if tiers:
+                query += f" WHERE activity_tier IN ({', '.join('?' for _ in tiers)})"
+                params = list(tiers)
+            # Los más atrasados primero: son los que más batallas pueden haber perdido
+            query += " ORDER BY last_scanned_timestamp"
+            names = [row[0] for row in conn.execute(query, params)]
+        finally:
+            conn.close()
+    return list(dict.fromkeys(name for name in names if name)) # Sin duplicados, conservando el orden
+
+# --- Lógica Principal del Backfill ---
+
+class Backfill:
+    """
+    Acumula las filas por destino (temporada, formato) y las escribe cuando el búfer
+    supera batch_rows. El checkpoint solo avanza después de confirmar las bases de
+    datos de temporada y el índice, así que una interrupción repite como mucho el
+    último lote, y el índice hace que la repetición no duplique nada.
+    """
+
+    def __init__(self, checkpoint, checkpoint_path, seasons_data, season_range, formats,
+                 batch_rows=DEFAULT_BATCH_ROWS, card_usage=EXTRACT_CARD_USAGE):
+        self.checkpoint = checkpoint
+        self.checkpoint_path = checkpoint_path
+        self.stats = checkpoint['stats']
+        self.seasons_data = seasons_data
+        self.season_range = season_range
+        self.formats = formats
+        self.batch_rows = batch_rows
+        self.card_usage = card_usage
+        self.archive_manifest = database.load_archive_manifest()
+        self.index_conn = database.get_battle_index_connection()
+        self.rows_by_destination = {}
+        self.card_usage_by_destination = {}
+        self.buffered_ids = set()
+        self.buffered_rows = 0
+        self.players_done = set() # Jugadores de 'pending' ya leídos pero aún sin confirmar
+
+    def in_scope(self, season_id, final_format):
+        if self.season_range and not self.season_range[0] <= season_id <= self.season_range[1]:
+            return False
+        return not self.formats or final_format in self.formats
+
+    def add_battles(self, battles):
+        """Filtra las batallas de un jugador y las añade al búfer. Retorna cuántas se añadieron."""
+        self.stats['fetched'] += len(battles)
+        candidates = {}
+        for battle in battles:
+            battle_id = battle.get('battle_queue_id_1')
+            if not battle_id:
+                self.stats['skipped'] += 1
+                continue
+            if battle_id in self.buffered_ids or battle_id in candidates:
+                self.stats['duplicate'] += 1 # Batalla entre dos jugadores del mismo lote
+                continue
+            candidates[battle_id] = battle
+        known = database.get_processed_battle_ids(self.index_conn, list(candidates))
+        self.stats['duplicate'] += len(known)
+
+        added = 0
+        for battle_id, battle in candidates.items():
+            if battle_id in known:
+                continue
+            destination = build_structured_row(battle_id, battle, self.seasons_data)
+            if destination is None:
+                self.stats['skipped'] += 1
+                continue
+            season_id, final_format, row = destination
+            if not self.in_scope(season_id, final_format):
+                self.stats['out_of_scope'] += 1 # El crawler la recogerá por la vía normal
+                continue
+            if database.get_archive_key(database.get_structured_db_path(season_id, final_format)) in self.archive_manifest:
+                self.stats['archived'] += 1 # Archivo inmutable
+                continue
+            db_key = (season_id, final_format)
+            self.rows_by_destination.setdefault(db_key, []).append(row)
+            if self.card_usage:
+                self.card_usage_by_destination.setdefault(db_key, []).extend(extract_card_usage(battle_id, battle))
+            self.buffered_ids.add(battle_id)
+            added += 1
+        self.buffered_rows += added
+        return added
+
+    def player_done(self, player):
+        self.players_done.add(player)
+        BACKFILL_PLAYERS.inc()
+        if self.buffered_rows >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        """Escribe el búfer (una transacción por destino), el índice y el checkpoint."""
+        with BACKFILL_FLUSH_SECONDS.time():
+            for (season_id, final_format), rows in self.rows_by_destination.items():
+                new_rows = write_destination_batch(season_id, final_format, rows,
+                                                   self.card_usage_by_destination.get((season_id, final_format)))
+                self.stats['written'] += new_rows
+                self.stats['duplicate'] += len(rows) - new_rows # Ya estaban en el archivo pero no en el índice
+                BACKFILL_BATTLES.inc(new_rows, result='written')
+            if self.buffered_ids:
+                changes_before = self.index_conn.total_changes
+                self.index_conn.executemany("INSERT OR IGNORE INTO processed_battles (battle_id) VALUES (?)",
+                                            [(battle_id,) for battle_id in self.buffered_ids])
+                database.timed_commit(self.index_conn, 'battle_index')
+                database.DB_ROWS_WRITTEN.inc(self.index_conn.total_changes - changes_before, db='battle_index')
+
+            self.checkpoint['pending'] = [player for player in self.checkpoint['pending'] if player not in self.players_done]
+            save_checkpoint(self.checkpoint_path, self.checkpoint)
+        if self.buffered_rows:
+            logging.info(f"Lote de backfill escrito: {self.buffered_rows} batallas en {len(self.rows_by_destination)} destinos.")
+        BACKFILL_PENDING_PLAYERS.set(len(self.checkpoint['pending']))
+        self.rows_by_destination = {}
+        self.card_usage_by_destination = {}
+        self.buffered_ids = set()
+        self.buffered_rows = 0
+        self.players_done = set()
+
+    def close(self):
+        self.index_conn.close()
+
+def format_eta(seconds):
+    return '-' if seconds is None else str(timedelta(seconds=int(seconds)))
+
+def log_progress(backfill, done_this_run, started):
+    checkpoint = backfill.checkpoint
+    total = checkpoint['total_players']
+    remaining = len(checkpoint['pending']) - len(backfill.players_done)
+    done = total - remaining
+    elapsed = time.monotonic() - started
+    rate = done_this_run / elapsed if elapsed > 0 else 0
+    eta = remaining / rate if rate > 0 else None
+    stats = backfill.stats
+    logging.info(
+        f"Backfill: {done}/{total} jugadores ({100.0 * done / total if total else 100:.1f}%), "
+        f"{stats['written']} batallas escritas (+{backfill.buffered_rows} en búfer), {stats['duplicate']} duplicadas, "
+        f"{stats['out_of_scope']} fuera de alcance, {rate:.2f} jugadores/s, ETA {format_eta(eta)}."
+    )
+
+def fetch_history(main, player, credentials):
+    """Historial del jugador; re-login si el token fue rechazado. Lanza main.BattleHistoryError si falla."""
+    try:
+        return main.get_player_battle_history(player, credentials['user'], credentials['token'], raise_on_failure=True)
+    except main.AuthenticationError as e:
+        logging.warning(f"{e} Iniciando sesión de nuevo.")
+        main.invalidate_cached_token()
+        credentials['user'], credentials['token'] = main.get_auth_token(
+            credentials['username'], credentials['posting_key'], force_login=True
+        )
+        if not credentials['user'] or not credentials['token']:
+            raise Exception("No se pudo volver a iniciar sesión. Abortando.")
+        return main.get_player_battle_history(player, credentials['user'], credentials['token'], raise_on_failure=True)
+
+def run_backfill(checkpoint, checkpoint_path, season_range, formats, max_rps=DEFAULT_MAX_RPS,
+                 batch_rows=DEFAULT_BATCH_ROWS, progress_every=DEFAULT_PROGRESS_EVERY, card_usage=EXTRACT_CARD_USAGE,
+                 retry_passes=DEFAULT_RETRY_PASSES):
+    import main # Import diferido: trae la configuración del API y el login solo al ejecutar
+
+    seasons_data = load_season_data()
+    if not seasons_data:
+        raise Exception("No se pudieron cargar los datos de las temporadas. Abortando.")
+
+    credentials = {'username': os.getenv("HIVE_USERNAME"), 'posting_key': os.getenv("HIVE_POSTING_KEY")}
+    if not credentials['username'] or not credentials['posting_key']:
+        raise Exception("Las variables de entorno HIVE_USERNAME y HIVE_POSTING_KEY no están definidas.")
+    credentials['user'], credentials['token'] = main.get_auth_token(credentials['username'], credentials['posting_key'])
+    if not credentials['user'] or not credentials['token']:
+        raise Exception("No se pudo iniciar sesión. Abortando.")
+
+    backfill = Backfill(checkpoint, checkpoint_path, seasons_data, season_range, formats, batch_rows, card_usage)
+    limiter = RateLimiter(max_rps)
+    stats_at_start = dict(checkpoint['stats']) # El checkpoint acumula entre ejecuciones; las métricas no
+    players = list(checkpoint['pending'])
+    BACKFILL_PENDING_PLAYERS.set(len(players))
+    logging.info(f"Backfill de {len(players)} jugadores pendientes (de {checkpoint['total_players']}) a {max_rps} req/s, "
+                 f"temporadas {season_range or 'todas'}, formatos {sorted(formats) if formats else 'todos'}.")
+    started = time.monotonic()
+    done_this_run = 0
+    failed = []
+    interrupted = False
+    try:
+        try:
+            for attempt in range(retry_passes + 1):
+                if attempt:
+                    logging.warning(f"Reintentando {len(players)} jugadores cuyo historial falló (pasada {attempt}/{retry_passes}) "
+                                    f"en {RETRY_PASS_DELAY_SECONDS} s...")
+                    time.sleep(RETRY_PASS_DELAY_SECONDS)
+                failed = []
+                for player in players:
+                    limiter.acquire()
+                    try:
+                        battles = fetch_history(main, player, credentials)
+                    except main.BattleHistoryError as e:
+                        # El jugador sigue pendiente en el checkpoint: un error transitorio no pierde su historial
+                        logging.warning(f"{e} Se reintentará.")
+                        BACKFILL_FETCH_FAILURES.inc()
+                        failed.append(player)
+                        continue
+                    backfill.add_battles(battles)
+                    backfill.player_done(player)
+                    done_this_run += 1
+                    if done_this_run % progress_every == 0:
+                        log_progress(backfill, done_this_run, started)
+                players = failed
+                if not players:
+                    break
+        except KeyboardInterrupt:
+            logging.info("Backfill interrumpido. Guardando lo acumulado para reanudar...")
+            interrupted = True
+        except BaseException:
+            # Error de login, de la API o de escritura: se guarda lo ya leído y se propaga el error original
+            try:
+                backfill.flush()
+            except Exception:
+                logging.exception("No se pudo escribir el último lote del backfill. Sus jugadores siguen pendientes en el checkpoint.")
+            raise
+        backfill.flush() # Fin normal o Ctrl-C: si falla, el error se propaga y el checkpoint no se marca completado
+    finally:
+        for result in ('duplicate', 'out_of_scope', 'archived', 'skipped'):
+            BACKFILL_BATTLES.inc(backfill.stats[result] - stats_at_start[result], result=result)
+        backfill.close()
+
+    log_progress(backfill, done_this_run, started)
+    if interrupted:
+        return backfill.stats
+    if checkpoint['pending']:
+        logging.warning(f"Backfill terminado con {len(checkpoint['pending'])} jugadores sin historial (siguen pendientes; volver a ejecutar para reanudar).")
+    else:
+        checkpoint['completed_at'] = datetime.now(timezone.utc).isoformat()
+        save_checkpoint(checkpoint_path, checkpoint)
+        logging.info(f"Backfill completado: {json.dumps(backfill.stats)}")
+    return backfill.stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Carga masiva de historiales directamente en las bases de datos de temporada.")
+    parser.add_argument('--seasons', help="Rango de temporadas a cargar, p. ej. '150-160' o '162'. Por defecto todas.")
+    parser.add_argument('--formats', help="Formatos a cargar separados por comas, p. ej. 'wild,modern'. Por defecto todos.")
+    parser.add_argument('--players', help="Jugadores separados por comas.")
+    parser.add_argument('--players-file', help="Archivo con un jugador por línea.")
+    parser.add_argument('--tiers', help="Sin --players/--players-file: niveles de actividad de players.db, p. ej. 'saturated,active'.")
+    parser.add_argument('--max-rps', type=float, default=DEFAULT_MAX_RPS,
+                        help="Peticiones por segundo al API (parte de la capacidad que se cede al backfill).")
+    parser.add_argument('--batch-rows', type=int, default=DEFAULT_BATCH_ROWS, help="Filas acumuladas antes de escribir un lote.")
+    parser.add_argument('--progress-every', type=int, default=DEFAULT_PROGRESS_EVERY, help="Jugadores entre reportes de progreso.")
+    parser.add_argument('--retry-passes', type=int, default=DEFAULT_RETRY_PASSES,
+                        help="Pasadas extra sobre los jugadores cuyo historial falló antes de terminar.")
+    parser.add_argument('--card-usage', action='store_true', default=EXTRACT_CARD_USAGE, help="Extraer también el uso de cartas.")
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT_FILE, help="Archivo de checkpoint para reanudar.")
+    parser.add_argument('--reset', action='store_true', help="Descartar el checkpoint existente y empezar de nuevo.")
+    args = parser.parse_args()
+
+    season_range = parse_season_range(args.seasons)
+    formats = parse_formats(args.formats)
+    explicit_players = bool(args.players or args.players_file)
+    tiers = [t.strip() for t in args.tiers.split(',')] if args.tiers and not explicit_players else None
+    checkpoint = None if args.reset else load_checkpoint(args.checkpoint)
+    if checkpoint:
+        requested = load_players(args.players, args.players_file) if explicit_players else None
+        error = resume_mismatch(checkpoint, season_range, formats, tiers, requested)
+        if error:
+            logging.error(f"{error} Checkpoint: {args.checkpoint}.")
+            exit(1)
+        logging.info(f"Reanudando desde {args.checkpoint}: {len(checkpoint['pending'])} jugadores pendientes.")
+    else:
+        checkpoint = new_checkpoint(load_players(args.players, args.players_file, tiers), season_range, formats, tiers)
+        save_checkpoint(args.checkpoint, checkpoint)
+
+    metrics_snapshot_path = metrics.start_from_env('backfill')
+    profiling.install('backfill')
+    try:
+        run_backfill(checkpoint, args.checkpoint, season_range, formats, args.max_rps,
+                     args.batch_rows, args.progress_every, args.card_usage, args.retry_passes)
+    finally:
+        if metrics_snapshot_path:
+            metrics.write_snapshot(metrics_snapshot_path)
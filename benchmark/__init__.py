@@ -0,0 +1,5 @@
+"""
+Suite de benchmarks del monitor: generador de batallas sintéticas, API simulado
+de Splinterlands y escenarios que miden la ingesta, el procesamiento, el índice y
+la deduplicación. Uso: python -m benchmark --help
+"""
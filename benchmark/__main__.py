@@ -0,0 +1,93 @@
+import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+
+# Solo consola y a partir de WARNING: los módulos que importan los escenarios
+# registran cada lote en INFO, lo que taparía el informe.
+logging.basicConfig(
+    level=logging.WARNING,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler() # Log to console
+    ]
+)
+
+# Permite ejecutar "python -m benchmark" desde la raíz del proyecto
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from benchmark.scenarios import SCENARIOS, run_suite, compare_reports
+from benchmark.stub_api import StubApiConfig
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description="Benchmarks de ingesta y procesamiento.")
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help="Ejecutar los escenarios (por defecto).")
+    run_parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Lista separada por coma de: {', '.join(SCENARIOS)}.")
+    run_parser.add_argument('--output', help="Guardar el reporte JSON en este archivo.")
+    run_parser.add_argument('--workdir', help="Directorio de trabajo (por defecto uno temporal que se borra al terminar).")
+    run_parser.add_argument('--battles', type=int, default=20000, help="Batallas sintéticas para process_raw.")
+    run_parser.add_argument('--extract-card-usage', action='store_true', help="Activar card_usage en process_raw.")
+    run_parser.add_argument('--dedup-sample', type=int, default=5000)
+    run_parser.add_argument('--structured-sample', type=int, default=200)
+    run_parser.add_argument('--player-scans', type=int, default=300)
+    run_parser.add_argument('--distinct-players', type=int, default=100)
+    run_parser.add_argument('--latency-ms', type=float, default=50.0)
+    run_parser.add_argument('--latency-jitter-ms', type=float, default=20.0)
+    run_parser.add_argument('--rate-limit-rps', type=float, default=0.0, help="Capacidad del API simulado (0 = sin límite).")
+    run_parser.add_argument('--rate-limit-429-prob', type=float, default=0.0, help="Probabilidad de 429 aleatorio.")
+    run_parser.add_argument('--retry-after', type=int, default=1)
+
+    compare_parser = subparsers.add_parser('compare', help="Comparar dos reportes JSON.")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+
+    args = parser.parse_args(sys.argv[1:] or ['run'])
+    if args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.candidate) as f:
+            candidate = json.load(f)
+        rows = compare_reports(baseline, candidate)
+        json.dump(rows, sys.stdout, indent=2)
+        print()
+        return
+
+    stub_config = StubApiConfig(
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        rate_limit_rps=args.rate_limit_rps,
+        rate_limit_429_prob=args.rate_limit_429_prob,
+        retry_after=args.retry_after,
+    )
+    workdir = args.workdir or tempfile.mkdtemp(prefix='splinterlands-bench-')
+    try:
+        report = run_suite(
+            workdir,
+            scenarios=[s.strip() for s in args.scenarios.split(',') if s.strip()],
+            battles=args.battles,
+            dedup_sample=args.dedup_sample,
+            structured_sample=args.structured_sample,
+            player_scans=args.player_scans,
+            distinct_players=args.distinct_players,
+            stub_config=stub_config,
+            extract_card_usage=args.extract_card_usage,
+        )
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    main()
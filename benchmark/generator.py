@@ -0,0 +1,171 @@
+import json
+import random
+import hashlib
+from datetime import datetime, timezone, timedelta
+
+# Reparto aproximado de tipos de partida observado en /battle/history:
+# (match_type, format, peso). determine_battle_format los convierte en
+# modern, wild, brawl, tournament y challenge.
+MATCH_MIX = (
+    ('Ranked', 'modern', 45),
+    ('Ranked', 'wild', 20),
+    ('Ranked', None, 10),       # Ranked sin formato -> wild
+    ('Tournament', None, 6),    # tournament
+    ('Tournament', 'BRAWL', 4), # tournament_id con BRAWL -> brawl
+    ('Challenge', None, 5),     # challenge
+    ('Practice', None, 10),     # practice
+)
+MANA_CAPS = (13, 15, 17, 19, 21, 23, 25, 27, 29, 31, 35, 40, 45, 50, 60, 99)
+RULESETS = (
+    'Standard', 'Little League', 'Silenced Summoners', 'Back to Basics', 'Earthquake',
+    'Up Close & Personal', 'Broken Arrows', 'Taking Sides', 'Even Stevens', 'Odd Ones Out',
+)
+COLORS = ('Red', 'Blue', 'Green', 'White', 'Black', 'Gold')
+SEASON_LENGTH = timedelta(days=14)
+
+def generate_seasons(count=6, current_season_id=160, now=None):
+    """
+    Genera datos de temporada con la forma de seasons_data.json. La última temporada
+    termina en el futuro (temporada actual), como al llamar a get_all_seasons.py.
+    """
+    now = now or datetime.now(timezone.utc)
+    current_end = now + SEASON_LENGTH / 2
+    seasons = []
+    for offset in range(count - 1, -1, -1):
+        ends = current_end - SEASON_LENGTH * offset
+        seasons.append({
+            'id': current_season_id - offset,
+            'name': f"Splinterlands Season {current_season_id - offset}",
+            'ends': ends.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'reset_block_num': None,
+        })
+    return seasons
+
+def _season_bounds(seasons):
+    bounds = []
+    for i, season in enumerate(seasons):
+        end = datetime.fromisoformat(season['ends'].replace('Z', '+00:00'))
+        start = end - SEASON_LENGTH if i == 0 else datetime.fromisoformat(seasons[i - 1]['ends'].replace('Z', '+00:00'))
+        bounds.append((start, end))
+    return bounds
+
+class BattleGenerator:
+    """
+    Genera batallas sintéticas con la forma de /battle/history. Es determinista
+    para una misma semilla, y reparte las batallas entre temporadas (con más peso
+    en las recientes) y entre los formatos que maneja determine_battle_format.
+    """
+
+    def __init__(self, seasons, player_count=5000, seed=42, recent_season_weight=3.0):
+        self.seasons = seasons
+        self.random = random.Random(seed)
+        self.players = [f"bench_player_{i:06d}" for i in range(player_count)]
+        # Actividad tipo Zipf: pocos jugadores acumulan la mayoría de las batallas
+        self.player_weights = [1.0 / (i + 1) ** 0.8 for i in range(player_count)]
+        self.season_bounds = _season_bounds(seasons)
+        self.season_weights = [recent_season_weight ** i for i in range(len(seasons))]
+        self.ratings = {}
+        self.sequence = 0
+
+    def _battle_id(self):
+        self.sequence += 1
+        return 'sl_' + hashlib.md5(f"bench-{self.sequence}-{self.random.random()}".encode()).hexdigest()
+
+    def _pick_player(self, exclude=None):
+        player = self.random.choices(self.players, weights=self.player_weights)[0]
+        while player == exclude:
+            player = self.random.choice(self.players)
+        return player
+
+    def _team(self, player, rating, size):
+        return {
+            'player': player,
+            'rating': rating,
+            'color': self.random.choice(COLORS),
+            'summoner': {'uid': f"starter-{self.random.randint(1, 400)}", 'card_detail_id': self.random.randint(1, 400),
+                         'level': self.random.randint(1, 10), 'gold': False, 'edition': 7},
+            'monsters': [
+                {'uid': f"starter-{self.random.randint(1, 400)}", 'card_detail_id': self.random.randint(1, 400),
+                 'level': self.random.randint(1, 10), 'gold': False, 'edition': 7}
+                for _ in range(size)
+            ],
+        }
+
+    def random_date(self, season_index=None):
+        if season_index is None:
+            season_index = self.random.choices(range(len(self.seasons)), weights=self.season_weights)[0]
+        start, end = self.season_bounds[season_index]
+        end = min(end, datetime.now(timezone.utc))
+        moment = start + (end - start) * self.random.random()
+        return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f"{moment.microsecond // 1000:03d}Z"
+
+    def battle(self, player_1=None, player_2=None, created_date=None):
+        player_1 = player_1 or self._pick_player(exclude=player_2)
+        player_2 = player_2 or self._pick_player(exclude=player_1)
+        match_type, game_format, _ = self.random.choices(MATCH_MIX, weights=[m[2] for m in MATCH_MIX])[0]
+
+        settings = {'rating_level': self.random.randint(0, 4), 'allowed_cards': {'foil': 'all', 'type': 'all'}}
+        if match_type == 'Tournament':
+            prefix = 'BRAWL' if game_format == 'BRAWL' else 'TRN'
+            settings['tournament_id'] = f"{prefix}-{self.random.randint(1000, 9999)}"
+            game_format = None
+
+        rating_1 = self.ratings.get(player_1, self.random.randint(400, 4000))
+        rating_2 = self.ratings.get(player_2, self.random.randint(400, 4000))
+        winner, loser = (player_1, player_2) if self.random.random() < 0.5 else (player_2, player_1)
+        delta = self.random.randint(5, 40)
+        final_1 = rating_1 + (delta if winner == player_1 else -delta)
+        final_2 = rating_2 + (delta if winner == player_2 else -delta)
+        self.ratings[player_1], self.ratings[player_2] = final_1, final_2
+
+        team_size = self.random.randint(3, 6)
+        ruleset = self.random.choice(RULESETS)
+        if ruleset != 'Standard' and self.random.random() < 0.4:
+            ruleset = f"{ruleset}|{self.random.choice(RULESETS[1:])}"
+
+        return {
+            'battle_queue_id_1': self._battle_id(),
+            'battle_queue_id_2': self._battle_id(),
+            'player_1_rating_initial': rating_1,
+            'player_2_rating_initial': rating_2,
+            'winner': winner,
+            'loser': loser,
+            'player_1_rating_final': final_1,
+            'player_2_rating_final': final_2,
+            'details': json.dumps({
+                'seed': hashlib.md5(str(self.sequence).encode()).hexdigest(),
+                'rounds': [],
+                'team1': self._team(player_1, rating_1, team_size),
+                'team2': self._team(player_2, rating_2, team_size),
+                'winner': winner,
+                'loser': loser,
+            }),
+            'player_1': player_1,
+            'player_2': player_2,
+            'created_date': created_date or self.random_date(),
+            'match_type': match_type,
+            'mana_cap': self.random.choice(MANA_CAPS),
+            'current_streak': self.random.randint(0, 10),
+            'ruleset': ruleset,
+            'inactive': '',
+            'settings': json.dumps(settings),
+            'block_num': self.random.randint(80_000_000, 95_000_000),
+            'rshares': self.random.randint(0, 10_000),
+            'dec_info': json.dumps({'reward': round(self.random.random() * 2, 3), 'glints': self.random.randint(0, 50)}),
+            'leaderboard': 0,
+            'reward_dec': '0.000',
+            'reward_sps': '0.000',
+            'format': game_format,
+        }
+
+    def battles(self, count):
+        return [self.battle() for _ in range(count)]
+
+    def player_history(self, player, count=50):
+        """Últimas `count` batallas de un jugador, de la más reciente a la más antigua."""
+        history = [
+            self.battle(player_1=player) if self.random.random() < 0.5 else self.battle(player_2=player)
+            for _ in range(count)
+        ]
+        history.sort(key=lambda b: b['created_date'], reverse=True)
+        return history
@@ -0,0 +1,279 @@
+import os
+import sys
+import glob
+import json
+import time
+import random
+import sqlite3
+import logging
+import platform
+from datetime import datetime, timezone
+
+import database
+import create_battle_index
+import process_raw_battles
+
+from benchmark.generator import BattleGenerator, generate_seasons
+from benchmark.stub_api import StubApiServer, StubApiConfig
+
+RAW_INSERT_CHUNK = 50 # Igual que una respuesta de /battle/history
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+def summarize_latencies(samples_seconds):
+    """Resumen en milisegundos: p50, p95, p99, media y máximo."""
+    samples = sorted(s * 1000.0 for s in samples_seconds)
+    if not samples:
+        return {}
+    return {
+        'count': len(samples),
+        'p50': round(percentile(samples, 0.50), 3),
+        'p95': round(percentile(samples, 0.95), 3),
+        'p99': round(percentile(samples, 0.99), 3),
+        'mean': round(sum(samples) / len(samples), 3),
+        'max': round(samples[-1], 3),
+    }
+
+def scenario_result(items, seconds, latencies=None, **extra):
+    result = {
+        'status': 'ok',
+        'items': items,
+        'seconds': round(seconds, 4),
+        'throughput_per_s': round(items / seconds, 2) if seconds > 0 else None,
+    }
+    if latencies is not None:
+        result['latency_ms'] = summarize_latencies(latencies)
+    result.update(extra)
+    return result
+
+def configure_workspace(root, seasons):
+    """
+    Redirige las rutas de database, process_raw_battles y create_battle_index a un
+    directorio temporal, para no tocar nunca los datos de producción.
+    """
+    data_folder = os.path.join(root, 'data')
+    season_root = os.path.join(root, 'Season')
+    os.makedirs(data_folder, exist_ok=True)
+    os.makedirs(season_root, exist_ok=True)
+
+    database.DB_FOLDER = data_folder
+    database.PLAYERS_DB = os.path.join(data_folder, 'players.db')
+    database.RAW_BATTLES_DB = os.path.join(data_folder, 'raw_battles.db')
+    database.STRUCTURED_BATTLES_ROOT = season_root
+    database.STRUCTURED_BATTLES_DB_PATTERN = os.path.join(season_root, '*', '*.db')
+    database.ARCHIVE_MANIFEST_FILE = os.path.join(season_root, 'archive_manifest.json')
+
+    process_raw_battles.DB_FOLDER = data_folder
+    process_raw_battles.RAW_BATTLES_DB = database.RAW_BATTLES_DB
+    process_raw_battles.SEASONS_DATA_FILE = os.path.join(root, 'seasons_data.json')
+
+    create_battle_index.DB_FOLDER = data_folder
+    create_battle_index.BATTLE_INDEX_DB = os.path.join(data_folder, 'battle_index.db')
+    create_battle_index.STRUCTURED_BATTLES_ROOT = season_root
+    create_battle_index.STRUCTURED_DB_PATTERN = database.STRUCTURED_BATTLES_DB_PATTERN
+
+    with open(process_raw_battles.SEASONS_DATA_FILE, 'w') as f:
+        json.dump(seasons, f, indent=2)
+
+    # process_raw_battles espera que el índice ya exista
+    create_battle_index.create_index_db_and_table().close()
+    raw_conn = database.get_raw_battles_db_connection()
+    database.initialize_raw_battles_table(raw_conn)
+    raw_conn.close()
+    players_conn = database.get_players_db_connection()
+    database.initialize_players_table(players_conn)
+    players_conn.close()
+
+# --- Escenarios ---
+
+def run_process_raw(seasons, battle_count, extract_card_usage=False, seed=42):
+    """Llena raw_battles.db con batallas sintéticas y mide process_raw_battles()."""
+    generator = BattleGenerator(seasons, seed=seed)
+    raw_conn = database.get_raw_battles_db_connection()
+    insert_latencies = []
+    for start in range(0, battle_count, RAW_INSERT_CHUNK):
+        batch = generator.battles(min(RAW_INSERT_CHUNK, battle_count - start))
+        t0 = time.perf_counter()
+        database.insert_raw_battles_batch(raw_conn, batch)
+        insert_latencies.append(time.perf_counter() - t0)
+    raw_conn.close()
+
+    t0 = time.perf_counter()
+    process_raw_battles.process_raw_battles(extract_card_usage)
+    elapsed = time.perf_counter() - t0
+
+    return scenario_result(
+        battle_count, elapsed,
+        raw_insert_batch_latency_ms=summarize_latencies(insert_latencies),
+        destinations=len(database_files()),
+        extract_card_usage=extract_card_usage,
+    )
+
+def database_files():
+    return glob.glob(database.STRUCTURED_BATTLES_DB_PATTERN)
+
+def run_create_index():
+    """Reconstruye battle_index.db desde las bases de datos de temporada."""
+    t0 = time.perf_counter()
+    create_battle_index.main()
+    elapsed = time.perf_counter() - t0
+    conn = sqlite3.connect(create_battle_index.BATTLE_INDEX_DB)
+    total = conn.execute("SELECT COUNT(*) FROM processed_battles").fetchone()[0]
+    conn.close()
+    return scenario_result(total, elapsed, files=len(database_files()))
+
+def run_dedup(sample_size, structured_sample_size, seed=42):
+    """
+    Mide las dos rutas de deduplicación: el índice centralizado (rápida) y el
+    recorrido de todas las bases de datos de temporada (lenta).
+    """
+    rng = random.Random(seed)
+    index_conn = database.get_battle_index_connection()
+    known_ids = [row[0] for row in index_conn.execute("SELECT battle_id FROM processed_battles LIMIT ?", (sample_size,))]
+    if not known_ids:
+        index_conn.close()
+        return {'status': 'skipped', 'reason': 'El índice está vacío (ejecutar process_raw antes).'}
+    sample = [rng.choice(known_ids) if rng.random() < 0.5 else f"sl_missing_{i}" for i in range(sample_size)]
+
+    index_latencies = []
+    hits = 0
+    t0 = time.perf_counter()
+    for battle_id in sample:
+        t1 = time.perf_counter()
+        hits += database.battle_exists_in_index(index_conn, battle_id)
+        index_latencies.append(time.perf_counter() - t1)
+    index_elapsed = time.perf_counter() - t0
+    index_conn.close()
+
+    structured_latencies = []
+    t0 = time.perf_counter()
+    for battle_id in sample[:structured_sample_size]:
+        t1 = time.perf_counter()
+        database.battle_exists_in_structured_dbs(battle_id)
+        structured_latencies.append(time.perf_counter() - t1)
+    structured_elapsed = time.perf_counter() - t0
+
+    return scenario_result(
+        len(sample), index_elapsed, index_latencies,
+        hit_ratio=round(hits / len(sample), 3),
+        structured_dbs=scenario_result(len(structured_latencies), structured_elapsed, structured_latencies),
+    )
+
+def run_api_ingest(stub_config, player_scans, distinct_players):
+    """
+    Reproduce el cuerpo del bucle de main.py contra el API simulado: consulta el
+    historial, inserta las batallas crudas y actualiza los jugadores.
+    """
+    try:
+        import main
+    except ImportError as e:
+        return {'status': 'skipped', 'reason': f"No se pudo importar main.py: {e}"}
+
+    server = StubApiServer(stub_config).start()
+    original_base_url = main.API_BASE_URL
+    main.API_BASE_URL = server.base_url
+    try:
+        players = server.state.generator.players[:distinct_players]
+        raw_conn = database.get_raw_battles_db_connection()
+        players_conn = database.get_players_db_connection()
+        index_conn = database.get_battle_index_connection()
+
+        api_latencies = []
+        insert_latencies = []
+        fetched = 0
+        new_battles = 0
+        t0 = time.perf_counter()
+        for scan in range(player_scans):
+            player = players[scan % len(players)]
+            t1 = time.perf_counter()
+            battles = main.get_player_battle_history(player, 'bench', 'stub-token')
+            api_latencies.append(time.perf_counter() - t1)
+            fetched += len(battles)
+
+            t1 = time.perf_counter()
+            processed_ids = database.get_processed_battle_ids(index_conn, [b['battle_queue_id_1'] for b in battles])
+            unprocessed = [b for b in battles if b['battle_queue_id_1'] not in processed_ids]
+            if unprocessed:
+                new_battles += database.insert_raw_battles_batch(raw_conn, unprocessed)
+            opponents = {b.get('player_1') for b in battles} | {b.get('player_2') for b in battles}
+            database.add_or_update_players_batch(players_conn, [p for p in opponents if p] + [player])
+            insert_latencies.append(time.perf_counter() - t1)
+        elapsed = time.perf_counter() - t0
+
+        raw_conn.close()
+        players_conn.close()
+        index_conn.close()
+    finally:
+        main.API_BASE_URL = original_base_url
+        server.stop()
+
+    return scenario_result(
+        player_scans, elapsed, api_latencies,
+        battles_fetched=fetched,
+        battles_new=new_battles,
+        battles_duplicate=fetched - new_battles,
+        battles_per_s=round(fetched / elapsed, 2) if elapsed > 0 else None,
+        insert_latency_ms=summarize_latencies(insert_latencies),
+        stub=server.stats(),
+        stub_config=stub_config.to_dict(),
+    )
+
+SCENARIOS = ('process_raw', 'create_index', 'dedup', 'api_ingest')
+
+def run_suite(workdir, scenarios=SCENARIOS, battles=20000, dedup_sample=5000, structured_sample=200,
+              player_scans=300, distinct_players=100, stub_config=None, extract_card_usage=False):
+    """Ejecuta los escenarios en orden y retorna el reporte como diccionario."""
+    stub_config = stub_config or StubApiConfig()
+    seasons = generate_seasons()
+    configure_workspace(workdir, seasons)
+
+    report = {
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'workdir': workdir,
+        'parameters': {
+            'battles': battles, 'dedup_sample': dedup_sample, 'structured_sample': structured_sample,
+            'player_scans': player_scans, 'distinct_players': distinct_players,
+            'extract_card_usage': extract_card_usage,
+        },
+        'scenarios': {},
+    }
+    for name in scenarios:
+        logging.warning(f"Ejecutando escenario {name}...")
+        try:
+            if name == 'process_raw':
+                result = run_process_raw(seasons, battles, extract_card_usage)
+            elif name == 'create_index':
+                result = run_create_index()
+            elif name == 'dedup':
+                result = run_dedup(dedup_sample, structured_sample)
+            elif name == 'api_ingest':
+                result = run_api_ingest(stub_config, player_scans, distinct_players)
+            else:
+                result = {'status': 'skipped', 'reason': f"Escenario desconocido: {name}"}
+        except Exception as e:
+            logging.exception(f"El escenario {name} falló.")
+            result = {'status': 'error', 'error': str(e)}
+        report['scenarios'][name] = result
+    report['finished_at'] = datetime.now(timezone.utc).isoformat()
+    return report
+
+def compare_reports(baseline, candidate):
+    """Compara el throughput de cada escenario entre dos reportes (candidato / base)."""
+    rows = []
+    for name, candidate_result in candidate.get('scenarios', {}).items():
+        baseline_result = baseline.get('scenarios', {}).get(name, {})
+        old = baseline_result.get('throughput_per_s')
+        new = candidate_result.get('throughput_per_s')
+        ratio = round(new / old, 3) if old and new else None
+        old_p95 = (baseline_result.get('latency_ms') or {}).get('p95')
+        new_p95 = (candidate_result.get('latency_ms') or {}).get('p95')
+        rows.append({'scenario': name, 'baseline_per_s': old, 'candidate_per_s': new, 'speedup': ratio,
+                     'baseline_p95_ms': old_p95, 'candidate_p95_ms': new_p95})
+    return rows
@@ -0,0 +1,189 @@
+import json
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from benchmark.generator import BattleGenerator, generate_seasons
+
+class StubApiConfig:
+    """Parámetros de comportamiento del API simulado."""
+
+    def __init__(self, latency_ms=50.0, latency_jitter_ms=20.0, rate_limit_rps=0.0, rate_limit_429_prob=0.0,
+                 retry_after=1, history_size=50, new_battles_per_scan=10, player_count=5000, seed=42):
+        self.latency_ms = latency_ms                   # Latencia media de cada respuesta
+        self.latency_jitter_ms = latency_jitter_ms     # Desviación uniforme +/- sobre la latencia
+        self.rate_limit_rps = rate_limit_rps           # 0 = sin límite; si no, cubeta de tokens global
+        self.rate_limit_429_prob = rate_limit_429_prob # Probabilidad de 429 aunque haya capacidad
+        self.retry_after = retry_after                 # Valor de la cabecera Retry-After en los 429
+        self.history_size = history_size               # Batallas por respuesta de /battle/history
+        self.new_battles_per_scan = new_battles_per_scan # Batallas nuevas entre dos escaneos del mismo jugador
+        self.player_count = player_count
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(vars(self))
+
+class StubApiState:
+    """Historias por jugador, temporadas y contadores, compartidos entre hilos del servidor."""
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.seasons = generate_seasons()
+        self.generator = BattleGenerator(self.seasons, player_count=config.player_count, seed=config.seed)
+        self.random = random.Random(config.seed + 1)
+        self.histories = {}
+        self.tokens = config.rate_limit_rps
+        self.last_refill = time.monotonic()
+        self.counters = {'requests': 0, 'history': 0, 'season': 0, 'login': 0, 'rate_limited': 0, 'not_found': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def allow_request(self):
+        """Cubeta de tokens global: False significa que hay que responder 429."""
+        with self.lock:
+            if self.config.rate_limit_429_prob and self.random.random() < self.config.rate_limit_429_prob:
+                return False
+            if self.config.rate_limit_rps <= 0:
+                return True
+            now = time.monotonic()
+            self.tokens = min(self.config.rate_limit_rps, self.tokens + (now - self.last_refill) * self.config.rate_limit_rps)
+            self.last_refill = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def player_history(self, player):
+        """
+        La primera consulta genera `history_size` batallas; cada consulta posterior añade
+        `new_battles_per_scan` batallas nuevas, de modo que las respuestas se solapan
+        como en producción (y ejercitan la deduplicación).
+        """
+        with self.lock:
+            history = self.histories.get(player)
+            if history is None:
+                history = self.generator.player_history(player, self.config.history_size)
+            else:
+                now = datetime.now(timezone.utc)
+                created = now.strftime('%Y-%m-%dT%H:%M:%S.') + f"{now.microsecond // 1000:03d}Z"
+                new_battles = [
+                    self.generator.battle(player_1=player, created_date=created)
+                    for _ in range(self.config.new_battles_per_scan)
+                ]
+                history = (new_battles + history)[:self.config.history_size]
+            self.histories[player] = history
+            return history
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def _sleep_latency(self):
+        config = self.state.config
+        latency = config.latency_ms + self.state.random.uniform(-config.latency_jitter_ms, config.latency_jitter_ms)
+        if latency > 0:
+            time.sleep(latency / 1000.0)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.state.count('requests')
+        self._sleep_latency()
+        if not self.state.allow_request():
+            self.state.count('rate_limited')
+            self._send_json(429, {'error': 'Too Many Requests'}, {'Retry-After': self.state.config.retry_after})
+            return
+
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == '/battle/history' and query.get('player'):
+            self.state.count('history')
+            self._send_json(200, {'player': query['player'], 'battles': self.state.player_history(query['player'])})
+        elif url.path == '/season' and query.get('id', '').isdigit():
+            self.state.count('season')
+            season = next((s for s in self.state.seasons if s['id'] == int(query['id'])), None)
+            if season:
+                self._send_json(200, season)
+            else:
+                self.state.count('not_found')
+                self._send_json(404, {'error': 'Season not found'})
+        elif url.path == '/players/login' and query.get('name'):
+            self.state.count('login')
+            self._send_json(200, {'name': query['name'], 'token': f"stub-token-{query['name']}", 'timestamp': int(time.time() * 1000)})
+        else:
+            self.state.count('not_found')
+            self._send_json(404, {'error': 'Not found'})
+
+    def log_message(self, format, *args):
+        pass # Silencioso: el servidor se usa en benchmarks
+
+class StubApiServer:
+    """
+    Servidor local que imita /battle/history, /season y /players/login.
+    Uso: server = StubApiServer(config).start(); ... server.base_url ...; server.stop()
+    """
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.config = config or StubApiConfig()
+        self.state = StubApiState(self.config)
+        handler = type('BoundStubApiHandler', (StubApiHandler,), {'state': self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def seasons(self):
+        return self.state.seasons
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread:
+            self.thread.join()
+
+    def stats(self):
+        with self.state.lock:
+            return dict(self.state.counters)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="API de Splinterlands simulado para benchmarks.")
+    parser.add_argument('--port', type=int, default=8790)
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    parser.add_argument('--rate-limit-rps', type=float, default=0.0)
+    parser.add_argument('--rate-limit-429-prob', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StubApiServer(StubApiConfig(latency_ms=args.latency_ms, rate_limit_rps=args.rate_limit_rps,
+                                         rate_limit_429_prob=args.rate_limit_429_prob), port=args.port)
+    print(f"API simulado escuchando en {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
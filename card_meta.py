@@ -0,0 +1,242 @@
+import csv
+import sys
+import json
+import sqlite3
+import logging
+import argparse
+
+# Importamos nuestros módulos
+import database
+from federated_query import discover_season_dbs
+from process_raw_battles import extract_card_usage
+
+# --- Configuración de Logging ---
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler() # Log to console
+    ]
+)
+
+# --- Configuración ---
+BACKFILL_CHUNK_SIZE = 5000
+GROUP_BY_OPTIONS = ('card', 'mana_cap', 'ruleset', 'format')
+
+def import_numpy():
+    """NumPy solo es necesario para la agregación; no lo exigimos al procesador."""
+    try:
+        import numpy as np
+    except ImportError:
+        logging.error("El motor de agregación requiere NumPy (pip install numpy).")
+        raise
+    return np
+
+def has_card_usage_table(conn):
+    cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'card_usage'")
+    return cursor.fetchone() is not None
+
+def load_card_usage_columns(seasons=None, formats=None, with_ruleset=False):
+    """
+    Carga las filas de card_usage de los archivos seleccionados como columnas NumPy:
+    card_id, level, slot, won, mana_cap, format_code y (opcional) ruleset_code.
+    Los códigos de formato y ruleset indexan las listas 'formats' y 'rulesets'.
+    """
+    np = import_numpy()
+    manifest = database.load_archive_manifest()
+    format_names = []
+    ruleset_codes = {}
+    chunks = []
+
+    if with_ruleset:
+        sql = '''
+            SELECT c.card_id, IFNULL(c.level, 0), c.slot, c.won, IFNULL(c.mana_cap, 0), IFNULL(b.ruleset, '')
+            FROM card_usage c JOIN battles b ON b.battle_id = c.battle_id
+        '''
+    else:
+        sql = "SELECT card_id, IFNULL(level, 0), slot, won, IFNULL(mana_cap, 0) FROM card_usage"
+
+    for season_id, db_format, db_path in discover_season_dbs(seasons, formats):
+        try:
+            conn = database.get_structured_db_read_connection(db_path, manifest)
+            if not has_card_usage_table(conn):
+                conn.close()
+                continue
+            rows = conn.execute(sql).fetchall()
+            conn.close()
+        except sqlite3.Error as e:
+            logging.warning(f"Error al leer card_usage de T{season_id}, F:{db_format}: {e}")
+            continue
+        if not rows:
+            continue
+
+        if db_format not in format_names:
+            format_names.append(db_format)
+        format_code = format_names.index(db_format)
+
+        if with_ruleset:
+            numeric = np.array([row[:5] for row in rows], dtype=np.int64)
+            rulesets = np.array([ruleset_codes.setdefault(row[5], len(ruleset_codes)) for row in rows], dtype=np.int64)
+        else:
+            numeric = np.array(rows, dtype=np.int64)
+            rulesets = np.zeros(len(rows), dtype=np.int64)
+        chunks.append((numeric, np.full(len(rows), format_code, dtype=np.int64), rulesets))
+
+    if chunks:
+        numeric = np.concatenate([chunk[0] for chunk in chunks])
+        format_column = np.concatenate([chunk[1] for chunk in chunks])
+        ruleset_column = np.concatenate([chunk[2] for chunk in chunks])
+    else:
+        numeric = np.zeros((0, 5), dtype=np.int64)
+        format_column = np.zeros(0, dtype=np.int64)
+        ruleset_column = np.zeros(0, dtype=np.int64)
+
+    return {
+        'card_id': numeric[:, 0],
+        'level': numeric[:, 1],
+        'slot': numeric[:, 2],
+        'won': numeric[:, 3],
+        'mana_cap': numeric[:, 4],
+        'format_code': format_column,
+        'ruleset_code': ruleset_column,
+        'formats': format_names,
+        'rulesets': sorted(ruleset_codes, key=ruleset_codes.get),
+    }
+
+def aggregate_card_stats(columns, group_by='card', min_picks=1):
+    """
+    Calcula en bloque, por carta y contexto (maná, ruleset o formato):
+    picks, victorias, win rate y pick rate (porcentaje de equipos que la usaron).
+    """
+    np = import_numpy()
+    if group_by not in GROUP_BY_OPTIONS:
+        raise ValueError(f"group_by debe ser uno de {GROUP_BY_OPTIONS}")
+
+    card_ids = columns['card_id']
+    if card_ids.size == 0:
+        return []
+
+    if group_by == 'card':
+        context = np.zeros(card_ids.size, dtype=np.int64)
+    elif group_by == 'mana_cap':
+        context = columns['mana_cap']
+    elif group_by == 'ruleset':
+        context = columns['ruleset_code']
+    else:
+        context = columns['format_code']
+
+    # Cada equipo tiene exactamente un invocador (slot 0): sirve para contar equipos por contexto
+    teams_per_context = np.bincount(context[columns['slot'] == 0], minlength=int(context.max()) + 1)
+
+    card_span = int(card_ids.max()) + 1
+    keys = context * card_span + card_ids
+    unique_keys, inverse, picks = np.unique(keys, return_inverse=True, return_counts=True)
+    wins = np.bincount(inverse, weights=columns['won'], minlength=unique_keys.size)
+    key_context = unique_keys // card_span
+    key_card = unique_keys % card_span
+    teams = teams_per_context[key_context]
+
+    win_rate = wins / picks
+    pick_rate = np.divide(picks, teams, out=np.zeros(picks.size), where=teams > 0)
+
+    order = np.lexsort((-picks, key_context))
+    results = []
+    for i in order:
+        if picks[i] < min_picks:
+            continue
+        context_value = int(key_context[i])
+        if group_by == 'ruleset':
+            context_value = columns['rulesets'][context_value]
+        elif group_by == 'format':
+            context_value = columns['formats'][context_value]
+        results.append({
+            group_by: context_value if group_by != 'card' else None,
+            'card_id': int(key_card[i]),
+            'picks': int(picks[i]),
+            'wins': int(wins[i]),
+            'win_rate': round(float(win_rate[i]), 4),
+            'pick_rate': round(float(pick_rate[i]), 4),
+        })
+    if group_by == 'card':
+        for row in results:
+            del row['card']
+    return results
+
+def backfill_card_usage(seasons=None, formats=None, chunk_size=BACKFILL_CHUNK_SIZE):
+    """
+    Rellena card_usage para batallas ya procesadas, leyendo full_battle_json.
+    Es idempotente y los archivos archivados (inmutables) se saltan.
+    """
+    manifest = database.load_archive_manifest()
+    total_rows = 0
+    for season_id, db_format, db_path in discover_season_dbs(seasons, formats):
+        if database.get_archive_key(db_path) in manifest:
+            logging.info(f"T{season_id}, F:{db_format} está archivada. Saltando.")
+            continue
+
+        conn = database.get_structured_db_connection(season_id, db_format)
+        database.initialize_card_usage_table(conn)
+        last_rowid = 0
+        file_rows = 0
+        while True:
+            battles = conn.execute('''
+                SELECT rowid, battle_id, full_battle_json FROM battles b
+                WHERE rowid > ? AND NOT EXISTS (SELECT 1 FROM card_usage c WHERE c.battle_id = b.battle_id)
+                ORDER BY rowid LIMIT ?
+            ''', (last_rowid, chunk_size)).fetchall()
+            if not battles:
+                break
+            card_usage_rows = []
+            for rowid, battle_id, full_battle_json in battles:
+                try:
+                    card_usage_rows.extend(extract_card_usage(battle_id, json.loads(full_battle_json)))
+                except (TypeError, json.JSONDecodeError):
+                    logging.warning(f"full_battle_json inválido para la batalla {battle_id}. Saltando.")
+                last_rowid = rowid
+            database.insert_card_usage_batch(conn, card_usage_rows)
+            conn.commit()
+            file_rows += len(card_usage_rows)
+        conn.close()
+        total_rows += file_rows
+        logging.info(f"T{season_id}, F:{db_format}: {file_rows} filas de uso de cartas añadidas.")
+    logging.info(f"Relleno de card_usage completado. Total de filas añadidas: {total_rows}.")
+
+def write_report(results, output_path, output_format):
+    if output_format == 'json':
+        with open(output_path, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        with open(output_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0].keys()) if results else ['card_id'])
+            writer.writeheader()
+            writer.writerows(results)
+    logging.info(f"Reporte de {len(results)} filas guardado en {output_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Meta de cartas: win rate y pick rate a partir de card_usage.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    report_parser = subparsers.add_parser('report', help="Calcular win rate y pick rate por carta.")
+    report_parser.add_argument('--seasons', help="Temporada o rango, p. ej. 162 o 150-162.")
+    report_parser.add_argument('--formats', help="Formatos separados por coma, p. ej. wild,modern.")
+    report_parser.add_argument('--group-by', choices=GROUP_BY_OPTIONS, default='card')
+    report_parser.add_argument('--min-picks', type=int, default=50)
+    report_parser.add_argument('--top', type=int, default=30, help="Filas a mostrar por consola.")
+    report_parser.add_argument('--output', help="Guardar el reporte completo (.json o .csv).")
+
+    backfill_parser = subparsers.add_parser('backfill', help="Extraer card_usage de batallas ya procesadas.")
+    backfill_parser.add_argument('--seasons')
+    backfill_parser.add_argument('--formats')
+
+    args = parser.parse_args()
+    if args.command == 'backfill':
+        backfill_card_usage(args.seasons, args.formats)
+    else:
+        columns = load_card_usage_columns(args.seasons, args.formats, with_ruleset=args.group_by == 'ruleset')
+        results = aggregate_card_stats(columns, args.group_by, args.min_picks)
+        if args.output:
+            write_report(results, args.output, 'json' if args.output.endswith('.json') else 'csv')
+        for row in results[:args.top]:
+            print('\t'.join(f"{key}={value}" for key, value in row.items()))
+        if not results:
+            print("No hay datos de card_usage para el filtro indicado.", file=sys.stderr)
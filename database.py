@@ -4,6 +4,10 @@ import glob
 import logging
 import json
 import time
+import hashlib
+
+import metrics
+import profiling
 
 # Definiciones de rutas
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -12,7 +16,27 @@ PLAYERS_DB = os.path.join(DB_FOLDER, 'players.db')
 RAW_BATTLES_DB = os.path.join(DB_FOLDER, 'raw_battles.db')
 
 STRUCTURED_BATTLES_ROOT = os.path.join(PROJECT_ROOT, 'Season')
-STRUCTURED_BATTLES_DB_PATTERN = os.path.join(STRUCTURED_BATTLES_ROOT, '*', '*', '*.db')
+STRUCTURED_BATTLES_DB_PATTERN = os.path.join(STRUCTURED_BATTLES_ROOT, '*', '*.db') # Season/XXX/<formato>.db
+# Manifiesto de temporadas cerradas compactadas por archive_seasons.py
+ARCHIVE_MANIFEST_FILE = os.path.join(STRUCTURED_BATTLES_ROOT, 'archive_manifest.json')
+ARCHIVE_MMAP_SIZE = 256 * 1024 * 1024 # 256 MB de I/O mapeado en memoria para lecturas de archivos
+
+# Columnas base de la tabla battles (en el orden de inserción)
+STRUCTURED_BATTLE_COLUMNS = (
+    'battle_id', 'player_1', 'player_2', 'winner', 'loser', 'match_type', 'format',
+    'mana_cap', 'ruleset', 'created_date', 'player_1_rating_initial',
+    'player_2_rating_initial', 'player_1_rating_final', 'player_2_rating_final',
+    'full_battle_json'
+)
+
+# --- Métricas ---
+DB_COMMIT_SECONDS = metrics.histogram('db_commit_seconds', 'Duración de los commits por base de datos.', ['db'])
+DB_ROWS_WRITTEN = metrics.counter('db_rows_written_total', 'Filas nuevas escritas en inserciones por lotes.', ['db'])
+
+def timed_commit(conn, db_name):
+    """Commit que registra su latencia en db_commit_seconds."""
+    with DB_COMMIT_SECONDS.time(db=db_name):
+        conn.commit()
 
 def get_raw_battles_db_connection():
     conn = sqlite3.connect(os.path.join(DB_FOLDER, 'raw_battles.db'), timeout=10) # Timeout de 10 segundos
@@ -30,18 +54,166 @@ def get_players_db_connection():
     conn.execute('PRAGMA journal_mode=WAL') # Habilitar WAL para concurrencia (ya existe)
     return conn
 
+def get_structured_db_path(season, match_type):
+    """Retorna la ruta del archivo de una temporada/formato: Season/XXX/<formato>.db"""
+    return os.path.join(STRUCTURED_BATTLES_ROOT, str(season), f'{match_type}.db')
+
 def get_structured_db_connection(season, match_type):
     # Construye la ruta exacta: /mnt/ssd/Splinterlands/Season/XXX/files.db
-    db_path = os.path.join(STRUCTURED_BATTLES_ROOT, str(season), f'{match_type}.db')
+    db_path = get_structured_db_path(season, match_type)
     if not os.path.exists(os.path.dirname(db_path)):
         os.makedirs(os.path.dirname(db_path))
     conn = sqlite3.connect(db_path, timeout=10) # Añadido timeout de 10 segundos
     conn.execute('PRAGMA journal_mode=WAL') # Habilitar WAL para concurrencia
     return conn
 
+def load_archive_manifest():
+    """
+    Carga el manifiesto de archivos compactados. Las claves son rutas relativas a
+    STRUCTURED_BATTLES_ROOT (p. ej. '162/wild.db').
+    """
+    try:
+        with open(ARCHIVE_MANIFEST_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_archive_manifest(manifest):
+    """Escribe el manifiesto de forma atómica (archivo temporal + os.replace)."""
+    tmp_path = f"{ARCHIVE_MANIFEST_FILE}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, ARCHIVE_MANIFEST_FILE)
+
+def file_sha256(path):
+    """sha256 del archivo completo, leído en bloques de 1 MB (archivos archivados y lotes del feed)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_archive_key(db_path):
+    return os.path.relpath(db_path, STRUCTURED_BATTLES_ROOT)
+
+def is_archived_db(db_path, manifest=None):
+    """Indica si el archivo de temporada/formato ya fue compactado y es de solo lectura."""
+    if manifest is None:
+        manifest = load_archive_manifest()
+    entry = manifest.get(get_archive_key(db_path))
+    return bool(entry) and not entry.get('compressed')
+
+def get_archived_db_connection(db_path):
+    """
+    Abre un archivo compactado como inmutable: sin WAL, sin bloqueos y con mmap.
+    Solo es seguro para archivos registrados en el manifiesto (nunca cambian), por
+    lo que la conexión puede compartirse entre hilos.
+    """
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro&immutable=1', uri=True, check_same_thread=False)
+    conn.execute(f'PRAGMA mmap_size={ARCHIVE_MMAP_SIZE}')
+    return conn
+
+def get_structured_db_read_connection(db_path, manifest=None):
+    """Conexión de solo lectura a un archivo de temporada/formato (inmutable si está archivado)."""
+    if is_archived_db(db_path, manifest):
+        return get_archived_db_connection(db_path)
+    return sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=10)
+
+# --- Columnas generadas de la tabla battles ---
+# Campos muy consultados que solo existen dentro de full_battle_json (o que se derivan
+# de otras columnas). SQLite los calcula con JSON1, de modo que se pueden filtrar,
+# agregar e indexar sin deserializar el JSON en Python.
+# 'dec_info' y 'settings' son cadenas JSON dentro del JSON de la batalla; json_valid
+# evita que un valor corrupto haga fallar la inserción o la creación del índice.
+def _nested_json_field(field, path):
+    inner = f"json_extract(full_battle_json, '$.{field}')"
+    return f"CASE WHEN json_valid({inner}) THEN json_extract({inner}, '{path}') END"
+
+STRUCTURED_GENERATED_COLUMNS = [
+    {'name': 'dec_reward', 'type': 'REAL', 'expr': _nested_json_field('dec_info', '$.reward'), 'indexed': False},
+    {'name': 'glints', 'type': 'INTEGER', 'expr': _nested_json_field('dec_info', '$.glints'), 'indexed': False},
+    {'name': 'tournament_id', 'type': 'TEXT', 'expr': _nested_json_field('settings', '$.tournament_id'), 'indexed': True},
+    {'name': 'ruleset_primary', 'type': 'TEXT',
+     'expr': "CASE WHEN instr(ruleset, '|') > 0 THEN substr(ruleset, 1, instr(ruleset, '|') - 1) ELSE ruleset END",
+     'indexed': True},
+    {'name': 'ruleset_secondary', 'type': 'TEXT',
+     'expr': "CASE WHEN instr(ruleset, '|') > 0 THEN substr(ruleset, instr(ruleset, '|') + 1) END",
+     'indexed': False},
+    {'name': 'player_1_rating_delta', 'type': 'INTEGER', 'expr': 'player_1_rating_final - player_1_rating_initial', 'indexed': False},
+    {'name': 'player_2_rating_delta', 'type': 'INTEGER', 'expr': 'player_2_rating_final - player_2_rating_initial', 'indexed': False},
+]
+# VIRTUAL (se calcula al leer, no ocupa espacio) o STORED (se calcula al insertar).
+# SQLite solo permite añadir columnas VIRTUAL a tablas existentes: STORED aplica a
+# archivos nuevos. Cada columna puede sobrescribirlo con la clave 'storage'.
+GENERATED_COLUMNS_STORAGE = os.getenv("GENERATED_COLUMNS_STORAGE", "VIRTUAL").upper()
+
+def _generated_column_definition(column, storage):
+    return f"{column['name']} {column['type']} GENERATED ALWAYS AS ({column['expr']}) {storage}"
+
+def missing_generated_columns(conn):
+    """Columnas generadas e índices que le faltan a battles (solo lectura, barato)."""
+    existing_columns = {row[1] for row in conn.execute("PRAGMA table_xinfo(battles)")}
+    existing_indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    missing = []
+    for column in STRUCTURED_GENERATED_COLUMNS:
+        if column['name'] not in existing_columns:
+            missing.append(column['name'])
+        if column.get('indexed') and f"idx_battles_{column['name']}" not in existing_indexes:
+            missing.append(f"idx_battles_{column['name']}")
+    return missing
+
+def ensure_generated_columns(conn):
+    """
+    Añade a battles las columnas generadas (VIRTUAL) y los índices que falten.
+    Retorna la lista de columnas e índices creados. Does NOT commit.
+    En archivos con datos es una migración pesada: la hace migrate_generated_columns.py.
+    """
+    created = []
+    for name in missing_generated_columns(conn):
+        column = next((c for c in STRUCTURED_GENERATED_COLUMNS if c['name'] == name), None)
+        if column is not None:
+            conn.execute(f"ALTER TABLE battles ADD COLUMN {_generated_column_definition(column, 'VIRTUAL')}")
+        else:
+            conn.execute(f"CREATE INDEX {name} ON battles ({name[len('idx_battles_'):]})")
+        created.append(name)
+    return created
+
+# Índices por jugador en los archivos vivos, para que la consulta de un jugador (caché
+# de jugadores, federated_query) no recorra la tabla. Los archivados ya los tienen
+# (mismos nombres que ARCHIVE_INDEXES de archive_seasons).
+STRUCTURED_PLAYER_INDEXES = {
+    'idx_battles_player_1': 'battles (player_1, created_date)',
+    'idx_battles_player_2': 'battles (player_2, created_date)',
+}
+
+def missing_player_indexes(conn):
+    existing_indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    return [name for name in STRUCTURED_PLAYER_INDEXES if name not in existing_indexes]
+
+def ensure_player_indexes(conn):
+    """Crea los índices por jugador que falten. Retorna sus nombres. Does NOT commit."""
+    created = missing_player_indexes(conn)
+    for name in created:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {STRUCTURED_PLAYER_INDEXES[name]}")
+    return created
+
+_warned_unmigrated = set()
+
 def initialize_structured_battle_table(conn):
+    """
+    Crea battles con las columnas generadas en archivos nuevos. Un archivo existente sin
+    ellas no se altera aquí (sería un ALTER + índices sobre toda la tabla en medio de un
+    lote): solo se avisa una vez para ejecutar migrate_generated_columns.py.
+    """
     cursor = conn.cursor()
-    cursor.execute('''
+    is_new = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'battles'").fetchone() is None
+    generated_columns_sql = '\n            '.join(
+        f", {_generated_column_definition(column, column.get('storage', GENERATED_COLUMNS_STORAGE))}"
+        for column in STRUCTURED_GENERATED_COLUMNS
+    )
+    cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS battles (
             battle_id TEXT PRIMARY KEY,
             player_1 TEXT NOT NULL,
@@ -58,9 +230,107 @@ def initialize_structured_battle_table(conn):
             player_1_rating_final INTEGER,
             player_2_rating_final INTEGER,
             full_battle_json TEXT -- Nueva columna para el JSON completo
+            {generated_columns_sql}
+        )
+    ''')
+    if is_new:
+        ensure_generated_columns(conn) # Solo los índices, sobre una tabla vacía
+        ensure_player_indexes(conn)
+    else:
+        db_path = conn.execute("PRAGMA database_list").fetchone()[2]
+        if db_path not in _warned_unmigrated and (missing_generated_columns(conn) or missing_player_indexes(conn)):
+            _warned_unmigrated.add(db_path)
+            logging.warning(f"{db_path} no tiene las columnas generadas o los índices por jugador. Ejecutar migrate_generated_columns.py.")
+    conn.commit()
+
+def initialize_card_usage_table(conn):
+    """
+    Tabla compacta de uso de cartas: una fila por carta jugada en cada equipo.
+    side es 1 o 2 (team1/team2), slot 0 es el invocador y 1..n los monstruos.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS card_usage (
+            battle_id TEXT NOT NULL,
+            side INTEGER NOT NULL,
+            slot INTEGER NOT NULL,
+            card_id INTEGER NOT NULL,
+            level INTEGER,
+            won INTEGER NOT NULL,
+            mana_cap INTEGER,
+            PRIMARY KEY (battle_id, side, slot)
+        ) WITHOUT ROWID
+    ''')
+    conn.commit()
+
+def _rating_histogram_trigger_sql(row):
+    """Sentencias de trigger que suman (NEW) o restan (OLD) el jugador en rating_histogram."""
+    if row == 'NEW':
+        return '''
+            INSERT INTO rating_histogram (rating, players) VALUES (NEW.rating, 1)
+            ON CONFLICT(rating) DO UPDATE SET players = players + 1;'''
+    return '''
+            UPDATE rating_histogram SET players = players - 1 WHERE rating = OLD.rating;
+            DELETE FROM rating_histogram WHERE rating = OLD.rating AND players <= 0;'''
+
+def initialize_rating_tables(conn):
+    """
+    rating_series guarda la curva de rating de cada jugador como un BLOB array('q')
+    intercalado [ts, rating, ts, rating, ...] ordenado por ts. player_ratings guarda el
+    último rating de cada jugador; su índice por rating es el leaderboard de la temporada.
+    rating_histogram (jugadores por rating, mantenida por triggers) da el rank de un
+    jugador sumando unos pocos miles de filas en lugar de contar toda la temporada.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rating_series (
+            player TEXT PRIMARY KEY,
+            points BLOB NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS player_ratings (
+            player TEXT PRIMARY KEY,
+            rating INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL,
+            battles INTEGER NOT NULL DEFAULT 0
         )
     ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_player_ratings_rating ON player_ratings (rating DESC, player)")
     conn.commit()
+    if cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rating_histogram'"
+    ).fetchone() is not None:
+        return
+
+    # Histograma y triggers en una sola transacción, poblado una vez desde player_ratings
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute('''
+            CREATE TABLE rating_histogram (
+                rating INTEGER PRIMARY KEY,
+                players INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute("INSERT INTO rating_histogram (rating, players) SELECT rating, COUNT(*) FROM player_ratings GROUP BY rating")
+        cursor.execute(f"CREATE TRIGGER player_ratings_insert AFTER INSERT ON player_ratings BEGIN{_rating_histogram_trigger_sql('NEW')}\n        END")
+        cursor.execute(f"CREATE TRIGGER player_ratings_delete AFTER DELETE ON player_ratings BEGIN{_rating_histogram_trigger_sql('OLD')}\n        END")
+        cursor.execute(
+            "CREATE TRIGGER player_ratings_update AFTER UPDATE OF rating ON player_ratings WHEN OLD.rating != NEW.rating BEGIN"
+            f"{_rating_histogram_trigger_sql('OLD')}{_rating_histogram_trigger_sql('NEW')}\n        END"
+        )
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+def insert_card_usage_batch(conn, card_usage_rows):
+    """Inserta filas de uso de cartas. Does NOT commit: el llamador agrupa la transacción."""
+    if not card_usage_rows: return
+    conn.executemany('''
+        INSERT OR IGNORE INTO card_usage (battle_id, side, slot, card_id, level, won, mana_cap)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', card_usage_rows)
 
 def insert_processed_battle(conn, battle_data):
     try:
@@ -106,10 +376,14 @@ def battle_exists_in_structured_dbs(battle_id):
     Verifica si un battle_id dado ya existe en alguna de las bases de datos estructuradas.
     """
     structured_db_files = glob.glob(STRUCTURED_BATTLES_DB_PATTERN)
+    manifest = load_archive_manifest()
     for db_file in structured_db_files:
         try:
-            conn = sqlite3.connect(db_file, timeout=5) # Usar un timeout corto
-            conn.execute('PRAGMA journal_mode=WAL') # Ensure WAL for this check
+            if is_archived_db(db_file, manifest):
+                conn = get_archived_db_connection(db_file)
+            else:
+                conn = sqlite3.connect(db_file, timeout=5) # Usar un timeout corto
+                conn.execute('PRAGMA journal_mode=WAL') # Ensure WAL for this check
             cursor = conn.cursor()
             cursor.execute("SELECT 1 FROM battles WHERE battle_id = ?", (battle_id,))
             if cursor.fetchone():
@@ -126,6 +400,22 @@ def battle_exists_in_index(conn, battle_id):
     cursor.execute("SELECT 1 FROM processed_battles WHERE battle_id = ?", (battle_id,))
     return cursor.fetchone() is not None
 
+INDEX_LOOKUP_CHUNK = 500 # IDs por consulta IN al índice (límite de variables de SQLite)
+
+def get_processed_battle_ids(conn, battle_ids):
+    """IDs de battle_ids que ya están en el índice centralizado, consultados en bloques IN (...)."""
+    known = set()
+    for start in range(0, len(battle_ids), INDEX_LOOKUP_CHUNK):
+        chunk = battle_ids[start:start + INDEX_LOOKUP_CHUNK]
+        try:
+            rows = conn.execute(
+                f"SELECT battle_id FROM processed_battles WHERE battle_id IN ({', '.join('?' for _ in chunk)})", chunk
+            ).fetchall()
+        except sqlite3.OperationalError:
+            return set() # Índice aún no creado (create_battle_index.py)
+        known.update(row[0] for row in rows)
+    return known
+
 def add_battle_id_to_index(conn, battle_id):
     """
     Añade un battle_id al índice centralizado."""
@@ -136,7 +426,39 @@ def add_battle_id_to_index(conn, battle_id):
     except sqlite3.Error as e:
         logging.error(f"Error al añadir battle_id {battle_id} al índice: {e}")
 
+# --- Frescura de escaneo (players.db) ---
+SCAN_BUCKET_SECONDS = 300 # Ancho de cada cubeta de scan_buckets (por last_scanned_timestamp)
+SCAN_LANES = ('rotation', 'priority', 'discovered')
+ACTIVITY_TIERS = ('saturated', 'active', 'casual', 'idle', 'unknown')
+BATTLE_HISTORY_WINDOW = 50 # Batallas que devuelve /battle/history
+ACTIVE_TIER_MIN_NEW_BATTLES = 10
+SCAN_COUNT_RETENTION_SECONDS = 7 * 86400 # Historia de scan_counts (escaneos reales por cubeta)
+
+_PLAYER_EXTRA_COLUMNS = (
+    ('scan_lane', "TEXT NOT NULL DEFAULT 'discovered'"),
+    ('activity_tier', "TEXT NOT NULL DEFAULT 'unknown'"),
+)
+
+def _scan_bucket_trigger_sql(row):
+    """Sentencias de trigger que suman (NEW) o restan (OLD) la fila en scan_buckets."""
+    bucket = f"{row}.last_scanned_timestamp - ({row}.last_scanned_timestamp % {SCAN_BUCKET_SECONDS})"
+    if row == 'NEW':
+        return f'''
+            INSERT INTO scan_buckets (bucket_ts, activity_tier, scan_lane, players)
+            VALUES ({bucket}, NEW.activity_tier, NEW.scan_lane, 1)
+            ON CONFLICT(bucket_ts, activity_tier, scan_lane) DO UPDATE SET players = players + 1;'''
+    key = f"bucket_ts = {bucket} AND activity_tier = OLD.activity_tier AND scan_lane = OLD.scan_lane"
+    return f'''
+            UPDATE scan_buckets SET players = players - 1 WHERE {key};
+            DELETE FROM scan_buckets WHERE {key} AND players <= 0;'''
+
 def initialize_players_table(conn):
+    """
+    Crea la tabla players y las estructuras de frescura: índice por
+    last_scanned_timestamp y la tabla resumen scan_buckets (jugadores por cubeta
+    de tiempo × nivel de actividad × carril), mantenida por triggers. Migra las
+    tablas antiguas añadiendo las columnas que falten y poblando el resumen una vez.
+    """
     cursor = conn.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS players (
@@ -146,6 +468,75 @@ def initialize_players_table(conn):
     ''')
     conn.commit()
 
+    existing_columns = {row[1] for row in cursor.execute("PRAGMA table_info(players)")}
+    summary_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scan_buckets'"
+    ).fetchone() is not None
+    # Escaneos realizados por cubeta y carril. scan_buckets cuenta jugadores *actualmente*
+    # en cada cubeta (un jugador re-escaneado o redescubierto se mueve), así que no sirve
+    # para medir la velocidad del crawler; esta tabla sí.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scan_counts (
+            bucket_ts INTEGER NOT NULL,
+            scan_lane TEXT NOT NULL,
+            scans INTEGER NOT NULL,
+            PRIMARY KEY (bucket_ts, scan_lane)
+        ) WITHOUT ROWID
+    ''')
+    conn.commit()
+    if summary_exists and all(name in existing_columns for name, _ in _PLAYER_EXTRA_COLUMNS):
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_players_last_scanned ON players (last_scanned_timestamp)")
+        conn.commit()
+        return
+
+    # Migración en una sola transacción para que el resumen y los triggers queden consistentes
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        for name, definition in _PLAYER_EXTRA_COLUMNS:
+            if name not in existing_columns:
+                cursor.execute(f"ALTER TABLE players ADD COLUMN {name} {definition}")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_players_last_scanned ON players (last_scanned_timestamp)")
+        cursor.execute("DROP TABLE IF EXISTS scan_buckets")
+        cursor.execute('''
+            CREATE TABLE scan_buckets (
+                bucket_ts INTEGER NOT NULL,
+                activity_tier TEXT NOT NULL,
+                scan_lane TEXT NOT NULL,
+                players INTEGER NOT NULL,
+                PRIMARY KEY (bucket_ts, activity_tier, scan_lane)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'''
+            INSERT INTO scan_buckets (bucket_ts, activity_tier, scan_lane, players)
+            SELECT last_scanned_timestamp - (last_scanned_timestamp % {SCAN_BUCKET_SECONDS}), activity_tier, scan_lane, COUNT(*)
+            FROM players GROUP BY 1, 2, 3
+        ''')
+        cursor.execute("DROP TRIGGER IF EXISTS players_scan_insert")
+        cursor.execute("DROP TRIGGER IF EXISTS players_scan_delete")
+        cursor.execute("DROP TRIGGER IF EXISTS players_scan_update")
+        cursor.execute(f"CREATE TRIGGER players_scan_insert AFTER INSERT ON players BEGIN{_scan_bucket_trigger_sql('NEW')}\n        END")
+        cursor.execute(f"CREATE TRIGGER players_scan_delete AFTER DELETE ON players BEGIN{_scan_bucket_trigger_sql('OLD')}\n        END")
+        cursor.execute(
+            "CREATE TRIGGER players_scan_update AFTER UPDATE OF last_scanned_timestamp, activity_tier, scan_lane ON players BEGIN"
+            f"{_scan_bucket_trigger_sql('OLD')}{_scan_bucket_trigger_sql('NEW')}\n        END"
+        )
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    logging.info("Tabla players migrada: índice por last_scanned_timestamp y resumen scan_buckets creados.")
+
+def record_scan(conn, lane, now=None):
+    """Suma un escaneo del crawler a scan_counts y poda la historia vieja."""
+    now = int(now or time.time())
+    bucket_ts = now - now % SCAN_BUCKET_SECONDS
+    conn.execute('''
+        INSERT INTO scan_counts (bucket_ts, scan_lane, scans) VALUES (?, ?, 1)
+        ON CONFLICT(bucket_ts, scan_lane) DO UPDATE SET scans = scans + 1
+    ''', (bucket_ts, lane))
+    conn.execute("DELETE FROM scan_counts WHERE bucket_ts < ?", (bucket_ts - SCAN_COUNT_RETENTION_SECONDS,))
+    conn.commit()
+
 def initialize_raw_battles_table(conn):
     cursor = conn.cursor()
     cursor.execute('''
@@ -154,39 +545,93 @@ def initialize_raw_battles_table(conn):
             battle_data TEXT
         )
     ''')
+    # Cuarentena: batallas tardías de temporadas ya archivadas (inmutables). Salen de
+    # raw_battles para no releerlas en cada ciclo; se conservan por si se regenera el archivo.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archived_season_battles (
+            battle_id TEXT PRIMARY KEY,
+            season_id INTEGER,
+            format TEXT,
+            battle_data TEXT,
+            quarantined_at INTEGER
+        )
+    ''')
     conn.commit()
 
+def quarantine_archived_battles(conn, rows):
+    """
+    Mueve batallas de raw_battles a archived_season_battles en una sola transacción.
+    rows: [(battle_id, season_id, formato, battle_data)]. Retorna cuántas se movieron.
+    """
+    if not rows: return 0
+    initialize_raw_battles_table(conn)
+    now = int(time.time())
+    conn.executemany('''
+        INSERT OR IGNORE INTO archived_season_battles (battle_id, season_id, format, battle_data, quarantined_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(battle_id, season_id, game_format, battle_data, now) for battle_id, season_id, game_format, battle_data in rows])
+    conn.executemany("DELETE FROM raw_battles WHERE battle_id = ?", [(row[0],) for row in rows])
+    timed_commit(conn, 'raw_battles')
+    DB_ROWS_WRITTEN.inc(len(rows), db='raw_battles_quarantine')
+    return len(rows)
+
 def get_total_players(conn):
+    """Suma el resumen scan_buckets (tamaño acotado) en lugar de COUNT(*) sobre players."""
     cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM players")
+    try:
+        cursor.execute("SELECT COALESCE(SUM(players), 0) FROM scan_buckets")
+    except sqlite3.OperationalError:
+        cursor.execute("SELECT COUNT(*) FROM players") # Base de datos aún sin migrar
     return cursor.fetchone()[0]
 
-def add_or_update_player(conn, player_name):
+_UPSERT_PLAYER_SQL = '''
+    INSERT INTO players (player_name, last_scanned_timestamp, scan_lane, activity_tier)
+    VALUES (?1, ?2, ?3, COALESCE(?4, 'unknown'))
+    ON CONFLICT(player_name) DO UPDATE SET
+        last_scanned_timestamp = excluded.last_scanned_timestamp,
+        scan_lane = excluded.scan_lane,
+        activity_tier = COALESCE(?4, players.activity_tier)
+'''
+
+def classify_activity_tier(new_battles_count):
+    """
+    Nivel de actividad según las batallas nuevas del último escaneo. 'saturated'
+    significa que toda la ventana de /battle/history era nueva: probablemente se
+    perdieron batallas entre dos escaneos.
+    """
+    if new_battles_count >= BATTLE_HISTORY_WINDOW:
+        return 'saturated'
+    if new_battles_count >= ACTIVE_TIER_MIN_NEW_BATTLES:
+        return 'active'
+    if new_battles_count > 0:
+        return 'casual'
+    return 'idle'
+
+def add_or_update_player(conn, player_name, lane='discovered', activity_tier=None):
     """
     Adds or updates a single player. Does NOT commit. For batching, use add_or_update_players_batch.
+    Usa un upsert (no INSERT OR REPLACE) para que los triggers de scan_buckets vean un UPDATE.
     """
     cursor = conn.cursor()
     current_time = int(time.time())
-    cursor.execute('''
-        INSERT OR REPLACE INTO players (player_name, last_scanned_timestamp)
-        VALUES (?, ?)
-    ''', (player_name, current_time))
+    cursor.execute(_UPSERT_PLAYER_SQL, (player_name, current_time, lane, activity_tier))
     # conn.commit() # Commit will be handled by the caller for batching
 
-def add_or_update_players_batch(conn, player_names_list):
+def add_or_update_players_batch(conn, player_names_list, lane='discovered', activity_tier=None):
     """
     Adds or updates a list of players in a single batch operation.
+    `lane` indica por qué se tocó al jugador ('discovered' para rivales encontrados en
+    un historial, 'rotation'/'priority' para el jugador escaneado); `activity_tier`
+    None conserva el nivel actual.
     """
     if not player_names_list: return
     cursor = conn.cursor()
     current_time = int(time.time())
     # Use set to avoid duplicates and ensure each player is processed once per batch
-    data_to_insert = [(name, current_time) for name in set(player_names_list)] 
-    cursor.executemany('''
-        INSERT OR REPLACE INTO players (player_name, last_scanned_timestamp)
-        VALUES (?, ?)
-    ''', data_to_insert)
-    conn.commit() # Commit the batch
+    data_to_insert = [(name, current_time, lane, activity_tier) for name in set(player_names_list)] 
+    cursor.executemany(_UPSERT_PLAYER_SQL, data_to_insert)
+    timed_commit(conn, 'players') # Commit the batch
+    DB_ROWS_WRITTEN.inc(len(data_to_insert), db='players')
     logging.info(f"Batch updated {len(data_to_insert)} players.")
 
 def get_priority_player_to_scan(conn, priority_players_names):
@@ -198,6 +643,12 @@ def get_priority_player_to_scan(conn, priority_players_names):
             return result[0]
     return None
 
+def get_player_last_scanned(conn, player_name):
+    cursor = conn.cursor()
+    cursor.execute("SELECT last_scanned_timestamp FROM players WHERE player_name = ?", (player_name,))
+    result = cursor.fetchone()
+    return result[0] if result else None
+
 def get_player_to_scan(conn):
     cursor = conn.cursor()
     cursor.execute("SELECT player_name FROM players ORDER BY last_scanned_timestamp ASC LIMIT 1")
@@ -226,11 +677,13 @@ def insert_raw_battle(conn, battle):
         logging.error(f"Error al insertar batalla cruda {battle.get('battle_queue_id_1')}: {e}")
         return False
 
+@profiling.timed('insert_raw_battles_batch')
 def insert_raw_battles_batch(conn, battles_list):
     """
     Inserts a list of raw battles in a single batch operation.
+    Retorna cuántas batallas eran nuevas (las ya presentes en raw_battles se ignoran).
     """
-    if not battles_list: return
+    if not battles_list: return 0
     cursor = conn.cursor()
     data_to_insert = []
     for battle in battles_list:
@@ -241,11 +694,22 @@ def insert_raw_battles_batch(conn, battles_list):
         else:
             logging.warning("Batalla en lote sin battle_queue_id_1. Saltando.")
 
+    inserted_count = 0
     if data_to_insert:
+        changes_before = conn.total_changes
         cursor.executemany('''
             INSERT OR IGNORE INTO raw_battles (battle_id, battle_data)
             VALUES (?, ?)
         ''', data_to_insert)
-        conn.commit() # Commit the batch
+        inserted_count = conn.total_changes - changes_before
+        timed_commit(conn, 'raw_battles') # Commit the batch
+        DB_ROWS_WRITTEN.inc(inserted_count, db='raw_battles')
         logging.info(f"Batch inserted {len(data_to_insert)} raw battles.")
+    return inserted_count
+
+def get_raw_backlog_count(conn):
+    """Batallas crudas pendientes de procesar."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM raw_battles")
+    return cursor.fetchone()[0]
 
@@ -0,0 +1,421 @@
+import os
+import re
+import sys
+import glob
+import json
+import sqlite3
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+# Importamos nuestro módulo de base de datos
+import database
+
+# --- Configuración de Logging ---
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler() # Log to console
+    ]
+)
+
+# --- Configuración ---
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_CACHE_SIZE = 256 # Cantidad de resultados guardados en la caché LRU
+DEFAULT_HTTP_HOST = '127.0.0.1'
+DEFAULT_HTTP_PORT = 8765
+READ_TIMEOUT = 5 # Segundos de espera si un archivo está bloqueado por el procesador
+
+# Acciones que el autorizador de SQLite permite al SQL recibido: solo lecturas.
+# ATTACH, PRAGMA con asignación y cualquier escritura se rechazan aunque la conexión sea mode=ro.
+READ_ONLY_ACTIONS = {
+    sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION,
+    getattr(sqlite3, 'SQLITE_RECURSIVE', 33), # WITH RECURSIVE
+}
+READ_ONLY_PRAGMAS = {'table_info', 'table_xinfo', 'index_list', 'index_info'}
+
+def parse_season_range(season_range):
+    """
+    Convierte '150-160', '162' o (150, 160) en una tupla (desde, hasta) inclusiva.
+    Retorna None si no se especificó un rango.
+    """
+    if season_range is None or season_range == '':
+        return None
+    if isinstance(season_range, (tuple, list)):
+        return int(season_range[0]), int(season_range[1])
+    if isinstance(season_range, int):
+        return season_range, season_range
+    match = re.fullmatch(r'\s*(\d+)\s*(?:-\s*(\d+)\s*)?', str(season_range))
+    if not match:
+        raise ValueError(f"Rango de temporadas inválido: {season_range}")
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else start
+    return min(start, end), max(start, end)
+
+def parse_formats(formats):
+    if not formats:
+        return None
+    if isinstance(formats, str):
+        formats = formats.split(',')
+    return {f.strip().lower() for f in formats if f.strip()}
+
+def parse_params(params):
+    """Parámetros de la consulta: lista JSON (o ya decodificada). ValueError si no lo es."""
+    if params is None or params == '' or params == ():
+        return ()
+    if isinstance(params, (str, bytes)):
+        params = json.loads(params) # JSONDecodeError es un ValueError
+    if not isinstance(params, (list, tuple)):
+        raise ValueError("'params' debe ser una lista JSON.")
+    return tuple(params)
+
+def read_only_authorizer(action, arg1, arg2, db_name, trigger_name):
+    if action in READ_ONLY_ACTIONS:
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_PRAGMA and arg1 in READ_ONLY_PRAGMAS: # Toman un nombre de tabla, no asignan
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+class ReadOnlyQueryError(ValueError):
+    """El SQL recibido intenta algo distinto de leer (escritura, ATTACH, PRAGMA...)."""
+
+def discover_season_dbs(season_range=None, formats=None):
+    """
+    Lista los archivos de temporada/formato que cumplen el filtro, como tuplas
+    (season_id, formato, ruta). La poda se hace por ruta, sin abrir ningún archivo.
+    """
+    season_range = parse_season_range(season_range)
+    formats = parse_formats(formats)
+    selected = []
+    for db_path in glob.glob(database.STRUCTURED_BATTLES_DB_PATTERN):
+        season_folder = os.path.basename(os.path.dirname(db_path))
+        if not season_folder.isdigit():
+            continue
+        season_id = int(season_folder)
+        db_format = os.path.splitext(os.path.basename(db_path))[0]
+        if season_range and not (season_range[0] <= season_id <= season_range[1]):
+            continue
+        if formats and db_format.lower() not in formats:
+            continue
+        selected.append((season_id, db_format, db_path))
+    selected.sort()
+    return selected
+
+def get_file_identity(db_path, manifest):
+    """
+    Identidad del archivo para el pool de conexiones: cambia cuando archive_seasons lo
+    reemplaza (os.replace cambia el inodo y el manifiesto), no con cada commit.
+    """
+    entry = manifest.get(database.get_archive_key(db_path))
+    try:
+        inode = os.stat(db_path).st_ino
+    except FileNotFoundError:
+        inode = None
+    return (bool(entry) and not entry.get('compressed'), inode)
+
+def get_file_version(db_path, manifest):
+    """
+    Versión de datos de un archivo. Los archivados nunca cambian (checksum del
+    manifiesto); para los vivos usamos tamaño y mtime del .db y de su -wal, que
+    cambian con cada commit del procesador. Un -wal vacío equivale a no tenerlo:
+    la primera conexión de lectura lo crea sin que cambien los datos.
+    """
+    entry = manifest.get(database.get_archive_key(db_path))
+    if entry and not entry.get('compressed'):
+        return ('archived', entry.get('sha256'))
+    version = []
+    for path in (db_path, db_path + '-wal'):
+        try:
+            st = os.stat(path)
+            version.append((st.st_mtime_ns, st.st_size) if st.st_size or path == db_path else None)
+        except FileNotFoundError:
+            version.append(None)
+    return tuple(version)
+
+class ConnectionPool:
+    """Pool de conexiones de solo lectura por archivo, compartido entre hilos."""
+
+    def __init__(self):
+        self._idle = {}
+        self._identities = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, db_path, identity):
+        """
+        Conexión de solo lectura al archivo. Si su identidad cambió desde la última vez
+        (archivado, restaurado), las conexiones ociosas apuntan al archivo viejo y se descartan.
+        """
+        if self._identities.get(db_path) != identity:
+            self.discard(db_path)
+            with self._lock:
+                self._identities[db_path] = identity
+        with self._lock:
+            idle = self._idle.get(db_path)
+            if idle:
+                return idle.pop()
+        archived = identity[0]
+        if archived:
+            conn = database.get_archived_db_connection(db_path)
+        else:
+            conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=READ_TIMEOUT, check_same_thread=False)
+        conn.set_authorizer(read_only_authorizer)
+        return conn
+
+    def release(self, db_path, conn, identity):
+        with self._lock:
+            if self._identities.get(db_path) == identity:
+                self._idle.setdefault(db_path, []).append(conn)
+                return
+        conn.close() # El archivo cambió mientras se usaba la conexión
+
+    def discard(self, db_path):
+        """Cierra las conexiones de un archivo (p. ej. después de ser archivado)."""
+        with self._lock:
+            for conn in self._idle.pop(db_path, []):
+                conn.close()
+
+    def close_all(self):
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle.clear()
+
+class QueryCache:
+    """Caché LRU de resultados, validada contra la versión de cada archivo consultado."""
+
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, versions):
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None or cached[0] != versions:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+    def put(self, key, versions, result):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (versions, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+class FederatedQuery:
+    """
+    Ejecuta una misma consulta SQL sobre todos los archivos de temporada/formato
+    seleccionados, en paralelo, y une los resultados. Cada fila resultante lleva
+    delante las columnas season_id y format del archivo de origen.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, cache_size=DEFAULT_CACHE_SIZE):
+        self.pool = ConnectionPool()
+        self.cache = QueryCache(cache_size)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _query_file(self, db_path, identity, sql, params):
+        conn = self.pool.acquire(db_path, identity)
+        try:
+            cursor = conn.execute(sql, params)
+            columns = [description[0] for description in cursor.description or []]
+            rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            # Una conexión con error puede haber quedado en mal estado; no la reutilizamos
+            conn.close()
+            if 'not authorized' in str(e):
+                raise ReadOnlyQueryError(f"Solo se permiten consultas de lectura ({e}).") from e
+            raise
+        self.pool.release(db_path, conn, identity)
+        return columns, rows
+
+    def query(self, sql, params=(), seasons=None, formats=None, use_cache=True):
+        params = parse_params(params)
+        targets = discover_season_dbs(seasons, formats)
+        manifest = database.load_archive_manifest()
+        versions = tuple(get_file_version(db_path, manifest) for _, _, db_path in targets)
+        cache_key = (sql, params, tuple(db_path for _, _, db_path in targets))
+
+        if use_cache:
+            cached = self.cache.get(cache_key, versions)
+            if cached is not None:
+                return cached
+
+        futures = []
+        for season_id, db_format, db_path in targets:
+            identity = get_file_identity(db_path, manifest)
+            futures.append((season_id, db_format, self.executor.submit(self._query_file, db_path, identity, sql, params)))
+
+        columns = None
+        rows = []
+        errors = []
+        for season_id, db_format, future in futures:
+            try:
+                file_columns, file_rows = future.result()
+            except sqlite3.Error as e:
+                logging.warning(f"Error al consultar T{season_id}, F:{db_format}: {e}")
+                errors.append({'season_id': season_id, 'format': db_format, 'error': str(e)})
+                continue
+            if columns is None:
+                columns = ['season_id', 'format'] + file_columns
+            rows.extend([season_id, db_format] + list(row) for row in file_rows)
+
+        result = {
+            'columns': columns or ['season_id', 'format'],
+            'rows': rows,
+            'files': len(targets),
+            'errors': errors,
+        }
+        # Los resultados con errores (p. ej. archivo bloqueado) no se guardan en caché
+        if use_cache and not errors:
+            self.cache.put(cache_key, versions, result)
+        return result
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.pool.close_all()
+
+# --- Servidor HTTP local ---
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /health
+    GET  /query?sql=...&seasons=150-160&formats=wild,modern
+    POST /query  {"sql": "...", "params": [...], "seasons": "150-160", "formats": ["wild"]}
+    GET  /player/<nombre>  resumen de la temporada actual desde la caché de jugadores
+    """
+    federated = None
+    hot_cache = None
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _run_query(self, request):
+        sql = request.get('sql')
+        if not sql:
+            self._send_json(400, {'error': "Falta el parámetro 'sql'."})
+            return
+        try:
+            result = self.federated.query(
+                sql,
+                request.get('params'),
+                seasons=request.get('seasons'),
+                formats=request.get('formats'),
+                use_cache=request.get('cache', True),
+            )
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        self._send_json(200, result)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            payload = {'status': 'ok', 'cache': self.federated.cache.stats()}
+            if self.hot_cache is not None:
+                payload['hot_cache'] = self.hot_cache.stats()
+            self._send_json(200, payload)
+        elif url.path.startswith('/player/') and self.hot_cache is not None:
+            player = unquote(url.path[len('/player/'):])
+            summary = self.hot_cache.get_player_summary(player) if player else None
+            if summary is None:
+                self._send_json(404, {'error': 'Jugador vacío o sin temporada actual en seasons_data.json.'})
+            else:
+                self._send_json(200, summary)
+        elif url.path == '/query':
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            query.setdefault('params', ()) # Se decodifica y valida en query()
+            query['cache'] = query.get('cache', '1') != '0'
+            self._run_query(query)
+        else:
+            self._send_json(404, {'error': 'Ruta no encontrada.'})
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/query':
+            self._send_json(404, {'error': 'Ruta no encontrada.'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except (ValueError, json.JSONDecodeError):
+            self._send_json(400, {'error': 'Cuerpo JSON inválido.'})
+            return
+        self._run_query(request)
+
+    def log_message(self, format, *args):
+        logging.info(f"HTTP {self.address_string()} - {format % args}")
+
+def serve(federated, host=DEFAULT_HTTP_HOST, port=DEFAULT_HTTP_PORT, hot_cache=None):
+    QueryRequestHandler.federated = federated
+    QueryRequestHandler.hot_cache = hot_cache
+    server = ThreadingHTTPServer((host, port), QueryRequestHandler)
+    logging.info(f"Servidor de consultas federadas escuchando en http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Servidor interrumpido por el usuario.")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consultas sobre todas las bases de datos de temporada/formato.")
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS, help="Archivos consultados en paralelo.")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE, help="Resultados guardados en la caché LRU.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    query_parser = subparsers.add_parser('query', help="Ejecutar una consulta y mostrar el resultado.")
+    query_parser.add_argument('sql')
+    query_parser.add_argument('--params', default='[]', help="Parámetros en JSON, p. ej. '[\"quigua\"]'.")
+    query_parser.add_argument('--seasons', help="Temporada o rango, p. ej. 162 o 150-162.")
+    query_parser.add_argument('--formats', help="Formatos separados por coma, p. ej. wild,modern.")
+    query_parser.add_argument('--json', action='store_true', help="Salida en JSON.")
+
+    serve_parser = subparsers.add_parser('serve', help="Exponer las consultas por HTTP local.")
+    serve_parser.add_argument('--host', default=DEFAULT_HTTP_HOST)
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_HTTP_PORT)
+    serve_parser.add_argument('--hot-cache-players', type=int, default=20000,
+                              help="Jugadores en la caché de /player/<nombre> (0 la desactiva).")
+
+    args = parser.parse_args()
+    federated = FederatedQuery(max_workers=args.workers, cache_size=args.cache_size)
+    try:
+        if args.command == 'serve':
+            hot_cache = None
+            if args.hot_cache_players > 0:
+                from hot_cache import HotCache # Import diferido: solo lo necesita el servidor
+                hot_cache = HotCache(max_players=args.hot_cache_players)
+            serve(federated, args.host, args.port, hot_cache)
+        else:
+            result = federated.query(args.sql, args.params, seasons=args.seasons, formats=args.formats)
+            if args.json:
+                json.dump(result, sys.stdout, indent=2)
+                print()
+            else:
+                print('\t'.join(result['columns']))
+                for row in result['rows']:
+                    print('\t'.join('' if value is None else str(value) for value in row))
+                print(f"-- {len(result['rows'])} filas de {result['files']} archivos, {len(result['errors'])} errores.")
+    finally:
+        federated.close()
@@ -0,0 +1,406 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+# Importamos nuestros módulos
+import database
+import metrics
+from process_raw_battles import load_season_data
+
+# Caché en memoria de las batallas recientes por jugador de la temporada actual.
+# Se alimenta siguiendo (por rowid) los archivos de la temporada actual que escribe
+# el procesador, y solo para los jugadores que ya están en caché; un fallo de caché
+# carga al jugador desde disco una vez. Las consultas repetidas sobre jugadores
+# populares se responden sin tocar SQLite.
+
+# --- Configuración ---
+DEFAULT_MAX_PLAYERS = 20000
+DEFAULT_MAX_RECORDS = 500000 # Batallas recientes guardadas en total (límite de memoria)
+DEFAULT_RECENT_PER_PLAYER = 50
+DEFAULT_REFRESH_INTERVAL = 2.0 # Segundos mínimos entre dos lecturas de las filas nuevas
+READ_TIMEOUT = 5
+
+_ROW_COLUMNS = (
+    'battle_id', 'player_1', 'player_2', 'winner', 'format', 'mana_cap', 'ruleset', 'created_date',
+    'player_1_rating_initial', 'player_2_rating_initial', 'player_1_rating_final', 'player_2_rating_final',
+)
+_SELECT_COLUMNS = ', '.join(_ROW_COLUMNS)
+
+# --- Métricas ---
+HOT_CACHE_LOOKUPS = metrics.counter('hot_cache_lookups_total', 'Consultas a la caché de jugadores por resultado.', ['result'])
+HOT_CACHE_EVICTIONS = metrics.counter('hot_cache_evictions_total', 'Jugadores expulsados de la caché.')
+HOT_CACHE_PLAYERS = metrics.gauge('hot_cache_players', 'Jugadores en la caché.')
+HOT_CACHE_RECORDS = metrics.gauge('hot_cache_records', 'Batallas recientes guardadas en la caché.')
+HOT_CACHE_REFRESH_SECONDS = metrics.histogram('hot_cache_refresh_seconds', 'Duración de la lectura de filas nuevas.')
+HOT_CACHE_LOAD_SECONDS = metrics.histogram('hot_cache_disk_load_seconds', 'Duración de la carga de un jugador desde disco.')
+
+def date_to_timestamp(date_str):
+    return int(datetime.fromisoformat(date_str.replace('Z', '+00:00')).timestamp())
+
+def get_current_season_id(seasons_data, now=None):
+    """Primera temporada cuyo fin aún no llega (seasons_data viene ordenado por fin)."""
+    now = now or datetime.now(timezone.utc)
+    for season in seasons_data:
+        if datetime.fromisoformat(season['ends'].replace('Z', '+00:00')) > now:
+            return season['id']
+    return None
+
+class BattleRecord:
+    """Una batalla vista desde un jugador. __slots__ evita un dict por instancia."""
+    __slots__ = ('battle_id', 'created_ts', 'format', 'opponent', 'won', 'mana_cap', 'ruleset', 'rating_initial', 'rating_final')
+
+    def __init__(self, battle_id, created_ts, game_format, opponent, won, mana_cap, ruleset, rating_initial, rating_final):
+        self.battle_id = battle_id
+        self.created_ts = created_ts
+        self.format = game_format
+        self.opponent = opponent
+        self.won = won
+        self.mana_cap = mana_cap
+        self.ruleset = ruleset
+        self.rating_initial = rating_initial
+        self.rating_final = rating_final
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class PlayerEntry:
+    """
+    Agregados de la temporada completa por formato ([batallas, victorias, rating, ts])
+    más las últimas batallas en una deque acotada.
+    """
+    __slots__ = ('formats', 'recent')
+
+    def __init__(self, recent_limit):
+        self.formats = {}
+        self.recent = deque(maxlen=recent_limit)
+
+    def add(self, record):
+        stats = self.formats.get(record.format)
+        if stats is None:
+            stats = self.formats[record.format] = [0, 0, None, 0]
+        stats[0] += 1
+        stats[1] += record.won
+        if record.created_ts >= stats[3]:
+            stats[2], stats[3] = record.rating_final, record.created_ts
+        if not self.recent or record.created_ts >= self.recent[-1].created_ts:
+            self.recent.append(record)
+        else:
+            # Poco habitual (batallas tardías): reinsertar en orden
+            ordered = sorted(list(self.recent) + [record], key=lambda r: r.created_ts)
+            self.recent.clear()
+            self.recent.extend(ordered[-self.recent.maxlen:])
+
+    def summary(self):
+        formats = {}
+        for game_format, (battles, wins, rating, last_ts) in self.formats.items():
+            formats[game_format] = {
+                'battles': battles, 'wins': wins, 'losses': battles - wins,
+                'win_rate': round(wins / battles, 4) if battles else None,
+                'rating': rating, 'last_battle_ts': last_ts,
+            }
+        return {'formats': formats, 'recent': [record.to_dict() for record in reversed(self.recent)]}
+
+def records_from_row(row):
+    """Una fila de battles produce un registro por cada lado: (jugador, BattleRecord)."""
+    (battle_id, player_1, player_2, winner, game_format, mana_cap, ruleset, created_date,
+     rating_1_initial, rating_2_initial, rating_1_final, rating_2_final) = row
+    try:
+        created_ts = date_to_timestamp(created_date)
+    except (TypeError, ValueError):
+        created_ts = 0
+    return (
+        (player_1, BattleRecord(battle_id, created_ts, game_format, player_2, int(winner == player_1), mana_cap, ruleset, rating_1_initial, rating_1_final)),
+        (player_2, BattleRecord(battle_id, created_ts, game_format, player_1, int(winner == player_2), mana_cap, ruleset, rating_2_initial, rating_2_final)),
+    )
+
+class HotCache:
+    """
+    Caché LRU de jugadores de la temporada actual, acotada por jugadores y por total
+    de batallas recientes. Thread-safe: un lock protege las entradas y las marcas de
+    agua, y ninguna lectura de disco se hace con él tomado. La carga de un fallo es una
+    sola por jugador (los demás hilos esperan su evento) y lee hasta las marcas de agua
+    del momento; al insertar completa con las filas que el seguimiento aplicó mientras
+    tanto. El seguimiento aplica sus filas solo si la marca de agua no cambió desde que
+    las leyó. Así cada batalla se cuenta exactamente una vez.
+    """
+
+    def __init__(self, max_players=DEFAULT_MAX_PLAYERS, max_records=DEFAULT_MAX_RECORDS,
+                 recent_per_player=DEFAULT_RECENT_PER_PLAYER, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        self.max_players = max_players
+        self.max_records = max_records
+        self.recent_per_player = recent_per_player
+        self.refresh_interval = refresh_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._records = 0
+        self._lock = threading.Lock()
+        self._season_id = None
+        self._files = {} # ruta -> {'rowid': marca de agua, 'inode': inodo}
+        self._last_refresh = 0.0
+        self._refresh_lock = threading.Lock() # Un solo hilo lee las filas nuevas a la vez
+        self._loading = {} # jugador -> threading.Event de la carga en curso
+        self._generation = 0 # Cambia en cada _reset_locked: invalida las cargas en curso
+
+    # --- Seguimiento de los archivos de la temporada actual ---
+
+    def _season_files(self, season_id):
+        from federated_query import discover_season_dbs # Import diferido: evita un ciclo con el servidor
+        return [db_path for _, _, db_path in discover_season_dbs(str(season_id))]
+
+    def _open(self, db_path):
+        return sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=READ_TIMEOUT)
+
+    def _scan_files(self, season_id):
+        """Marcas de agua iniciales (final de cada archivo) de una temporada. Lee disco: fuera del lock."""
+        files = {}
+        if season_id is None:
+            return files
+        for db_path in self._season_files(season_id):
+            files[db_path] = {'rowid': self._max_rowid(db_path), 'inode': os.stat(db_path).st_ino}
+            self._warn_unindexed(db_path)
+        return files
+
+    def _reset_locked(self, season_id, files):
+        """Vacía la caché y adopta las marcas de agua de _scan_files (sin precarga)."""
+        self._entries.clear()
+        self._records = 0
+        self._season_id = season_id
+        self._files = files
+        self._generation += 1
+        self._recount_and_evict()
+        if season_id is not None:
+            logging.info(f"Caché de jugadores iniciada para la temporada {season_id} ({len(files)} archivos).")
+
+    def _warn_unindexed(self, db_path):
+        conn = self._open(db_path)
+        try:
+            if database.missing_player_indexes(conn):
+                logging.warning(f"{db_path} no tiene índices por jugador: cada fallo de caché recorrerá la tabla. "
+                                "Ejecutar migrate_generated_columns.py.")
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            conn.close()
+
+    def _max_rowid(self, db_path):
+        conn = self._open(db_path)
+        try:
+            return conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM battles").fetchone()[0]
+        except sqlite3.OperationalError:
+            return 0
+        finally:
+            conn.close()
+
+    def _refresh(self, force=False):
+        """
+        Sigue las filas nuevas de los archivos de la temporada. La lectura se hace fuera
+        del lock global (un solo hilo a la vez, con _refresh_lock); bajo el lock solo se
+        aplican las filas de cada archivo cuya marca de agua no cambió desde la lectura.
+        """
+        # Hasta la primera temporada cargada, las consultas esperan al hilo que la carga
+        if not self._refresh_lock.acquire(blocking=self._generation == 0):
+            return # Otro hilo ya está leyendo: se responde con lo que hay en caché
+        try:
+            with self._lock:
+                now = time.monotonic()
+                if not force and now - self._last_refresh < self.refresh_interval:
+                    return
+                self._last_refresh = now
+                generation = self._generation
+                season_id = self._season_id
+                files = {db_path: dict(state) for db_path, state in self._files.items()}
+                tracking = bool(self._entries)
+
+            current_season_id = get_current_season_id(load_season_data())
+            if current_season_id == season_id and generation:
+                with HOT_CACHE_REFRESH_SECONDS.time():
+                    updates = self._read_new_rows(season_id, files, tracking)
+                if updates is not None:
+                    with self._lock:
+                        if generation == self._generation:
+                            self._merge_locked(updates)
+                    return
+                logging.warning(f"Un archivo de la temporada {season_id} fue reemplazado. Reiniciando la caché de jugadores.")
+            new_files = self._scan_files(current_season_id)
+            with self._lock:
+                self._reset_locked(current_season_id, new_files)
+        finally:
+            self._refresh_lock.release()
+
+    def _read_new_rows(self, season_id, files, tracking):
+        """
+        Filas con rowid mayor que la marca de agua de cada archivo, sin el lock. Sin
+        jugadores en caché basta con el rowid máximo. Retorna None si un archivo fue
+        sustituido (snapshot de réplica, restauración): sus marcas de agua ya no valen.
+        """
+        updates = {}
+        for db_path in self._season_files(season_id):
+            try:
+                inode = os.stat(db_path).st_ino
+            except FileNotFoundError:
+                continue
+            state = files.get(db_path)
+            if state is None:
+                state = {'rowid': 0, 'inode': inode} # Formato nuevo: todo es nuevo
+                self._warn_unindexed(db_path)
+            elif state['inode'] != inode:
+                return None
+            update = {'inode': inode, 'from': state['rowid'], 'to': state['rowid'], 'rows': [], 'advance_only': not tracking}
+            if not tracking:
+                update['to'] = self._max_rowid(db_path)
+            else:
+                conn = self._open(db_path)
+                try:
+                    update['rows'] = conn.execute(
+                        f"SELECT rowid, {_SELECT_COLUMNS} FROM battles WHERE rowid > ? ORDER BY rowid", (state['rowid'],)
+                    ).fetchall()
+                except sqlite3.OperationalError as e:
+                    logging.warning(f"No se pudieron leer las filas nuevas de {db_path}: {e}")
+                    continue
+                finally:
+                    conn.close()
+                if update['rows']:
+                    update['to'] = update['rows'][-1][0]
+            updates[db_path] = update
+        return updates
+
+    def _merge_locked(self, updates):
+        """Aplica lo leído por _read_new_rows a los jugadores en caché, cada batalla una sola vez."""
+        for db_path, update in updates.items():
+            state = self._files.get(db_path)
+            if (state['rowid'] if state else 0) != update['from']:
+                continue # La marca avanzó mientras leíamos: la próxima lectura parte de ella
+            if update['advance_only'] and self._entries:
+                continue # Se cargó un jugador mientras leíamos solo el máximo: hay que leer las filas
+            if state is None:
+                state = self._files[db_path] = {'rowid': 0, 'inode': update['inode']}
+            for row in update['rows']:
+                for player, record in records_from_row(row[1:]):
+                    entry = self._entries.get(player)
+                    if entry is not None:
+                        entry.add(record)
+            state['rowid'] = update['to']
+        self._recount_and_evict()
+
+    # --- Carga y expulsión ---
+
+    def _read_player_rows(self, player, ranges):
+        """
+        Filas del jugador en cada archivo dentro de (desde, hasta] por rowid. Usa los
+        índices por jugador (un UNION de dos búsquedas en lugar de un OR que recorre la tabla).
+        """
+        rows = []
+        for db_path, (low, high) in ranges.items():
+            if high <= low:
+                continue
+            conn = self._open(db_path)
+            try:
+                rows.extend(conn.execute(
+                    f"SELECT {_SELECT_COLUMNS} FROM battles WHERE player_1 = ?1 AND rowid > ?2 AND rowid <= ?3 "
+                    f"UNION SELECT {_SELECT_COLUMNS} FROM battles WHERE player_2 = ?1 AND rowid > ?2 AND rowid <= ?3",
+                    (player, low, high)
+                ).fetchall())
+            except sqlite3.OperationalError as e:
+                logging.warning(f"No se pudo cargar {player} desde {db_path}: {e}")
+            finally:
+                conn.close()
+        records = [record for row in rows for side_player, record in records_from_row(row) if side_player == player]
+        records.sort(key=lambda record: record.created_ts)
+        return records
+
+    def _load_player(self, player, watermarks):
+        """Fallo de caché, sin el lock: todas las batallas del jugador hasta las marcas dadas."""
+        entry = PlayerEntry(self.recent_per_player)
+        with HOT_CACHE_LOAD_SECONDS.time():
+            for record in self._read_player_rows(player, {db_path: (0, rowid) for db_path, rowid in watermarks.items()}):
+                entry.add(record)
+        return entry
+
+    def _install(self, player, entry, watermarks, generation):
+        """
+        Inserta una carga y retorna su resumen. Las filas que el seguimiento aplicó
+        después de las marcas de agua de la carga se leen fuera del lock (rango corto por
+        rowid); la inserción solo ocurre cuando las marcas ya no avanzaron entre medias.
+        """
+        while True:
+            with self._lock:
+                if generation != self._generation:
+                    return entry.summary() # Hubo un reinicio: la carga es de archivos viejos, no se guarda
+                current = {db_path: state['rowid'] for db_path, state in self._files.items()}
+                if current == watermarks:
+                    self._entries[player] = entry
+                    self._recount_and_evict()
+                    return entry.summary()
+            catch_up = {db_path: (watermarks.get(db_path, 0), rowid) for db_path, rowid in current.items()}
+            for record in self._read_player_rows(player, catch_up):
+                entry.add(record)
+            watermarks = current
+
+    def _recount_and_evict(self):
+        self._records = sum(len(entry.recent) for entry in self._entries.values())
+        while self._entries and (len(self._entries) > self.max_players or self._records > self.max_records):
+            _, evicted = self._entries.popitem(last=False)
+            self._records -= len(evicted.recent)
+            HOT_CACHE_EVICTIONS.inc()
+        HOT_CACHE_PLAYERS.set(len(self._entries))
+        HOT_CACHE_RECORDS.set(self._records)
+
+    # --- API de consulta ---
+
+    def get_player_summary(self, player):
+        """
+        Resumen de la temporada actual del jugador: agregados por formato y sus
+        batallas recientes. 'source' indica si vino de la caché o de disco.
+        """
+        while True:
+            self._refresh()
+            with self._lock:
+                if self._season_id is None:
+                    return None
+                season_id = self._season_id
+                entry = self._entries.get(player)
+                if entry is not None:
+                    self._entries.move_to_end(player)
+                    self.hits += 1
+                    HOT_CACHE_LOOKUPS.inc(result='hit')
+                    summary = entry.summary()
+                    source = 'cache'
+                    break
+                loading = self._loading.get(player)
+                if loading is None:
+                    # Este hilo carga al jugador; los demás esperan su evento en vez del lock global
+                    loading = self._loading[player] = threading.Event()
+                    self.misses += 1
+                    HOT_CACHE_LOOKUPS.inc(result='miss')
+                    generation = self._generation
+                    watermarks = {db_path: state['rowid'] for db_path, state in self._files.items()}
+                    is_loader = True
+                else:
+                    is_loader = False
+            if not is_loader:
+                loading.wait()
+                continue # Normalmente ya está en caché (salvo expulsión o reinicio): reintentar
+
+            try:
+                entry = self._load_player(player, watermarks)
+                summary = self._install(player, entry, watermarks, generation)
+            finally:
+                with self._lock:
+                    self._loading.pop(player, None)
+                    loading.set()
+            source = 'disk'
+            break
+        summary.update({'player': player, 'season_id': season_id, 'source': source})
+        return summary
+
+    def stats(self):
+        with self._lock:
+            return {
+                'season_id': self._season_id, 'players': len(self._entries), 'records': self._records,
+                'hits': self.hits, 'misses': self.misses,
+            }
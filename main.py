@@ -1,9 +1,7 @@
 import os
 import json
 import time
-import requests
 from binascii import hexlify
-from beem.message import sign_message
 from datetime import datetime, timezone
 import sqlite3
 import subprocess
@@ -11,22 +9,48 @@ import logging
 
 # Importamos nuestro nuevo módulo de base de datos
 import database
-
-# --- Configuración de Logging ---
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("/mnt/ssd/Splinterlands_Services/desarrollo.log"),
-        logging.StreamHandler()
-    ]
-)
-
+import metrics
+import profiling
 
 # --- Configuración ---
 API_BASE_URL = "https://api.splinterlands.com"
 
 PENDING_REQUESTS_FILE = "/mnt/ssd/Splinterlands_Services/pending_requests.json"
+# Token de login cacheado entre reinicios (el orquestador reinicia el servicio en cada ciclo).
+# TOKEN_CACHE=0 obliga a iniciar sesión en cada arranque.
+TOKEN_CACHE_FILE = os.getenv("TOKEN_CACHE_FILE", "/mnt/ssd/Splinterlands_Services/token_cache.json")
+TOKEN_CACHE_ENABLED = os.getenv("TOKEN_CACHE", "1") == "1"
+TOKEN_TTL_SECONDS = int(os.getenv("TOKEN_TTL_HOURS", "12")) * 3600
+AUTH_FAILURE_STATUS_CODES = (401, 403)
+BACKLOG_SAMPLE_EVERY = 20 # Escaneos entre mediciones del tamaño de raw_battles
+
+# --- Métricas ---
+API_REQUEST_SECONDS = metrics.histogram('splinterlands_api_request_seconds', 'Latencia de las llamadas al API de Splinterlands.', ['endpoint'])
+API_RESPONSES = metrics.counter('splinterlands_api_responses_total', 'Respuestas del API por código HTTP (o error de conexión).', ['endpoint', 'status'])
+API_RATE_LIMITED = metrics.counter('splinterlands_api_rate_limited_total', 'Respuestas HTTP 429 recibidas.')
+API_RETRIES = metrics.counter('splinterlands_api_retries_total', 'Reintentos de llamadas al API.', ['reason'])
+API_GAVE_UP = metrics.counter('splinterlands_api_exhausted_retries_total', 'Historiales abandonados tras agotar los reintentos.')
+CRAWLER_SCANS = metrics.counter('crawler_scans_total', 'Jugadores escaneados por carril.', ['lane'])
+CRAWLER_BATTLES = metrics.counter('crawler_battles_total', 'Batallas obtenidas del API por tipo.', ['kind'])
+CRAWLER_BATTLES_PER_SCAN = metrics.histogram(
+    'crawler_battles_per_scan', 'Batallas obtenidas, nuevas y duplicadas en cada escaneo.', ['kind'],
+    buckets=(0, 1, 5, 10, 20, 30, 40, 49, 50)
+)
+CRAWLER_SCHEDULER_LAG = metrics.histogram(
+    'crawler_scheduler_lag_seconds', 'Tiempo desde el escaneo anterior del jugador elegido.',
+    buckets=(60, 300, 900, 1800, 3600, 7200, 14400, 28800, 86400, 172800, 604800)
+)
+CRAWLER_SCAN_SECONDS = metrics.histogram('crawler_scan_seconds', 'Duración total del ciclo de un jugador.')
+CRAWLER_RAW_BACKLOG = metrics.gauge('crawler_raw_backlog_battles', 'Batallas pendientes en raw_battles.db.')
+CRAWLER_PLAYERS = metrics.gauge('crawler_players', 'Jugadores registrados en players.db.')
+MONITOR_STARTUP_SECONDS = metrics.gauge('monitor_startup_seconds', 'Tiempo desde el arranque hasta el primer escaneo.')
+AUTH_LOGINS = metrics.counter('splinterlands_logins_total', 'Obtención del token por origen.', ['source'])
+
+class AuthenticationError(Exception):
+    """El API rechazó el token (HTTP 401/403): hay que volver a iniciar sesión."""
+
+class BattleHistoryError(Exception):
+    """No se pudo obtener el historial (error HTTP, reintentos agotados o JSON inválido)."""
 
 def load_pending_requests():
     try:
@@ -42,11 +66,13 @@ def save_pending_requests(requests_list):
 # --- Funciones de API ---
 
 def compute_signature(string_to_sign, private_key):
+    from beem.message import sign_message # Import diferido: beem tarda en cargar y solo se usa al iniciar sesión
     bytestring_signature = sign_message(string_to_sign, private_key)
     hex_signature = hexlify(bytestring_signature).decode("ascii")
     return hex_signature
 
 def login_to_splinterlands(username, posting_key):
+    import requests
     logging.info("Iniciando login en Splinterlands...")
     ts = int(time.time() * 1000)
     message = f"{username}{ts}"
@@ -54,7 +80,9 @@ def login_to_splinterlands(username, posting_key):
     login_endpoint = f"{API_BASE_URL}/players/login?name={username}&ts={ts}&sig={signature}"
     
     try:
-        response = requests.get(login_endpoint, timeout=30)
+        with API_REQUEST_SECONDS.time(endpoint='login'):
+            response = requests.get(login_endpoint, timeout=30)
+        API_RESPONSES.inc(endpoint='login', status=str(response.status_code))
         response.raise_for_status()
         login_data = response.json()
         if login_data.get('name') == username and 'token' in login_data:
@@ -67,10 +95,14 @@ def login_to_splinterlands(username, posting_key):
         logging.error(f"Error durante el proceso de login: {e}")
         return None, None
 
-def get_player_battle_history(player, auth_user, auth_token):
+@profiling.timed('get_player_battle_history')
+def get_player_battle_history(player, auth_user, auth_token, raise_on_failure=False):
     """
     Obtiene las últimas 50 batallas de un jugador, con manejo de límites de tasa.
+    Ante un fallo retorna [] (el monitor volverá al jugador en la rotación), o lanza
+    BattleHistoryError con raise_on_failure para distinguirlo de un historial vacío.
     """
+    import requests
     endpoint = f"{API_BASE_URL}/battle/history?player={player}"
     auth_params = {'username': auth_user, 'token': auth_token}
     
@@ -81,7 +113,9 @@ def get_player_battle_history(player, auth_user, auth_token):
     while retries < max_retries:
         logging.info(f"Consultando historial para: {player} (Intento {retries + 1}/{max_retries})")
         try:
-            response = requests.get(endpoint, params=auth_params, timeout=30)
+            with API_REQUEST_SECONDS.time(endpoint='battle_history'):
+                response = requests.get(endpoint, params=auth_params, timeout=30)
+            API_RESPONSES.inc(endpoint='battle_history', status=str(response.status_code))
             response.raise_for_status() # Esto lanzará una excepción para códigos de error HTTP (4xx, 5xx)
 
             # La API puede devolver 'no battles' que no es JSON
@@ -94,7 +128,11 @@ def get_player_battle_history(player, auth_user, auth_token):
             return battles_data
 
         except requests.exceptions.HTTPError as e:
+            if e.response.status_code in AUTH_FAILURE_STATUS_CODES:
+                raise AuthenticationError(f"El API rechazó el token al consultar {player} (HTTP {e.response.status_code}).") from e
             if e.response.status_code == 429: # Too Many Requests
+                API_RATE_LIMITED.inc()
+                API_RETRIES.inc(reason='rate_limit')
                 retry_after = e.response.headers.get('Retry-After')
                 sleep_time = initial_sleep * (2 ** retries) # Exponential backoff
                 
@@ -109,27 +147,115 @@ def get_player_battle_history(player, auth_user, auth_token):
                 retries += 1
             else:
                 logging.error(f"Error HTTP al obtener historial de {player}: {e}")
+                if raise_on_failure:
+                    raise BattleHistoryError(f"HTTP {e.response.status_code} al consultar {player}.") from e
                 return [] # Other HTTP errors are not retried
         
         except requests.exceptions.RequestException as e:
             logging.error(f"Error de conexión al obtener historial de {player}: {e}")
+            API_RESPONSES.inc(endpoint='battle_history', status='error')
+            API_RETRIES.inc(reason='connection')
             # For connection errors, also apply a small backoff before retrying
             time.sleep(initial_sleep * (2 ** retries))
             retries += 1
         
         except json.JSONDecodeError as e:
             logging.error(f"Error de decodificación JSON para {player}: {e}. Respuesta: {response.text[:200]}...")
+            if raise_on_failure:
+                raise BattleHistoryError(f"Respuesta JSON inválida al consultar {player}.") from e
             return [] # JSON errors are not retried
 
     logging.error(f"Falló la obtención del historial de {player} después de {max_retries} reintentos debido a límites de tasa o errores de conexión.")
+    API_GAVE_UP.inc()
+    if raise_on_failure:
+        raise BattleHistoryError(f"Reintentos agotados al consultar {player}.")
     return []
 
+# --- Cache del token ---
+
+def load_cached_token(username):
+    """
+    Retorna el token cacheado si pertenece a `username`, no ha expirado y el archivo
+    solo es legible por el usuario actual. Cualquier otra cosa se trata como ausente.
+    """
+    try:
+        file_stat = os.stat(TOKEN_CACHE_FILE)
+        if file_stat.st_uid != os.getuid() or file_stat.st_mode & 0o077:
+            logging.warning(f"Permisos inseguros en {TOKEN_CACHE_FILE}; se ignora el token cacheado.")
+            return None
+        with open(TOKEN_CACHE_FILE, 'r') as f:
+            cached = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    except OSError as e:
+        logging.warning(f"No se pudo leer el token cacheado: {e}")
+        return None
+    if cached.get('name') != username or not cached.get('token'):
+        return None
+    if cached.get('expires_at', 0) <= time.time():
+        logging.info("El token cacheado expiró.")
+        return None
+    return cached['token']
+
+def save_cached_token(username, token):
+    """Escritura atómica con permisos 0600 desde la creación del archivo."""
+    now = int(time.time())
+    tmp_path = f"{TOKEN_CACHE_FILE}.tmp"
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'name': username, 'token': token, 'obtained_at': now, 'expires_at': now + TOKEN_TTL_SECONDS}, f)
+        os.chmod(tmp_path, 0o600) # Por si el .tmp ya existía con otros permisos
+        os.replace(tmp_path, TOKEN_CACHE_FILE)
+    except OSError as e:
+        logging.warning(f"No se pudo guardar el token en {TOKEN_CACHE_FILE}: {e}")
+
+def invalidate_cached_token():
+    try:
+        os.remove(TOKEN_CACHE_FILE)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.warning(f"No se pudo eliminar el token cacheado: {e}")
+
+def get_auth_token(username, posting_key, force_login=False):
+    """
+    Retorna (usuario, token). Usa el token cacheado si es válido; si no (o con
+    force_login), inicia sesión y cachea el token nuevo.
+    """
+    if TOKEN_CACHE_ENABLED and not force_login:
+        token = load_cached_token(username)
+        if token:
+            logging.info("Usando token cacheado; sin login.")
+            AUTH_LOGINS.inc(source='cache')
+            return username, token
+    user, token = login_to_splinterlands(username, posting_key)
+    if user and token:
+        AUTH_LOGINS.inc(source='login')
+        if TOKEN_CACHE_ENABLED:
+            save_cached_token(user, token)
+    return user, token
 
 # --- Lógica Principal del Monitor ---
 
 if __name__ == "__main__":
+    startup_start = time.perf_counter()
+
+    # --- Configuración de Logging ---
+    # Solo al ejecutar el monitor: backfill y el benchmark importan este módulo y
+    # conservan su propio logging.
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("/mnt/ssd/Splinterlands_Services/desarrollo.log"),
+            logging.StreamHandler()
+        ]
+    )
 
     logging.info("Iniciando el monitor de batallas de Splinterlands...")
+    metrics.start_from_env('monitor')
+    profiling.install('monitor')
     
     hive_username = os.getenv("HIVE_USERNAME")
     hive_posting_key = os.getenv("HIVE_POSTING_KEY")
@@ -138,7 +264,7 @@ if __name__ == "__main__":
         logging.error("¡Error! Las variables de entorno HIVE_USERNAME y HIVE_POSTING_KEY no están definidas.")
         exit()
 
-    user, token = login_to_splinterlands(hive_username, hive_posting_key)
+    user, token = get_auth_token(hive_username, hive_posting_key)
     if not user or not token:
         logging.error("No se pudo iniciar sesión. Abortando.")
         exit()
@@ -146,6 +272,7 @@ if __name__ == "__main__":
     # --- NUEVO: Inicialización de Conexiones ---
     players_db_conn = None
     raw_battles_conn = None
+    index_conn = None
     try:
         logging.info("Conectando a la base de datos de jugadores...")
         players_db_conn = database.get_players_db_connection()
@@ -160,6 +287,7 @@ if __name__ == "__main__":
             logging.error("No se pudo conectar a la base de datos de batallas crudas. Abortando.")
             exit()
         logging.info("Base de datos de batallas crudas conectada.")
+        index_conn = database.get_battle_index_connection() # Para distinguir batallas ya procesadas
 
         logging.info("Inicializando tablas...")
         database.initialize_players_table(players_db_conn)
@@ -174,14 +302,17 @@ if __name__ == "__main__":
         logging.info(f"Iniciando escaneo con {database.get_total_players(players_db_conn)} jugadores registrados...")
 
         # --- Bucle Principal ---
+        scans_since_backlog_sample = BACKLOG_SAMPLE_EVERY
         while True:
             pending_requests = load_pending_requests()
             priority_players_names = [req['target_username'] for req in pending_requests if req.get('status') == "DETECTED" and req.get('target_username')]
             
             current_player = None
+            scan_lane = 'rotation'
             if priority_players_names:
                 current_player = database.get_priority_player_to_scan(players_db_conn, priority_players_names)
                 if current_player:
+                    scan_lane = 'priority'
                     logging.info(f"Priorizando escaneo para el jugador: {current_player} (solicitud pendiente).")
 
             if not current_player:
@@ -191,9 +322,32 @@ if __name__ == "__main__":
                     time.sleep(0.5)
                     continue
 
-            logging.info(f"Procesando jugador: {current_player}")
-            battles = get_player_battle_history(current_player, user, token)
+            scan_start = time.perf_counter()
+            CRAWLER_SCANS.inc(lane=scan_lane)
+            last_scanned = database.get_player_last_scanned(players_db_conn, current_player)
+            if last_scanned:
+                CRAWLER_SCHEDULER_LAG.observe(max(0, int(time.time()) - last_scanned))
 
+            logging.info(f"Procesando jugador: {current_player}")
+            if startup_start is not None:
+                MONITOR_STARTUP_SECONDS.set(round(time.perf_counter() - startup_start, 3))
+                logging.info(f"Monitor listo para escanear en {time.perf_counter() - startup_start:.3f} s.")
+                startup_start = None
+            try:
+                battles = get_player_battle_history(current_player, user, token)
+            except AuthenticationError as e:
+                # Único caso en que se repite el login: el token cacheado/actual fue rechazado
+                logging.warning(f"{e} Iniciando sesión de nuevo.")
+                invalidate_cached_token()
+                user, token = get_auth_token(hive_username, hive_posting_key, force_login=True)
+                if not user or not token:
+                    logging.error("No se pudo volver a iniciar sesión. Abortando.")
+                    break
+                battles = get_player_battle_history(current_player, user, token)
+            CRAWLER_BATTLES.inc(len(battles), kind='fetched')
+            CRAWLER_BATTLES_PER_SCAN.observe(len(battles), kind='fetched')
+
+            new_battles_count = 0
             if not battles:
                 logging.info(f"No se encontraron batallas para {current_player} en la API.")
             else:
@@ -215,18 +369,38 @@ if __name__ == "__main__":
                     if player_2: players_to_add_update.add(player_2)
                 
                 if battles_to_insert:
-                    # --- MODIFICADO: Usar la conexión existente ---
-                    database.insert_raw_battles_batch(raw_battles_conn, battles_to_insert)
-                    logging.info(f"Batch inserted {len(battles_to_insert)} raw battles for {current_player}.")
+                    # Nuevas = ausentes de raw_battles y de battle_index.db: el procesador vacía raw_battles
+                    # en cada ciclo, y sin el índice todo el historial re-consultado volvería a contar como nuevo.
+                    processed_ids = database.get_processed_battle_ids(index_conn, [b['battle_queue_id_1'] for b in battles_to_insert])
+                    unprocessed_battles = [b for b in battles_to_insert if b['battle_queue_id_1'] not in processed_ids]
+                    if unprocessed_battles:
+                        new_battles_count = database.insert_raw_battles_batch(raw_battles_conn, unprocessed_battles)
+                    CRAWLER_BATTLES.inc(new_battles_count, kind='new')
+                    CRAWLER_BATTLES.inc(len(battles_to_insert) - new_battles_count, kind='duplicate')
+                    CRAWLER_BATTLES_PER_SCAN.observe(new_battles_count, kind='new')
+                    CRAWLER_BATTLES_PER_SCAN.observe(len(battles_to_insert) - new_battles_count, kind='duplicate')
+                    logging.info(f"Batch inserted {new_battles_count} new raw battles ({len(battles_to_insert) - new_battles_count} already known) for {current_player}.")
                 
                 if players_to_add_update:
                     database.add_or_update_players_batch(players_db_conn, list(players_to_add_update))
                     logging.info(f"Batch updated {len(players_to_add_update)} players for {current_player}.")
 
-            logging.info(f"Ciclo para {current_player} completado. Total de jugadores registrados: {database.get_total_players(players_db_conn)}")
-            database.add_or_update_players_batch(players_db_conn, [current_player])
+            total_players = database.get_total_players(players_db_conn)
+            CRAWLER_PLAYERS.set(total_players)
+            logging.info(f"Ciclo para {current_player} completado. Total de jugadores registrados: {total_players}")
+            database.add_or_update_players_batch(
+                players_db_conn, [current_player],
+                lane=scan_lane, activity_tier=database.classify_activity_tier(new_battles_count)
+            )
+            database.record_scan(players_db_conn, scan_lane)
             logging.info(f"Timestamp para {current_player} actualizado.")
 
+            scans_since_backlog_sample += 1
+            if scans_since_backlog_sample >= BACKLOG_SAMPLE_EVERY:
+                CRAWLER_RAW_BACKLOG.set(database.get_raw_backlog_count(raw_battles_conn))
+                scans_since_backlog_sample = 0
+            CRAWLER_SCAN_SECONDS.observe(time.perf_counter() - scan_start)
+
             if current_player in priority_players_names:
                 for req in pending_requests:
                     if req.get('target_username') == current_player and req.get('status') == "DETECTED":
@@ -250,4 +424,6 @@ if __name__ == "__main__":
         if raw_battles_conn:
             raw_battles_conn.close()
             logging.info("Conexión a la base de datos de batallas crudas cerrada.")
+        if index_conn:
+            index_conn.close()
         logging.info("Proceso de escaneo completado.")
@@ -0,0 +1,256 @@
+import os
+import json
+import time
+import logging
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Registro de métricas compartido por main.py, process_raw_battles.py y database.py.
+# Cada proceso tiene su propio registro; se exponen en formato Prometheus por HTTP
+# local y/o como snapshots JSON periódicos. Sin dependencias externas.
+
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DEFAULT_SNAPSHOT_INTERVAL = 60 # segundos
+DEFAULT_HTTP_HOST = '127.0.0.1'
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Se esperaban las etiquetas {labelnames}, se recibieron {tuple(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, key)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            samples = [{'labels': dict(zip(self.labelnames, key)), 'value': value} for key, value in sorted(self._values.items())]
+        return {'type': self.type_name, 'help': self.documentation, 'samples': samples}
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+        return False
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            state['counts'][bisect_left(self.buckets, value)] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def time(self, **labels):
+        """Context manager que observa la duración del bloque en segundos."""
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), state['counts']):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, (('le', _format_value(float(bound))),))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state['sum'])}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state['count']}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            samples = [
+                {
+                    'labels': dict(zip(self.labelnames, key)),
+                    'count': state['count'],
+                    'sum': state['sum'],
+                    'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], state['counts'])),
+                }
+                for key, state in sorted(self._values.items())
+            ]
+        return {'type': self.type_name, 'help': self.documentation, 'samples': samples}
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"La métrica {name} ya existe con otro tipo o etiquetas.")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render_prometheus(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {'timestamp': time.time(), 'pid': os.getpid(), 'metrics': {m.name: m.snapshot() for m in metrics}}
+
+REGISTRY = MetricsRegistry()
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.counter(name, documentation, labelnames)
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.gauge(name, documentation, labelnames)
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+    return REGISTRY.histogram(name, documentation, labelnames, buckets)
+
+# --- Exposición ---
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] in ('/metrics', '/'):
+            body = self.registry.render_prometheus().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path.split('?')[0] == '/metrics.json':
+            body = json.dumps(self.registry.snapshot()).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # No llenar los logs con cada scrape
+
+def start_http_server(port, host=DEFAULT_HTTP_HOST, registry=REGISTRY):
+    """Sirve /metrics (Prometheus) y /metrics.json en un hilo demonio."""
+    handler = type('BoundMetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logging.info(f"Métricas disponibles en http://{host}:{port}/metrics")
+    return server
+
+def write_snapshot(path, registry=REGISTRY):
+    """Escribe un snapshot JSON de forma atómica."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(registry.snapshot(), f, indent=2)
+    os.replace(tmp_path, path)
+
+def start_snapshot_writer(path, interval=DEFAULT_SNAPSHOT_INTERVAL, registry=REGISTRY):
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot(path, registry)
+            except OSError as e:
+                logging.warning(f"No se pudo escribir el snapshot de métricas en {path}: {e}")
+    threading.Thread(target=loop, name='metrics-snapshot', daemon=True).start()
+
+def start_from_env(service):
+    """
+    Activa la exposición según variables de entorno con el prefijo del servicio:
+    <SERVICE>_METRICS_PORT, <SERVICE>_METRICS_SNAPSHOT (ruta) y METRICS_SNAPSHOT_INTERVAL.
+    Retorna la ruta del snapshot (o None) para que el llamador escriba el final.
+    """
+    prefix = service.upper()
+    port = os.getenv(f"{prefix}_METRICS_PORT")
+    snapshot_path = os.getenv(f"{prefix}_METRICS_SNAPSHOT")
+    if port:
+        try:
+            start_http_server(int(port))
+        except OSError as e:
+            logging.warning(f"No se pudo iniciar el servidor de métricas en el puerto {port}: {e}")
+    if snapshot_path:
+        start_snapshot_writer(snapshot_path, int(os.getenv("METRICS_SNAPSHOT_INTERVAL", DEFAULT_SNAPSHOT_INTERVAL)))
+    return snapshot_path
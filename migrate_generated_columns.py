@@ -0,0 +1,104 @@
+import os
+import shutil
+import sqlite3
+import logging
+import argparse
+from datetime import datetime, timezone
+
+# Importamos nuestros módulos
+import database
+from federated_query import discover_season_dbs
+
+# --- Configuración de Logging ---
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler() # Log to console
+    ]
+)
+
+def migrate_live_db(season_id, db_format):
+    conn = database.get_structured_db_connection(season_id, db_format)
+    try:
+        created = database.ensure_generated_columns(conn) + database.ensure_player_indexes(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    return created
+
+def migrate_archived_db(db_path, manifest):
+    """
+    Añade las columnas a un archivo archivado y actualiza su checksum en el manifiesto.
+    El archivo nunca se modifica en su sitio (los lectores lo abren con immutable=1):
+    se migra una copia y se reemplaza con os.replace, como hace archive_seasons.
+    """
+    conn = database.get_archived_db_connection(db_path)
+    try:
+        pending = database.missing_generated_columns(conn) + database.missing_player_indexes(conn)
+    finally:
+        conn.close()
+    if not pending:
+        return []
+
+    tmp_path = f"{db_path}.migrate.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    shutil.copyfile(db_path, tmp_path)
+    os.chmod(tmp_path, 0o644)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        conn.execute('PRAGMA journal_mode=DELETE')
+        created = database.ensure_generated_columns(conn) + database.ensure_player_indexes(conn)
+        conn.commit()
+        conn.execute("ANALYZE")
+        conn.commit()
+        check_result = conn.execute('PRAGMA quick_check').fetchone()[0]
+        conn.close()
+        if check_result != 'ok':
+            raise sqlite3.DatabaseError(f"quick_check de la copia migrada: {check_result}")
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    entry = manifest[database.get_archive_key(db_path)]
+    entry['size'] = os.path.getsize(tmp_path)
+    entry['sha256'] = database.file_sha256(tmp_path)
+    entry['migrated_at'] = datetime.now(timezone.utc).isoformat()
+    os.chmod(tmp_path, 0o444) # Solo lectura: el archivo ya no debe cambiar
+    os.replace(tmp_path, db_path)
+    database.save_archive_manifest(manifest)
+    return created
+
+def migrate_all(seasons=None, formats=None, include_archived=False):
+    manifest = database.load_archive_manifest()
+    migrated_count = 0
+    for season_id, db_format, db_path in discover_season_dbs(seasons, formats):
+        key = database.get_archive_key(db_path)
+        try:
+            if key in manifest:
+                if not include_archived:
+                    logging.info(f"{key} está archivado. Saltando (usar --include-archived).")
+                    continue
+                created = migrate_archived_db(db_path, manifest)
+            else:
+                created = migrate_live_db(season_id, db_format)
+        except sqlite3.Error as e:
+            logging.error(f"Error de SQLite al migrar {key}: {e}")
+            continue
+
+        if created:
+            migrated_count += 1
+            logging.info(f"{key}: creados {', '.join(created)}.")
+        else:
+            logging.info(f"{key}: ya estaba al día.")
+
+    logging.info(f"Migración completada. Archivos modificados: {migrated_count}.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Añade las columnas generadas, sus índices y los índices por jugador a las bases de datos de temporada existentes.")
+    parser.add_argument('--seasons', help="Temporada o rango, p. ej. 162 o 150-162.")
+    parser.add_argument('--formats', help="Formatos separados por coma, p. ej. wild,modern.")
+    parser.add_argument('--include-archived', action='store_true', help="Migrar también los archivos archivados (se reemplazan por una copia migrada).")
+    args = parser.parse_args()
+    migrate_all(args.seasons, args.formats, args.include_archived)
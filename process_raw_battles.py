@@ -1,27 +1,64 @@
 import os
 import json
+import time
 import logging
 from datetime import datetime, timezone
 import sqlite3 # Import sqlite3 directly for batch operations
 
-# Importamos nuestro módulo de base de datos
+# Importamos nuestros módulos
 import database
-
-# --- Configuración de Logging ---
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("/mnt/ssd/Splinterlands_Services/process_raw_battles.log"),
-        logging.StreamHandler()
-    ]
-)
+import metrics
+import profiling
+import ratings
 
 # --- Rutas de Archivos ---
 DB_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
 RAW_BATTLES_DB = os.path.join(DB_FOLDER, "raw_battles.db")
 SEASONS_DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "seasons_data.json")
 
+# --- Métricas ---
+PROCESSOR_BATTLES = metrics.counter('processor_battles_total', 'Batallas crudas por resultado (processed, duplicate, skipped, archived).', ['result'])
+PROCESSOR_RAW_BACKLOG = metrics.gauge('processor_raw_backlog_battles', 'Batallas en raw_battles.db al iniciar el procesamiento.')
+PROCESSOR_DESTINATION_ROWS = metrics.counter('processor_destination_rows_total', 'Filas nuevas insertadas por destino (sin las ignoradas por duplicadas).', ['season', 'format'])
+PROCESSOR_DESTINATION_INSERT_SECONDS = metrics.histogram('processor_destination_insert_seconds', 'Duración de la escritura de un lote por destino (batallas, uso de cartas y ratings, sin el commit).', ['format'])
+PROCESSOR_DESTINATION_ROWS_PER_SECOND = metrics.gauge('processor_destination_rows_per_second', 'Filas nuevas por segundo del último lote por destino.', ['season', 'format'])
+PROCESSOR_RUN_SECONDS = metrics.gauge('processor_run_seconds', 'Duración de la última ejecución del procesador.')
+
+# Extraer filas de uso de cartas (tabla card_usage) al procesar. Activar con EXTRACT_CARD_USAGE=1.
+EXTRACT_CARD_USAGE = os.getenv("EXTRACT_CARD_USAGE", "0") == "1"
+
+# --- Funciones de Cartas ---
+def extract_card_usage(battle_id, battle):
+    """
+    Extrae las cartas de ambos equipos desde 'details' como filas
+    (battle_id, side, slot, card_id, level, won, mana_cap). Retorna [] si la batalla
+    no tiene equipos (p. ej. rendición antes de enviar el equipo).
+    """
+    details = battle.get('details')
+    if isinstance(details, str):
+        try:
+            details = json.loads(details)
+        except json.JSONDecodeError:
+            logging.warning(f"No se pudo decodificar details para la batalla {battle_id}. Sin uso de cartas.")
+            return []
+    if not isinstance(details, dict):
+        return []
+
+    winner = details.get('winner') or battle.get('winner')
+    mana_cap = battle.get('mana_cap')
+    rows = []
+    for side, team_key in ((1, 'team1'), (2, 'team2')):
+        team = details.get(team_key)
+        if not team:
+            continue
+        won = 1 if winner and team.get('player') == winner else 0
+        cards = [team.get('summoner')] + list(team.get('monsters') or [])
+        for slot, card in enumerate(cards):
+            if not card or card.get('card_detail_id') is None:
+                continue
+            rows.append((battle_id, side, slot, int(card['card_detail_id']), card.get('level'), won, mana_cap))
+    return rows
+
 # --- Funciones de Temporada ---
 def determine_battle_format(battle, match_type, game_format):
     """
@@ -57,6 +94,7 @@ def load_season_data():
         logging.error(f"Error al cargar los datos de las temporadas desde {SEASONS_DATA_FILE}: {e}")
         return []
 
+@profiling.timed('get_season_id_from_date')
 def get_season_id_from_date(battle_date_str, seasons_data):
     """
     Determina el ID de la temporada a la que pertenece una batalla
@@ -99,9 +137,102 @@ def get_season_id_from_date(battle_date_str, seasons_data):
         logging.error(f"Error al parsear la fecha de la batalla '{battle_date_str}': {e}")
         return None
 
+# --- Filas Estructuradas ---
+def build_structured_row(battle_id, battle, seasons_data):
+    """
+    Ubica una batalla del API en su destino y construye la fila en el orden de
+    database.STRUCTURED_BATTLE_COLUMNS. Retorna (season_id, formato, fila) o None
+    si no tiene fecha o no se puede determinar su temporada.
+    """
+    created_date = battle.get('created_date')
+    match_type = battle.get('match_type')
+    game_format = battle.get('format')
+
+    if not created_date:
+        logging.warning(f"Batalla {battle_id} no tiene 'created_date'. Saltando.")
+        return None
+
+    season_id = get_season_id_from_date(created_date, seasons_data)
+    if season_id is None:
+        logging.warning(f"No se pudo determinar la temporada para la batalla {battle_id}. Saltando.")
+        return None
+
+    final_format = determine_battle_format(battle, match_type, game_format)
+    battle_data_tuple = (
+        battle_id,
+        battle.get('player_1'),
+        battle.get('player_2'),
+        battle.get('winner'),
+        battle.get('loser'),
+        match_type,
+        final_format,
+        battle.get('mana_cap'),
+        battle.get('ruleset'),
+        created_date,
+        battle.get('player_1_rating_initial'),
+        battle.get('player_2_rating_initial'),
+        battle.get('player_1_rating_final'),
+        battle.get('player_2_rating_final'),
+        json.dumps(battle) # Store the original full JSON
+    )
+    return season_id, final_format, battle_data_tuple
+
+def write_destination_batch(season_id, final_format, battles_to_insert_batch, card_usage_rows=None):
+    """
+    Inserta un lote en la base de datos de una temporada/formato en una sola
+    transacción: batallas (INSERT OR IGNORE), uso de cartas y ratings.
+    Retorna cuántas batallas eran nuevas en ese archivo.
+    """
+    db_path = database.get_structured_db_path(season_id, final_format)
+    inode = os.stat(db_path).st_ino if os.path.exists(db_path) else None
+    structured_db_conn = database.get_structured_db_connection(season_id, final_format)
+    if not structured_db_conn:
+        raise Exception(f"No se pudo conectar a la DB estructurada para Temporada {season_id}, Formato {final_format}. Abortando.")
+
+    database.initialize_structured_battle_table(structured_db_conn) # Ensure table exists
+    database.initialize_rating_tables(structured_db_conn)
+    if card_usage_rows:
+        database.initialize_card_usage_table(structured_db_conn)
+
+    # archive_seasons reemplaza el archivo con el bloqueo de escritura tomado: si el
+    # inodo cambió mientras esperábamos, esta conexión apunta al archivo huérfano.
+    structured_db_conn.execute('BEGIN IMMEDIATE')
+    if inode is not None and (not os.path.exists(db_path) or os.stat(db_path).st_ino != inode):
+        structured_db_conn.rollback()
+        structured_db_conn.close()
+        raise Exception(f"T{season_id}, F:{final_format} fue archivada durante la escritura. Abortando el lote.")
+
+    insert_start = time.perf_counter()
+    cursor = structured_db_conn.cursor()
+    changes_before = structured_db_conn.total_changes
+    with profiling.span('structured_executemany'):
+        cursor.executemany('''
+            INSERT OR IGNORE INTO battles (
+                battle_id, player_1, player_2, winner, loser, match_type, format,
+                mana_cap, ruleset, created_date, player_1_rating_initial,
+                player_2_rating_initial, player_1_rating_final, player_2_rating_final,
+                full_battle_json
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', battles_to_insert_batch)
+    new_rows = structured_db_conn.total_changes - changes_before
+    database.insert_card_usage_batch(structured_db_conn, card_usage_rows)
+    ratings.update_ratings(structured_db_conn, battles_to_insert_batch)
+    insert_seconds = time.perf_counter() - insert_start
+    database.timed_commit(structured_db_conn, 'structured') # Commit the batch
+    PROCESSOR_DESTINATION_INSERT_SECONDS.observe(insert_seconds, format=final_format)
+    PROCESSOR_DESTINATION_ROWS.inc(new_rows, season=season_id, format=final_format)
+    database.DB_ROWS_WRITTEN.inc(new_rows, db='structured')
+    if insert_seconds > 0:
+        PROCESSOR_DESTINATION_ROWS_PER_SECOND.set(round(new_rows / insert_seconds, 1), season=season_id, format=final_format)
+    logging.info(f"Lote de {len(battles_to_insert_batch)} batallas insertado en T{season_id}, F:{final_format} ({new_rows} nuevas).")
+    structured_db_conn.close()
+    return new_rows
+
 # --- Lógica Principal del Procesador ---
-def process_raw_battles():
+def process_raw_battles(extract_card_usage_rows=EXTRACT_CARD_USAGE):
     logging.info("Iniciando el procesador de batallas crudas...")
+    run_start = time.perf_counter()
 
     raw_battles_conn = database.get_raw_battles_db_connection()
     if not raw_battles_conn:
@@ -121,86 +252,54 @@ def process_raw_battles():
     cursor.execute("SELECT battle_id, battle_data FROM raw_battles")
     battles_to_process = cursor.fetchall()
     raw_battles_conn.close() # Close raw_battles_conn early as we have fetched all data
+    PROCESSOR_RAW_BACKLOG.set(len(battles_to_process))
 
     processed_ids = []
     skipped_count = 0
+    archived_battles = []
+    archive_manifest = database.load_archive_manifest()
     
     battles_by_db_destination = {}
+    card_usage_by_db_destination = {}
 
     for battle_id, battle_data_json in battles_to_process:
         battle = json.loads(battle_data_json) # This will raise JSONDecodeError if invalid
 
-        created_date = battle.get('created_date')
-        match_type = battle.get('match_type')
-        game_format = battle.get('format')
-
-        if not created_date:
-            logging.warning(f"Batalla {battle_id} no tiene 'created_date'. Saltando.")
+        destination = build_structured_row(battle_id, battle, seasons_data)
+        if destination is None:
             skipped_count += 1
             continue
+        season_id, final_format, battle_data_tuple = destination
 
-        season_id = get_season_id_from_date(created_date, seasons_data)
-        if season_id is None:
-            logging.warning(f"No se pudo determinar la temporada para la batalla {battle_id}. Saltando.")
-            skipped_count += 1
+        # Las temporadas archivadas son inmutables: la batalla pasa a la cuarentena de raw_battles.db
+        if database.get_archive_key(database.get_structured_db_path(season_id, final_format)) in archive_manifest:
+            archived_battles.append((battle_id, season_id, final_format, battle_data_json))
             continue
-        
-        final_format = determine_battle_format(battle, match_type, game_format)
-
-        battle_data_tuple = (
-            battle_id,
-            battle.get('player_1'),
-            battle.get('player_2'),
-            battle.get('winner'),
-            battle.get('loser'),
-            match_type,
-            final_format,
-            battle.get('mana_cap'),
-            battle.get('ruleset'),
-            created_date,
-            battle.get('player_1_rating_initial'),
-            battle.get('player_2_rating_initial'),
-            battle.get('player_1_rating_final'),
-            battle.get('player_2_rating_final'),
-            json.dumps(battle) # Store the original full JSON
-        )
 
         db_key = (season_id, final_format)
         if db_key not in battles_by_db_destination:
             battles_by_db_destination[db_key] = []
         battles_by_db_destination[db_key].append(battle_data_tuple)
+        if extract_card_usage_rows:
+            card_usage_by_db_destination.setdefault(db_key, []).extend(extract_card_usage(battle_id, battle))
         
         processed_ids.append(battle_id)
 
     # --- Batch insert into structured databases ---
     total_inserted_structured = 0
+    total_new_structured = 0
     for (season_id, final_format), battles_to_insert_batch in battles_by_db_destination.items():
-        structured_db_conn = database.get_structured_db_connection(season_id, final_format)
-        if not structured_db_conn:
-            raise Exception(f"No se pudo conectar a la DB estructurada para Temporada {season_id}, Formato {final_format}. Abortando.")
-        
-        database.initialize_structured_battle_table(structured_db_conn) # Ensure table exists
-        
-        cursor = structured_db_conn.cursor()
-        cursor.executemany('''
-            INSERT OR IGNORE INTO battles (
-                battle_id, player_1, player_2, winner, loser, match_type, format,
-                mana_cap, ruleset, created_date, player_1_rating_initial,
-                player_2_rating_initial, player_1_rating_final, player_2_rating_final,
-                full_battle_json
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', battles_to_insert_batch)
-        structured_db_conn.commit() # Commit the batch
+        total_new_structured += write_destination_batch(season_id, final_format, battles_to_insert_batch,
+                                                        card_usage_by_db_destination.get((season_id, final_format)))
         total_inserted_structured += len(battles_to_insert_batch)
-        logging.info(f"Lote de {len(battles_to_insert_batch)} batallas insertado en T{season_id}, F:{final_format}.")
-        structured_db_conn.close()
 
     # --- Batch insert into battle index ---
     if processed_ids:
         cursor = index_conn.cursor()
+        changes_before = index_conn.total_changes
         cursor.executemany("INSERT OR IGNORE INTO processed_battles (battle_id) VALUES (?)", [(pid,) for pid in processed_ids])
-        index_conn.commit() # Commit the index batch
+        database.timed_commit(index_conn, 'battle_index') # Commit the index batch
+        database.DB_ROWS_WRITTEN.inc(index_conn.total_changes - changes_before, db='battle_index')
         logging.info(f"Lote de {len(processed_ids)} IDs de batalla insertado en el índice.")
     
     index_conn.close() # Close index connection after all operations
@@ -211,13 +310,47 @@ def process_raw_battles():
         if raw_battles_conn_for_delete:
             cursor = raw_battles_conn_for_delete.cursor()
             cursor.executemany("DELETE FROM raw_battles WHERE battle_id = ?", [(pid,) for pid in processed_ids])
-            raw_battles_conn_for_delete.commit()
+            database.timed_commit(raw_battles_conn_for_delete, 'raw_battles')
             logging.info(f"{len(processed_ids)} batallas procesadas eliminadas de raw_battles.db.")
             raw_battles_conn_for_delete.close()
     else:
         logging.warning("No se eliminaron batallas de raw_battles.db porque no todas se insertaron correctamente en las DBs estructuradas o el índice.")
 
-    logging.info(f"Procesador de batallas crudas finalizado. Procesadas (intentadas): {len(battles_to_process)}, Insertadas en estructuradas: {total_inserted_structured}, Saltadas: {skipped_count}.")
+    # --- Move battles of archived seasons to quarantine (logged once per destination) ---
+    archived_count = 0
+    if archived_battles:
+        raw_battles_conn_for_quarantine = database.get_raw_battles_db_connection()
+        archived_count = database.quarantine_archived_battles(raw_battles_conn_for_quarantine, archived_battles)
+        raw_battles_conn_for_quarantine.close()
+        per_destination = {}
+        for _, season_id, final_format, _ in archived_battles:
+            per_destination[(season_id, final_format)] = per_destination.get((season_id, final_format), 0) + 1
+        summary = ', '.join(f"T{season_id}/{final_format}: {count}" for (season_id, final_format), count in sorted(per_destination.items()))
+        logging.warning(f"{archived_count} batallas de temporadas ya archivadas movidas a archived_season_battles ({summary}).")
+
+    PROCESSOR_BATTLES.inc(len(processed_ids), result='processed')
+    PROCESSOR_BATTLES.inc(total_inserted_structured - total_new_structured, result='duplicate') # Ya estaban en su archivo
+    PROCESSOR_BATTLES.inc(skipped_count, result='skipped')
+    PROCESSOR_BATTLES.inc(archived_count, result='archived')
+    PROCESSOR_RUN_SECONDS.set(round(time.perf_counter() - run_start, 3))
+    logging.info(f"Procesador de batallas crudas finalizado. Procesadas (intentadas): {len(battles_to_process)}, Insertadas en estructuradas: {total_inserted_structured} ({total_new_structured} nuevas), Saltadas: {skipped_count}, En cuarentena (temporadas archivadas): {archived_count}.")
 
 if __name__ == "__main__":
-    process_raw_battles()
\ No newline at end of file
+    # --- Configuración de Logging ---
+    # Solo al ejecutar el procesador: archive_seasons, backfill, card_meta y hot_cache
+    # importan este módulo y no deben adoptar (ni necesitar) su archivo de log.
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("/mnt/ssd/Splinterlands_Services/process_raw_battles.log"),
+            logging.StreamHandler()
+        ]
+    )
+    metrics_snapshot_path = metrics.start_from_env('processor')
+    profiling.install('processor')
+    try:
+        process_raw_battles()
+    finally:
+        if metrics_snapshot_path:
+            metrics.write_snapshot(metrics_snapshot_path) # Snapshot final: el proceso termina enseguida
\ No newline at end of file
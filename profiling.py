@@ -0,0 +1,441 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import pstats
+import signal
+import logging
+import cProfile
+import argparse
+import functools
+import threading
+import tracemalloc
+import socketserver
+from datetime import datetime
+
+import metrics
+
+# Controles de perfilado bajo demanda para los procesos de larga duración
+# (main.py y process_raw_battles.py), sin reiniciarlos:
+#   SIGUSR1 -> activa/detiene el perfilado de CPU (muestreo de pilas o cProfile)
+#   SIGUSR2 -> activa tracemalloc / toma un snapshot y lo detiene
+#   Socket de control (<SERVICE>_PROFILING_SOCKET) -> comandos de texto, ver handle_command
+# Todos los resultados se escriben con marca de tiempo en PROFILE_DIR.
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(PROJECT_ROOT, 'data', 'profiles'))
+DEFAULT_CPU_MODE = os.getenv("PROFILE_CPU_MODE", 'sample') # 'sample' o 'cprofile'
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005")) # segundos entre muestras de pila
+TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "10"))
+TOP_STATS = 40 # Líneas en los resúmenes de texto
+
+SPAN_SECONDS = metrics.histogram('profiling_span_seconds', 'Duración de los spans de funciones críticas (si están activos).', ['span'])
+
+_service = 'proceso'
+_lock = threading.Lock()
+_cpu_profiler = None
+_previous_memory_snapshot = None
+_main_thread_actions = queue.SimpleQueue()
+
+# --- Spans ---
+# Con los spans desactivados, el costo es una comprobación de un global por llamada.
+_spans_enabled = False
+_span_stats = {}
+
+def spans_enabled():
+    return _spans_enabled
+
+def set_spans_enabled(enabled):
+    global _spans_enabled
+    _spans_enabled = bool(enabled)
+
+def _record_span(name, elapsed):
+    SPAN_SECONDS.observe(elapsed, span=name)
+    with _lock:
+        stats = _span_stats.get(name)
+        if stats is None:
+            _span_stats[name] = [1, elapsed, elapsed]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _record_span(self.name, time.perf_counter() - self.start)
+        return False
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def span(name):
+    """Context manager que mide el bloque solo si los spans están activos."""
+    return _Span(name) if _spans_enabled else _NULL_SPAN
+
+def timed(name=None):
+    """Decorador equivalente a span() alrededor de toda la función."""
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _spans_enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record_span(label, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def span_summary():
+    with _lock:
+        items = sorted(_span_stats.items(), key=lambda item: item[1][1], reverse=True)
+    return {
+        name: {'count': count, 'total_s': round(total, 6), 'mean_ms': round(1000 * total / count, 4), 'max_ms': round(1000 * longest, 4)}
+        for name, (count, total, longest) in items
+    }
+
+def reset_spans():
+    with _lock:
+        _span_stats.clear()
+
+# --- Archivos de salida ---
+
+def output_path(kind, extension):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    return os.path.join(PROFILE_DIR, f"{_service}-{kind}-{stamp}-{os.getpid()}.{extension}")
+
+def dump_spans():
+    path = output_path('spans', 'json')
+    with open(path, 'w') as f:
+        json.dump({'service': _service, 'enabled': _spans_enabled, 'spans': span_summary()}, f, indent=2)
+    return path
+
+# --- Perfilado de CPU ---
+
+class StackSampler:
+    """
+    Muestreador de pilas: un hilo lee sys._current_frames() cada `interval` segundos
+    y cuenta las pilas colapsadas (formato de flamegraph.pl / speedscope). Cubre todos
+    los hilos y su costo no depende de cuántas funciones se llamen.
+    """
+
+    mode = 'sample'
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self.started_at = time.time()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(thread_id, str(thread_id)))
+                key = ';'.join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        path = output_path('cpu-sample', 'folded')
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.counts.items(), key=lambda item: item[1], reverse=True):
+                f.write(f"{stack} {count}\n")
+        return path
+
+class CProfiler:
+    """cProfile determinista. Solo perfila el hilo principal (donde corren ambos servicios)."""
+
+    mode = 'cprofile'
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.started_at = time.time()
+
+    def start(self):
+        self.profile.enable()
+        return self
+
+    def stop(self):
+        self.profile.disable()
+        path = output_path('cpu-cprofile', 'prof')
+        self.profile.dump_stats(path)
+        with open(path[:-len('.prof')] + '.txt', 'w') as f:
+            pstats.Stats(self.profile, stream=f).sort_stats('cumulative').print_stats(TOP_STATS)
+        return path
+
+def _run_in_main_thread(func):
+    """
+    cProfile.enable/disable afectan solo al hilo que los llama; desde el socket de
+    control se encolan y se despiertan con SIGUSR1, cuyo handler corre en el hilo principal.
+    """
+    if threading.current_thread() is threading.main_thread():
+        return func()
+    _main_thread_actions.put(func)
+    os.kill(os.getpid(), signal.SIGUSR1)
+    return None
+
+def start_cpu(mode=None):
+    global _cpu_profiler
+    mode = mode or DEFAULT_CPU_MODE
+    if _cpu_profiler is not None:
+        return f"El perfilado de CPU ya está activo ({_cpu_profiler.mode})."
+    if mode == 'cprofile':
+        def start():
+            global _cpu_profiler
+            if _cpu_profiler is None:
+                _cpu_profiler = CProfiler().start()
+        _run_in_main_thread(start)
+    elif mode == 'sample':
+        _cpu_profiler = StackSampler().start()
+    else:
+        return f"Modo de CPU desconocido: {mode} (usar sample o cprofile)."
+    logging.info(f"Perfilado de CPU ({mode}) iniciado.")
+    return f"Perfilado de CPU ({mode}) iniciado."
+
+def stop_cpu():
+    global _cpu_profiler
+    profiler = _cpu_profiler
+    if profiler is None:
+        return "El perfilado de CPU no está activo."
+    if profiler.mode == 'cprofile' and threading.current_thread() is not threading.main_thread():
+        def stop():
+            global _cpu_profiler
+            if _cpu_profiler is profiler:
+                _cpu_profiler = None
+                logging.info(f"Perfil de CPU escrito en {profiler.stop()}")
+        _run_in_main_thread(stop)
+        return "Deteniendo cProfile en el hilo principal; ver el log para la ruta del perfil."
+    _cpu_profiler = None
+    path = profiler.stop()
+    logging.info(f"Perfil de CPU escrito en {path}")
+    return f"Perfil de CPU escrito en {path}"
+
+# --- tracemalloc ---
+
+def start_memory():
+    if tracemalloc.is_tracing():
+        return "tracemalloc ya está activo."
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+    logging.info("tracemalloc iniciado.")
+    return "tracemalloc iniciado."
+
+def snapshot_memory():
+    """Escribe el snapshot (.tracemalloc), su top por línea y la diferencia con el anterior."""
+    global _previous_memory_snapshot
+    if not tracemalloc.is_tracing():
+        return "tracemalloc no está activo."
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+    path = output_path('memory', 'tracemalloc')
+    snapshot.dump(path)
+    current, peak = tracemalloc.get_traced_memory()
+    with open(path[:-len('.tracemalloc')] + '.txt', 'w') as f:
+        f.write(f"Memoria trazada: actual {current / 1024 / 1024:.1f} MiB, pico {peak / 1024 / 1024:.1f} MiB\n\n")
+        f.write("Top por línea:\n")
+        for stat in snapshot.statistics('lineno')[:TOP_STATS]:
+            f.write(f"{stat}\n")
+        if _previous_memory_snapshot is not None:
+            f.write("\nDiferencia con el snapshot anterior:\n")
+            for stat in snapshot.compare_to(_previous_memory_snapshot, 'lineno')[:TOP_STATS]:
+                f.write(f"{stat}\n")
+    _previous_memory_snapshot = snapshot
+    logging.info(f"Snapshot de memoria escrito en {path}")
+    return f"Snapshot de memoria escrito en {path}"
+
+def stop_memory():
+    global _previous_memory_snapshot
+    if not tracemalloc.is_tracing():
+        return "tracemalloc no está activo."
+    result = snapshot_memory()
+    tracemalloc.stop()
+    _previous_memory_snapshot = None
+    return result
+
+# --- Control ---
+
+def status():
+    return json.dumps({
+        'service': _service,
+        'pid': os.getpid(),
+        'cpu': _cpu_profiler.mode if _cpu_profiler else None,
+        'tracemalloc': tracemalloc.is_tracing(),
+        'spans': _spans_enabled,
+        'output_dir': PROFILE_DIR,
+    })
+
+def handle_command(line):
+    """
+    Comandos: status | cpu start [sample|cprofile] | cpu stop | mem start |
+    mem snapshot | mem stop | spans on | spans off | spans dump | spans reset
+    """
+    parts = line.split()
+    if not parts:
+        return "Comando vacío."
+    command, args = parts[0], parts[1:]
+    action = args[0] if args else ''
+    if command == 'status':
+        return status()
+    if command == 'cpu' and action == 'start':
+        return start_cpu(args[1] if len(args) > 1 else None)
+    if command == 'cpu' and action == 'stop':
+        return stop_cpu()
+    if command == 'mem' and action in ('start', 'snapshot', 'stop'):
+        return {'start': start_memory, 'snapshot': snapshot_memory, 'stop': stop_memory}[action]()
+    if command == 'spans' and action in ('on', 'off'):
+        set_spans_enabled(action == 'on')
+        logging.info(f"Spans de perfilado {'activados' if _spans_enabled else 'desactivados'}.")
+        return f"Spans {'activados' if _spans_enabled else 'desactivados'}."
+    if command == 'spans' and action == 'dump':
+        return f"Spans escritos en {dump_spans()}"
+    if command == 'spans' and action == 'reset':
+        reset_spans()
+        return "Estadísticas de spans reiniciadas."
+    return f"Comando desconocido: {line.strip()}"
+
+# Los handlers interrumpen el bucle principal del servicio: un error al escribir un
+# perfil (p. ej. PROFILE_DIR sin permisos) se registra aquí en lugar de propagarse a
+# ese bucle, que lo trataría como un fallo del servicio y se detendría.
+
+def _handle_sigusr1(signum, frame):
+    ran_queued = False
+    while True:
+        try:
+            action = _main_thread_actions.get_nowait()
+        except queue.Empty:
+            break
+        ran_queued = True
+        try:
+            action()
+        except Exception:
+            logging.exception("Error en una acción de perfilado encolada para el hilo principal.")
+    if not ran_queued:
+        try:
+            stop_cpu() if _cpu_profiler else start_cpu()
+        except Exception:
+            logging.exception("Error al alternar el perfilado de CPU con SIGUSR1.")
+
+def _handle_sigusr2(signum, frame):
+    try:
+        stop_memory() if tracemalloc.is_tracing() else start_memory()
+    except Exception:
+        logging.exception("Error al alternar tracemalloc con SIGUSR2.")
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for raw_line in self.rfile:
+            line = raw_line.decode('utf-8', 'replace').strip()
+            if not line:
+                continue
+            try:
+                response = handle_command(line)
+            except Exception as e:
+                logging.exception(f"Error en el comando de perfilado '{line}'.")
+                response = f"Error: {e}"
+            self.wfile.write((response + '\n').encode('utf-8'))
+
+def start_control_socket(path):
+    if os.path.exists(path):
+        os.remove(path) # Socket huérfano de una ejecución anterior
+    server = socketserver.ThreadingUnixStreamServer(path, _ControlHandler)
+    server.daemon_threads = True
+    os.chmod(path, 0o600)
+    threading.Thread(target=server.serve_forever, name='profiling-control', daemon=True).start()
+    atexit.register(lambda: os.path.exists(path) and os.remove(path))
+    logging.info(f"Socket de control de perfilado en {path}")
+    return server
+
+def _finish_on_exit():
+    # No perder un perfil en curso si el proceso termina con el perfilado activo
+    if _cpu_profiler is not None:
+        stop_cpu()
+    if tracemalloc.is_tracing():
+        stop_memory()
+    if _span_stats:
+        dump_spans()
+
+def install(service):
+    """
+    Instala los handlers de señales y, si <SERVICE>_PROFILING_SOCKET está definido,
+    el socket de control. PROFILE_SPANS=1 activa los spans desde el arranque.
+    """
+    global _service
+    _service = service
+    if threading.current_thread() is threading.main_thread() and hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, _handle_sigusr1)
+        signal.signal(signal.SIGUSR2, _handle_sigusr2)
+    socket_path = os.getenv(f"{service.upper()}_PROFILING_SOCKET")
+    if socket_path:
+        try:
+            start_control_socket(socket_path)
+        except OSError as e:
+            logging.warning(f"No se pudo abrir el socket de control de perfilado en {socket_path}: {e}")
+    if os.getenv("PROFILE_SPANS", "0") == "1":
+        set_spans_enabled(True)
+    atexit.register(_finish_on_exit)
+
+def send_command(socket_path, command, timeout=60):
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall((command + '\n').encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return b''.join(chunks).decode('utf-8').strip()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Envía un comando al socket de control de perfilado de un servicio.")
+    parser.add_argument('socket', help="Ruta del socket (MONITOR_PROFILING_SOCKET / PROCESSOR_PROFILING_SOCKET).")
+    parser.add_argument('command', nargs='+', help="p. ej.: status | cpu start cprofile | cpu stop | mem snapshot | spans on")
+    args = parser.parse_args()
+    print(send_command(args.socket, ' '.join(args.command)))
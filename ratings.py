@@ -0,0 +1,266 @@
+import os
+import sqlite3
+import logging
+import argparse
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+# Importamos nuestro módulo de base de datos
+import database
+
+# --- Configuración ---
+SQL_IN_CHUNK_SIZE = 500 # Jugadores por consulta IN (...) al cargar series existentes
+REBUILD_CHUNK_SIZE = 20000
+DEFAULT_LEADERBOARD_SIZE = 100
+
+# Posiciones de las columnas en las tuplas que inserta el procesador
+_COLUMN_INDEX = {name: i for i, name in enumerate(database.STRUCTURED_BATTLE_COLUMNS)}
+_RATING_SIDES = (
+    (_COLUMN_INDEX['player_1'], _COLUMN_INDEX['player_1_rating_final']),
+    (_COLUMN_INDEX['player_2'], _COLUMN_INDEX['player_2_rating_final']),
+)
+
+def date_to_timestamp(date_str):
+    return int(datetime.fromisoformat(date_str.replace('Z', '+00:00')).timestamp())
+
+def extract_rating_points(battle_rows):
+    """
+    Agrupa por jugador los puntos (ts, rating final) de las tuplas de batallas
+    (en el orden de database.STRUCTURED_BATTLE_COLUMNS).
+    """
+    created_index = _COLUMN_INDEX['created_date']
+    points_by_player = {}
+    for row in battle_rows:
+        try:
+            ts = date_to_timestamp(row[created_index])
+        except (TypeError, ValueError):
+            continue
+        for player_index, rating_index in _RATING_SIDES:
+            player, rating = row[player_index], row[rating_index]
+            if player and rating is not None:
+                points_by_player.setdefault(player, []).append((ts, int(rating)))
+    return points_by_player
+
+def decode_series(blob):
+    series = array('q')
+    if blob:
+        series.frombytes(blob)
+    return series
+
+def merge_points(series, new_points):
+    """
+    Inserta los puntos nuevos en la serie intercalada manteniendo el orden por ts.
+    Los puntos ya presentes (misma batalla reprocesada) se ignoran. Retorna True si cambió.
+    """
+    changed = False
+    for ts, rating in sorted(new_points):
+        # Caso habitual: batallas más recientes que el último punto -> append
+        if not series or ts > series[-2]:
+            series.extend((ts, rating))
+            changed = True
+            continue
+        timestamps = series[0::2]
+        position = bisect_left(timestamps, ts)
+        # Con el mismo ts, los puntos se ordenan por rating (igual que en rebuild_ratings)
+        while position < len(timestamps) and timestamps[position] == ts and series[2 * position + 1] < rating:
+            position += 1
+        duplicate = position < len(timestamps) and timestamps[position] == ts and series[2 * position + 1] == rating
+        if not duplicate:
+            series[2 * position:2 * position] = array('q', (ts, rating))
+            changed = True
+    return changed
+
+def _load_series(conn, players):
+    existing = {}
+    for i in range(0, len(players), SQL_IN_CHUNK_SIZE):
+        chunk = players[i:i + SQL_IN_CHUNK_SIZE]
+        placeholders = ', '.join('?' * len(chunk))
+        for player, blob in conn.execute(f"SELECT player, points FROM rating_series WHERE player IN ({placeholders})", chunk):
+            existing[player] = decode_series(blob)
+    return existing
+
+def _write_series(conn, series_by_player):
+    conn.executemany(
+        "INSERT OR REPLACE INTO rating_series (player, points) VALUES (?, ?)",
+        [(player, series.tobytes()) for player, series in series_by_player.items()]
+    )
+    conn.executemany('''
+        INSERT INTO player_ratings (player, rating, updated_at, battles) VALUES (?, ?, ?, ?)
+        ON CONFLICT(player) DO UPDATE SET
+            rating = excluded.rating, updated_at = excluded.updated_at, battles = excluded.battles
+    ''', [(player, series[-1], series[-2], len(series) // 2) for player, series in series_by_player.items()])
+
+def update_ratings(conn, battle_rows):
+    """
+    Actualiza de forma incremental las series de rating y el leaderboard con las
+    batallas de un lote. Las tablas deben existir (database.initialize_rating_tables).
+    Does NOT commit: se confirma junto con la inserción de las batallas.
+    """
+    points_by_player = extract_rating_points(battle_rows)
+    if not points_by_player:
+        return 0
+    series_by_player = _load_series(conn, list(points_by_player))
+    changed = {}
+    for player, points in points_by_player.items():
+        series = series_by_player.get(player, array('q'))
+        if merge_points(series, points):
+            changed[player] = series
+    if changed:
+        _write_series(conn, changed)
+    return len(changed)
+
+def rebuild_ratings(season_id, db_format, chunk_size=REBUILD_CHUNK_SIZE):
+    """Reconstruye rating_series y player_ratings de un archivo a partir de la tabla battles."""
+    conn = database.get_structured_db_connection(season_id, db_format)
+    database.initialize_rating_tables(conn)
+    columns = ', '.join(database.STRUCTURED_BATTLE_COLUMNS[:-1]) # Sin full_battle_json
+    series_by_player = {}
+    last_rowid = 0
+    while True:
+        rows = conn.execute(
+            f"SELECT rowid, {columns} FROM battles WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last_rowid, chunk_size)
+        ).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+        for player, points in extract_rating_points([row[1:] for row in rows]).items():
+            series_by_player.setdefault(player, []).extend(points)
+
+    conn.execute("DELETE FROM rating_series")
+    conn.execute("DELETE FROM player_ratings")
+    final_series = {}
+    for player, points in series_by_player.items():
+        series = array('q')
+        for ts, rating in sorted(set(points)):
+            series.extend((ts, rating))
+        final_series[player] = series
+    _write_series(conn, final_series)
+    conn.commit()
+    conn.close()
+    return len(final_series)
+
+# --- API de consulta ---
+
+def _open(season_id, db_format):
+    """Conexión de lectura al archivo, o None si esa temporada/formato no existe (o está comprimido)."""
+    db_path = database.get_structured_db_path(season_id, db_format)
+    if not os.path.exists(db_path):
+        return None
+    return database.get_structured_db_read_connection(db_path)
+
+def get_rating_series(season_id, db_format, player):
+    """Retorna la curva de rating del jugador como lista de (ts, rating) ordenada por ts."""
+    conn = _open(season_id, db_format)
+    if conn is None:
+        return []
+    try:
+        row = conn.execute("SELECT points FROM rating_series WHERE player = ?", (player,)).fetchone()
+    except sqlite3.OperationalError:
+        row = None # Archivo sin tablas de rating (p. ej. anterior a la reconstrucción)
+    conn.close()
+    if not row:
+        return []
+    series = decode_series(row[0])
+    return list(zip(series[0::2], series[1::2]))
+
+def get_leaderboard(season_id, db_format, limit=DEFAULT_LEADERBOARD_SIZE, offset=0):
+    """Top-N por rating: recorre el índice idx_player_ratings_rating, sin ordenar la temporada."""
+    conn = _open(season_id, db_format)
+    if conn is None:
+        return []
+    try:
+        rows = conn.execute(
+            "SELECT player, rating, battles, updated_at FROM player_ratings ORDER BY rating DESC, player LIMIT ? OFFSET ?",
+            (limit, offset)
+        ).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    conn.close()
+    return [
+        {'rank': offset + i + 1, 'player': player, 'rating': rating, 'battles': battles, 'updated_at': updated_at}
+        for i, (player, rating, battles, updated_at) in enumerate(rows)
+    ]
+
+def _count_ranked_players(conn, rating):
+    """
+    (jugadores con rating mayor, total) desde rating_histogram: una fila por rating
+    distinto, no por jugador. Los archivos archivados antes de existir el histograma
+    (inmutables, sin migrar) cuentan sobre player_ratings.
+    """
+    try:
+        return conn.execute(
+            "SELECT COALESCE(SUM(CASE WHEN rating > ? THEN players END), 0), COALESCE(SUM(players), 0) FROM rating_histogram",
+            (rating,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        higher = conn.execute("SELECT COUNT(*) FROM player_ratings WHERE rating > ?", (rating,)).fetchone()[0]
+        return higher, conn.execute("SELECT COUNT(*) FROM player_ratings").fetchone()[0]
+
+def get_player_rank(season_id, db_format, player):
+    """Retorna {'rank', 'rating', 'players'} del jugador, o None si no tiene rating en ese archivo."""
+    conn = _open(season_id, db_format)
+    if conn is None:
+        return None
+    try:
+        row = conn.execute("SELECT rating FROM player_ratings WHERE player = ?", (player,)).fetchone()
+        if not row:
+            conn.close()
+            return None
+        rating = row[0]
+        higher, total = _count_ranked_players(conn, rating)
+    except sqlite3.OperationalError:
+        conn.close()
+        return None
+    conn.close()
+    return {'rank': higher + 1, 'rating': rating, 'players': total}
+
+if __name__ == "__main__":
+    # --- Configuración de Logging ---
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler() # Log to console
+        ]
+    )
+    from federated_query import discover_season_dbs
+
+    parser = argparse.ArgumentParser(description="Series de rating y leaderboards por temporada/formato.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    rebuild_parser = subparsers.add_parser('rebuild', help="Reconstruir las tablas de rating desde battles.")
+    rebuild_parser.add_argument('--seasons', help="Temporada o rango, p. ej. 162 o 150-162.")
+    rebuild_parser.add_argument('--formats', help="Formatos separados por coma, p. ej. wild,modern.")
+
+    leaderboard_parser = subparsers.add_parser('leaderboard', help="Mostrar el top-N de una temporada/formato.")
+    leaderboard_parser.add_argument('season', type=int)
+    leaderboard_parser.add_argument('format')
+    leaderboard_parser.add_argument('--top', type=int, default=DEFAULT_LEADERBOARD_SIZE)
+
+    player_parser = subparsers.add_parser('player', help="Mostrar rank y curva de rating de un jugador.")
+    player_parser.add_argument('season', type=int)
+    player_parser.add_argument('format')
+    player_parser.add_argument('player')
+
+    args = parser.parse_args()
+    if args.command == 'rebuild':
+        manifest = database.load_archive_manifest()
+        for season_id, db_format, db_path in discover_season_dbs(args.seasons, args.formats):
+            if database.get_archive_key(db_path) in manifest:
+                logging.info(f"T{season_id}, F:{db_format} está archivada. Saltando.")
+                continue
+            players = rebuild_ratings(season_id, db_format)
+            logging.info(f"T{season_id}, F:{db_format}: series de rating reconstruidas para {players} jugadores.")
+    elif args.command == 'leaderboard':
+        for entry in get_leaderboard(args.season, args.format, args.top):
+            print(f"{entry['rank']:>5}  {entry['player']:<24} {entry['rating']:>6}  ({entry['battles']} batallas)")
+    else:
+        rank = get_player_rank(args.season, args.format, args.player)
+        if rank is None:
+            print(f"{args.player} no tiene rating en T{args.season}, F:{args.format}.")
+        else:
+            print(f"{args.player}: rank {rank['rank']}/{rank['players']}, rating {rank['rating']}")
+            for ts, rating in get_rating_series(args.season, args.format, args.player):
+                print(f"  {datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')}  {rating}")
@@ -0,0 +1,405 @@
+import os
+import gzip
+import json
+import shutil
+import sqlite3
+import logging
+import argparse
+from datetime import datetime, timezone
+
+# Importamos nuestros módulos
+import database
+import ratings
+from federated_query import discover_season_dbs
+
+# --- Configuración de Logging ---
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler() # Log to console
+    ]
+)
+
+# Replicación de las bases de datos de temporada hacia una segunda máquina.
+# En el primario, `export` escribe en FEED_DIR lotes gzip con las filas nuevas de
+# cada archivo (por rowid) y los registra en manifest.jsonl con su sha256; `snapshot`
+# añade copias completas hechas con la API de backup de SQLite. Los archivos
+# archivados (inmutables) se envían una sola vez, completos. El directorio se copia
+# tal cual (rsync) a la réplica, donde `apply` aplica las entradas en orden.
+
+# --- Configuración ---
+DEFAULT_FEED_DIR = os.path.join(database.DB_FOLDER, 'replication')
+FEED_MANIFEST_FILE = 'manifest.jsonl'
+EXPORT_STATE_FILE = 'export_state.json'
+DEFAULT_BATCH_ROWS = 50000
+BATTLE_INDEX_KEY = 'battle_index.db'
+BATTLES_COLUMNS = database.STRUCTURED_BATTLE_COLUMNS # Sin columnas generadas: la réplica las recalcula
+PROCESSED_BATTLES_COLUMNS = ('battle_id',)
+
+# --- Utilidades comunes ---
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+def get_battle_index_path():
+    return os.path.join(database.DB_FOLDER, 'battle_index.db')
+
+def get_target_path(key):
+    """Ruta local de una clave del feed ('162/wild.db' o 'battle_index.db')."""
+    if key == BATTLE_INDEX_KEY:
+        return get_battle_index_path()
+    return os.path.join(database.STRUCTURED_BATTLES_ROOT, key)
+
+def tables_for_key(key):
+    if key == BATTLE_INDEX_KEY:
+        return (('processed_battles', PROCESSED_BATTLES_COLUMNS),)
+    return (('battles', BATTLES_COLUMNS),)
+
+def read_feed_manifest(feed_dir):
+    """Entradas del feed en orden. Una última línea incompleta (copia a medias) se ignora."""
+    entries = []
+    try:
+        with open(os.path.join(feed_dir, FEED_MANIFEST_FILE), 'r') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logging.warning("Línea incompleta al final de manifest.jsonl; se aplicará en la próxima ejecución.")
+                    break
+    except FileNotFoundError:
+        pass
+    return entries
+
+# --- Primario: exportación ---
+
+def load_export_state(feed_dir):
+    try:
+        with open(os.path.join(feed_dir, EXPORT_STATE_FILE), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'next_seq': 1, 'files': {}}
+
+def save_export_state(feed_dir, state):
+    path = os.path.join(feed_dir, EXPORT_STATE_FILE)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+def append_feed_entry(feed_dir, entry):
+    """El archivo del lote ya está en disco cuando su entrada aparece en el manifiesto."""
+    with open(os.path.join(feed_dir, FEED_MANIFEST_FILE), 'a') as f:
+        f.write(json.dumps(entry, sort_keys=True) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def next_entry_id(state):
+    entry_id = f"{state['next_seq']:010d}"
+    state['next_seq'] += 1
+    return entry_id
+
+def write_batch_file(path, header, rows):
+    with gzip.open(f"{path}.tmp", 'wt', encoding='utf-8', compresslevel=6) as f:
+        f.write(json.dumps(header) + '\n')
+        for row in rows:
+            f.write(json.dumps(row, separators=(',', ':')) + '\n')
+    os.replace(f"{path}.tmp", path)
+
+def get_watermark(conn, table):
+    """Rowid máximo y su battle_id, para detectar si la tabla se reescribió desde el último export."""
+    row = conn.execute(f"SELECT rowid, battle_id FROM {table} ORDER BY rowid DESC LIMIT 1").fetchone()
+    return {'rowid': row[0], 'battle_id': row[1]} if row else {'rowid': 0, 'battle_id': None}
+
+def export_table(feed_dir, state, key, conn, table, columns, batch_rows):
+    """Exporta las filas con rowid mayor que la marca de agua. El costo depende solo de las filas nuevas."""
+    file_state = state['files'].setdefault(key, {})
+    watermark = file_state.get(table) or {'rowid': 0, 'battle_id': None}
+    if watermark['rowid']:
+        row = conn.execute(f"SELECT battle_id FROM {table} WHERE rowid = ?", (watermark['rowid'],)).fetchone()
+        if not row or row[0] != watermark['battle_id']:
+            # Tabla reconstruida (p. ej. create_battle_index.py): se reexporta completa, la aplicación es idempotente
+            logging.warning(f"{key}/{table} cambió bajo la marca de agua {watermark['rowid']}. Reexportando desde el inicio.")
+            watermark = {'rowid': 0, 'battle_id': None}
+
+    exported = 0
+    column_list = ', '.join(columns)
+    while True:
+        rows = conn.execute(
+            f"SELECT rowid, {column_list} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (watermark['rowid'], batch_rows)
+        ).fetchall()
+        if not rows:
+            break
+        entry_id = next_entry_id(state)
+        relative_path = os.path.join('batches', f"{entry_id}.jsonl.gz")
+        batch_path = os.path.join(feed_dir, relative_path)
+        write_batch_file(batch_path, {'id': entry_id, 'key': key, 'table': table, 'columns': list(columns)}, [row[1:] for row in rows])
+        append_feed_entry(feed_dir, {
+            'id': entry_id, 'type': 'batch', 'key': key, 'table': table, 'file': relative_path,
+            'from_rowid': rows[0][0], 'to_rowid': rows[-1][0], 'rows': len(rows),
+            'sha256': database.file_sha256(batch_path), 'created_at': now_iso(),
+        })
+        watermark = {'rowid': rows[-1][0], 'battle_id': rows[-1][1]}
+        file_state[table] = watermark
+        save_export_state(feed_dir, state)
+        exported += len(rows)
+    return exported
+
+def gzip_file(source_path, target_path):
+    with open(source_path, 'rb') as src, gzip.open(f"{target_path}.tmp", 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(f"{target_path}.tmp", target_path)
+
+def ship_archived_file(feed_dir, state, key, db_path, archive_entry):
+    """Los archivos archivados son inmutables: se envían una vez, completos."""
+    entry_id = next_entry_id(state)
+    relative_path = os.path.join('files', f"{entry_id}.db.gz")
+    shipped_path = os.path.join(feed_dir, relative_path)
+    gzip_file(db_path, shipped_path)
+    append_feed_entry(feed_dir, {
+        'id': entry_id, 'type': 'file', 'key': key, 'file': relative_path,
+        'sha256': database.file_sha256(shipped_path), 'archive': archive_entry, 'created_at': now_iso(),
+    })
+    state['files'][key] = {'archived_sha256': archive_entry['sha256']}
+    save_export_state(feed_dir, state)
+    logging.info(f"{key} archivado: enviado completo ({os.path.getsize(shipped_path) / 1024 / 1024:.1f} MB comprimido).")
+
+def open_source(db_path):
+    return sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=10)
+
+def iter_source_files():
+    """(clave, ruta) de todos los archivos replicables del primario."""
+    for _, _, db_path in discover_season_dbs():
+        yield database.get_archive_key(db_path), db_path
+    if os.path.exists(get_battle_index_path()):
+        yield BATTLE_INDEX_KEY, get_battle_index_path()
+
+def export_changes(feed_dir=DEFAULT_FEED_DIR, batch_rows=DEFAULT_BATCH_ROWS):
+    os.makedirs(os.path.join(feed_dir, 'batches'), exist_ok=True)
+    os.makedirs(os.path.join(feed_dir, 'files'), exist_ok=True)
+    state = load_export_state(feed_dir)
+    archive_manifest = database.load_archive_manifest()
+    total_rows = 0
+    for key, db_path in iter_source_files():
+        archive_entry = archive_manifest.get(key)
+        if archive_entry:
+            if not archive_entry.get('compressed') and state['files'].get(key, {}).get('archived_sha256') != archive_entry['sha256']:
+                ship_archived_file(feed_dir, state, key, db_path, archive_entry)
+            continue
+        conn = open_source(db_path)
+        try:
+            for table, columns in tables_for_key(key):
+                exported = export_table(feed_dir, state, key, conn, table, columns, batch_rows)
+                if exported:
+                    logging.info(f"{key}/{table}: {exported} filas nuevas exportadas.")
+                total_rows += exported
+        except sqlite3.OperationalError as e:
+            logging.warning(f"{key} no se pudo exportar: {e}")
+        finally:
+            conn.close()
+    logging.info(f"Exportación completada. Filas nuevas: {total_rows}.")
+    return total_rows
+
+def snapshot_all(feed_dir=DEFAULT_FEED_DIR):
+    """
+    Copia completa de cada archivo vivo con la API de backup (consistente aunque el
+    crawler/procesador estén escribiendo). Las marcas de agua se leen de la copia, así
+    que los exports siguientes continúan exactamente donde termina el snapshot.
+    """
+    os.makedirs(os.path.join(feed_dir, 'snapshots'), exist_ok=True)
+    os.makedirs(os.path.join(feed_dir, 'files'), exist_ok=True)
+    state = load_export_state(feed_dir)
+    archive_manifest = database.load_archive_manifest()
+    for key, db_path in iter_source_files():
+        archive_entry = archive_manifest.get(key)
+        if archive_entry:
+            if not archive_entry.get('compressed') and state['files'].get(key, {}).get('archived_sha256') != archive_entry['sha256']:
+                ship_archived_file(feed_dir, state, key, db_path, archive_entry)
+            continue
+
+        entry_id = next_entry_id(state)
+        staging_path = os.path.join(feed_dir, 'snapshots', f"{entry_id}.db")
+        source = open_source(db_path)
+        target = sqlite3.connect(staging_path)
+        source.backup(target)
+        source.close()
+        watermarks = {}
+        for table, _ in tables_for_key(key):
+            try:
+                watermarks[table] = get_watermark(target, table)
+            except sqlite3.OperationalError:
+                watermarks[table] = {'rowid': 0, 'battle_id': None}
+        target.close()
+
+        relative_path = os.path.join('snapshots', f"{entry_id}.db.gz")
+        shipped_path = os.path.join(feed_dir, relative_path)
+        gzip_file(staging_path, shipped_path)
+        os.remove(staging_path)
+        append_feed_entry(feed_dir, {
+            'id': entry_id, 'type': 'snapshot', 'key': key, 'file': relative_path,
+            'watermarks': watermarks, 'sha256': database.file_sha256(shipped_path), 'created_at': now_iso(),
+        })
+        state['files'][key] = watermarks
+        save_export_state(feed_dir, state)
+        logging.info(f"{key}: snapshot {entry_id} ({os.path.getsize(shipped_path) / 1024 / 1024:.1f} MB comprimido).")
+
+# --- Réplica: aplicación ---
+
+def initialize_applied_table(conn):
+    """Registro de entradas aplicadas, dentro del propio archivo para que sea atómico con los datos."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS replication_applied (
+            entry_id TEXT PRIMARY KEY,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+    conn.commit()
+
+def open_target(key):
+    path = get_target_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute('PRAGMA journal_mode=WAL')
+    if key == BATTLE_INDEX_KEY:
+        conn.execute("CREATE TABLE IF NOT EXISTS processed_battles (battle_id TEXT PRIMARY KEY)")
+        conn.commit()
+    else:
+        database.initialize_structured_battle_table(conn)
+        database.initialize_rating_tables(conn)
+    initialize_applied_table(conn)
+    return conn
+
+def verify_checksum(feed_dir, entry):
+    path = os.path.join(feed_dir, entry['file'])
+    if database.file_sha256(path) != entry['sha256']:
+        raise ValueError(f"Checksum incorrecto en {entry['file']} (entrada {entry['id']}).")
+    return path
+
+def apply_batch(feed_dir, entry, replica_manifest):
+    key = entry['key']
+    if database.is_archived_db(get_target_path(key), replica_manifest):
+        logging.warning(f"Lote {entry['id']} para {key}, que ya está archivado en la réplica. Saltando.")
+        return False
+    conn = open_target(key)
+    try:
+        if conn.execute("SELECT 1 FROM replication_applied WHERE entry_id = ?", (entry['id'],)).fetchone():
+            return False
+        path = verify_checksum(feed_dir, entry)
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            rows = [tuple(json.loads(line)) for line in f]
+        columns = header['columns']
+        placeholders = ', '.join('?' * len(columns))
+        conn.executemany(
+            f"INSERT OR IGNORE INTO {header['table']} ({', '.join(columns)}) VALUES ({placeholders})", rows
+        )
+        if header['table'] == 'battles':
+            ratings.update_ratings(conn, rows) # Idempotente: los puntos repetidos se ignoran
+        conn.execute("INSERT INTO replication_applied (entry_id, applied_at) VALUES (?, ?)", (entry['id'], now_iso()))
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+def replace_database_file(source_path, target_path):
+    """Sustituye un archivo SQLite descartando su WAL/SHM (que pertenecen al archivo anterior)."""
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(f"{target_path}{suffix}"):
+            os.remove(f"{target_path}{suffix}")
+    os.replace(source_path, target_path)
+
+def gunzip_to(source_path, target_path):
+    with gzip.open(source_path, 'rb') as src, open(target_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+def apply_snapshot(feed_dir, entry):
+    target_path = get_target_path(entry['key'])
+    if os.path.exists(target_path):
+        conn = sqlite3.connect(target_path, timeout=10)
+        try:
+            applied = conn.execute("SELECT 1 FROM replication_applied WHERE entry_id = ?", (entry['id'],)).fetchone()
+        except sqlite3.OperationalError:
+            applied = None
+        conn.close()
+        if applied:
+            return False
+    path = verify_checksum(feed_dir, entry)
+    staging_path = f"{target_path}.replica.tmp"
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    gunzip_to(path, staging_path)
+    conn = sqlite3.connect(staging_path)
+    if conn.execute("PRAGMA quick_check").fetchone()[0] != 'ok':
+        conn.close()
+        os.remove(staging_path)
+        raise ValueError(f"El snapshot {entry['id']} de {entry['key']} no pasó quick_check.")
+    initialize_applied_table(conn)
+    conn.execute("INSERT OR IGNORE INTO replication_applied (entry_id, applied_at) VALUES (?, ?)", (entry['id'], now_iso()))
+    conn.commit()
+    conn.close()
+    replace_database_file(staging_path, target_path)
+    return True
+
+def apply_archived_file(feed_dir, entry, replica_manifest):
+    key = entry['key']
+    archive_entry = entry['archive']
+    if replica_manifest.get(key, {}).get('sha256') == archive_entry['sha256']:
+        return False
+    path = verify_checksum(feed_dir, entry)
+    target_path = get_target_path(key)
+    staging_path = f"{target_path}.replica.tmp"
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    gunzip_to(path, staging_path)
+    if database.file_sha256(staging_path) != archive_entry['sha256']:
+        os.remove(staging_path)
+        raise ValueError(f"El archivo {key} no coincide con el sha256 del manifiesto de archivo.")
+    os.chmod(staging_path, 0o444)
+    replace_database_file(staging_path, target_path)
+    replica_manifest[key] = archive_entry
+    database.save_archive_manifest(replica_manifest)
+    return True
+
+def apply_feed(feed_dir=DEFAULT_FEED_DIR):
+    """
+    Aplica las entradas del feed en orden. Es idempotente: cada archivo registra qué
+    entradas ya contiene, y los lotes anteriores al último snapshot de su archivo se omiten.
+    """
+    entries = read_feed_manifest(feed_dir)
+    last_full_copy = {entry['key']: i for i, entry in enumerate(entries) if entry['type'] in ('snapshot', 'file')}
+    replica_manifest = database.load_archive_manifest()
+    applied = {'batch': 0, 'snapshot': 0, 'file': 0}
+    for i, entry in enumerate(entries):
+        if i < last_full_copy.get(entry['key'], -1):
+            continue # Superado por una copia completa posterior
+        if entry['type'] == 'batch':
+            changed = apply_batch(feed_dir, entry, replica_manifest)
+        elif entry['type'] == 'snapshot':
+            changed = apply_snapshot(feed_dir, entry)
+        elif entry['type'] == 'file':
+            changed = apply_archived_file(feed_dir, entry, replica_manifest)
+        else:
+            logging.warning(f"Tipo de entrada desconocido en el feed: {entry['type']}. Saltando.")
+            continue
+        if changed:
+            applied[entry['type']] += 1
+            logging.info(f"Entrada {entry['id']} ({entry['type']}, {entry['key']}) aplicada.")
+    logging.info(f"Aplicación completada. Lotes: {applied['batch']}, snapshots: {applied['snapshot']}, archivos: {applied['file']}.")
+    return applied
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replicación incremental de las bases de datos de temporada.")
+    parser.add_argument('--feed', default=DEFAULT_FEED_DIR, help="Directorio del feed (se copia del primario a la réplica).")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="Primario: exportar las filas nuevas desde el último export.")
+    export_parser.add_argument('--batch-rows', type=int, default=DEFAULT_BATCH_ROWS)
+    subparsers.add_parser('snapshot', help="Primario: copia completa de cada archivo (arranque de una réplica).")
+    subparsers.add_parser('apply', help="Réplica: aplicar las entradas pendientes del feed.")
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        export_changes(args.feed, args.batch_rows)
+    elif args.command == 'snapshot':
+        snapshot_all(args.feed)
+    else:
+        apply_feed(args.feed)
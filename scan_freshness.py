@@ -0,0 +1,217 @@
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+# Importamos nuestro módulo de base de datos
+import database
+
+# --- Configuración ---
+DEFAULT_RATE_WINDOW = 900 # segundos de escaneos recientes para estimar la velocidad del crawler
+DEFAULT_TARGET_HOURS = 24.0 # Edad máxima deseada para los jugadores activos
+DEFAULT_WATCH_INTERVAL = 60
+PERCENTILES = (0.5, 0.9, 0.99)
+HISTOGRAM_BOUNDS = ( # Límites superiores de edad (segundos) para el histograma impreso
+    ('<15m', 900), ('<1h', 3600), ('<6h', 21600), ('<24h', 86400),
+    ('<3d', 259200), ('<7d', 604800), ('>=7d', None),
+)
+BEHIND_TIERS = ('saturated', 'active')
+
+def load_scan_buckets(conn):
+    """Lee la tabla resumen (tamaño acotado por la antigüedad, no por el número de jugadores)."""
+    return conn.execute("SELECT bucket_ts, activity_tier, scan_lane, players FROM scan_buckets").fetchall()
+
+def load_scan_counts(conn, since):
+    """[(bucket_ts, escaneos)] desde `since` (escaneos reales registrados por el crawler)."""
+    try:
+        return conn.execute(
+            "SELECT bucket_ts, SUM(scans) FROM scan_counts WHERE bucket_ts >= ? GROUP BY bucket_ts", (since,)
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return [] # players.db sin migrar
+
+def get_oldest_scan(conn, scanned_only=True):
+    """
+    MIN(last_scanned_timestamp) por el índice idx_players_last_scanned. Con
+    scanned_only se ignoran los jugadores que nunca se escanearon (timestamp 0).
+    """
+    where = " WHERE last_scanned_timestamp > 0" if scanned_only else ""
+    row = conn.execute(f"SELECT MIN(last_scanned_timestamp) FROM players{where}").fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+def bucket_age(bucket_ts, now):
+    """Edad representativa de una cubeta: su punto medio (error máximo de media cubeta)."""
+    return max(0, now - bucket_ts - database.SCAN_BUCKET_SECONDS // 2)
+
+def age_distribution(buckets, now):
+    """Retorna [(edad, jugadores)] ordenado por edad. Los jugadores con ts 0 nunca fueron escaneados."""
+    ages = {}
+    never = 0
+    for bucket_ts, _, _, players in buckets:
+        if bucket_ts <= 0:
+            never += players
+            continue
+        age = bucket_age(bucket_ts, now)
+        ages[age] = ages.get(age, 0) + players
+    return sorted(ages.items()), never
+
+def percentiles_from_distribution(distribution, fractions=PERCENTILES):
+    total = sum(count for _, count in distribution)
+    if not total:
+        return {f"p{int(f * 100)}": None for f in fractions}
+    result = {}
+    for fraction in fractions:
+        target = fraction * total
+        cumulative = 0
+        for age, count in distribution:
+            cumulative += count
+            if cumulative >= target:
+                result[f"p{int(fraction * 100)}"] = age
+                break
+    return result
+
+def histogram_from_distribution(distribution, never=0):
+    histogram = {label: 0 for label, _ in HISTOGRAM_BOUNDS}
+    for age, count in distribution:
+        for label, bound in HISTOGRAM_BOUNDS:
+            if bound is None or age < bound:
+                histogram[label] += count
+                break
+    histogram['never'] = never
+    return histogram
+
+def summarize(buckets, now):
+    distribution, never = age_distribution(buckets, now)
+    summary = {'players': sum(count for _, count in distribution) + never}
+    summary.update(percentiles_from_distribution(distribution))
+    summary['histogram'] = histogram_from_distribution(distribution, never)
+    return summary
+
+def crawl_rate(conn, now, window=DEFAULT_RATE_WINDOW):
+    """
+    Escaneos por segundo en la ventana reciente, desde scan_counts. El inicio se alinea
+    al borde de cubeta para no descartar la cubeta más vieja cubierta solo en parte.
+    """
+    if window <= 0:
+        return 0.0
+    since = (now - window) - (now - window) % database.SCAN_BUCKET_SECONDS
+    scans = sum(count for _, count in load_scan_counts(conn, since))
+    return scans / max(1, now - since)
+
+def build_report(conn, now=None, rate_window=DEFAULT_RATE_WINDOW, target_hours=DEFAULT_TARGET_HOURS):
+    now = int(now or time.time())
+    buckets = load_scan_buckets(conn)
+    report = {'generated_at': now, 'overall': summarize(buckets, now)}
+    report['by_tier'] = {
+        tier: summarize([b for b in buckets if b[1] == tier], now)
+        for tier in database.ACTIVITY_TIERS if any(b[1] == tier for b in buckets)
+    }
+    report['by_lane'] = {
+        lane: summarize([b for b in buckets if b[2] == lane], now)
+        for lane in database.SCAN_LANES if any(b[2] == lane for b in buckets)
+    }
+
+    oldest = get_oldest_scan(conn)
+    report['oldest_scan_ts'] = oldest
+    report['oldest_scan_age'] = now - oldest if oldest else None
+
+    # Rotación completa: todos los jugadores pasan una vez por el crawler al ritmo actual
+    rate = crawl_rate(conn, now, rate_window)
+    total_players = report['overall']['players']
+    report['crawl_rate_per_s'] = round(rate, 4)
+    report['rotation_eta_seconds'] = int(total_players / rate) if rate > 0 else None
+
+    # Jugadores activos cuya edad supera el objetivo: su ventana de 50 batallas puede desbordarse
+    target_seconds = int(target_hours * 3600)
+    behind = 0
+    active_players = 0
+    for bucket_ts, tier, _, players in buckets:
+        if tier in BEHIND_TIERS:
+            active_players += players
+            if now - bucket_ts > target_seconds:
+                behind += players
+    required_rate = total_players / target_seconds if target_seconds > 0 else None
+    report['window'] = {
+        'target_hours': target_hours,
+        'active_players': active_players,
+        'behind_target': behind,
+        'saturated_last_scan': sum(p for _, tier, _, p in buckets if tier == 'saturated'),
+        'required_rate_per_s': round(required_rate, 4) if required_rate else None,
+        # Factor de concurrencia necesario respecto al crawler actual para cumplir el objetivo
+        'concurrency_factor': round(required_rate / rate, 2) if required_rate and rate > 0 else None,
+    }
+    return report
+
+def format_age(seconds):
+    return '-' if seconds is None else str(timedelta(seconds=int(seconds)))
+
+def print_report(report):
+    generated = datetime.fromtimestamp(report['generated_at']).strftime('%Y-%m-%d %H:%M:%S')
+    overall = report['overall']
+    print(f"=== Frescura de escaneo ({generated}) ===")
+    print(f"Jugadores: {overall['players']}  |  Escaneo más antiguo: hace {format_age(report['oldest_scan_age'])}")
+    print(f"Velocidad: {report['crawl_rate_per_s']} escaneos/s  |  Rotación completa estimada: {format_age(report['rotation_eta_seconds'])}")
+
+    header = f"{'grupo':<20}{'jugadores':>10}{'p50':>18}{'p90':>18}{'p99':>18}"
+    print("\n" + header)
+    rows = [('total', overall)] + [(f"tier:{k}", v) for k, v in report['by_tier'].items()] + \
+           [(f"lane:{k}", v) for k, v in report['by_lane'].items()]
+    for name, summary in rows:
+        print(f"{name:<20}{summary['players']:>10}{format_age(summary['p50']):>18}"
+              f"{format_age(summary['p90']):>18}{format_age(summary['p99']):>18}")
+
+    print("\nHistograma de edad (total):")
+    largest = max(overall['histogram'].values()) or 1
+    for label, count in overall['histogram'].items():
+        print(f"  {label:>6} {count:>10}  {'#' * int(40 * count / largest)}")
+
+    window = report['window']
+    print(f"\nActivos (saturated/active): {window['active_players']}, "
+          f"más viejos que {window['target_hours']}h: {window['behind_target']}, "
+          f"saturados en el último escaneo: {window['saturated_last_scan']}")
+    if window['concurrency_factor']:
+        print(f"Para rotar en {window['target_hours']}h se necesitan {window['required_rate_per_s']} escaneos/s "
+              f"(x{window['concurrency_factor']} la concurrencia actual).")
+
+if __name__ == "__main__":
+    # --- Configuración de Logging ---
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler() # Log to console
+        ]
+    )
+
+    parser = argparse.ArgumentParser(description="Distribución de la antigüedad de escaneo de los jugadores.")
+    parser.add_argument('--rate-window', type=int, default=DEFAULT_RATE_WINDOW,
+                        help="Segundos recientes usados para estimar la velocidad del crawler.")
+    parser.add_argument('--target-hours', type=float, default=DEFAULT_TARGET_HOURS,
+                        help="Edad máxima deseada para los jugadores activos.")
+    parser.add_argument('--json', action='store_true', help="Imprimir el reporte como JSON.")
+    parser.add_argument('--watch', type=int, nargs='?', const=DEFAULT_WATCH_INTERVAL, metavar='SEGUNDOS',
+                        help="Repetir el reporte cada N segundos.")
+    args = parser.parse_args()
+
+    conn = database.get_players_db_connection()
+    database.initialize_players_table(conn) # Crea índice/resumen si la base de datos es antigua
+    try:
+        while True:
+            report = build_report(conn, rate_window=args.rate_window, target_hours=args.target_hours)
+            if args.json:
+                print(json.dumps(report))
+            else:
+                print_report(report)
+            if not args.watch:
+                break
+            sys.stdout.flush()
+            time.sleep(args.watch)
+            if not args.json:
+                print()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
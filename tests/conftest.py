@@ -0,0 +1,49 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import create_battle_index
+import process_raw_battles
+from benchmark import scenarios
+from benchmark.generator import generate_seasons
+
+# Rutas que scenarios.configure_workspace redirige; se restauran al terminar cada test
+WORKSPACE_ATTRIBUTES = (
+    (database, ('DB_FOLDER', 'PLAYERS_DB', 'RAW_BATTLES_DB', 'STRUCTURED_BATTLES_ROOT',
+                'STRUCTURED_BATTLES_DB_PATTERN', 'ARCHIVE_MANIFEST_FILE')),
+    (process_raw_battles, ('DB_FOLDER', 'RAW_BATTLES_DB', 'SEASONS_DATA_FILE')),
+    (create_battle_index, ('DB_FOLDER', 'BATTLE_INDEX_DB', 'STRUCTURED_BATTLES_ROOT', 'STRUCTURED_DB_PATTERN')),
+)
+
+@pytest.fixture
+def seasons():
+    return generate_seasons()
+
+@pytest.fixture
+def use_workspace(tmp_path, monkeypatch, seasons):
+    """
+    Función que apunta database/process_raw_battles/create_battle_index a
+    tmp_path/<nombre> (p. ej. 'primary' y 'replica'). Se puede alternar entre
+    directorios dentro del mismo test.
+    """
+    for module, names in WORKSPACE_ATTRIBUTES:
+        for name in names:
+            monkeypatch.setattr(module, name, getattr(module, name))
+
+    configured = {}
+    def use(name='primary'):
+        root = str(tmp_path / name)
+        if name in configured:
+            # configure_workspace vacía el índice: al volver a un directorio solo se restauran las rutas
+            for module, attribute, value in configured[name]:
+                setattr(module, attribute, value)
+        else:
+            scenarios.configure_workspace(root, seasons)
+            configured[name] = [(module, attribute, getattr(module, attribute))
+                                for module, names in WORKSPACE_ATTRIBUTES for attribute in names]
+        return root
+    return use
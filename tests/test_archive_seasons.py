@@ -0,0 +1,118 @@
+import glob
+import os
+import sqlite3
+import stat
+
+import archive_seasons
+import database
+import process_raw_battles
+from benchmark.generator import BattleGenerator
+
+def counter_total(metric, **labels):
+    return sum(sample['value'] for sample in metric.snapshot()['samples']
+               if all(sample['labels'].get(name) == value for name, value in labels.items()))
+
+def ingest(battles):
+    raw_conn = database.get_raw_battles_db_connection()
+    database.insert_raw_battles_batch(raw_conn, battles)
+    raw_conn.close()
+    process_raw_battles.process_raw_battles(False)
+
+def battle_ids(db_path):
+    conn = sqlite3.connect(db_path)
+    ids = conn.execute("SELECT battle_id FROM battles ORDER BY battle_id").fetchall()
+    conn.close()
+    return ids
+
+def largest_structured_db():
+    return max(glob.glob(database.STRUCTURED_BATTLES_DB_PATTERN), key=lambda path: len(battle_ids(path)))
+
+def archive(db_path, compress=False):
+    entry = archive_seasons.archive_db_file(db_path, compress=compress)
+    manifest = database.load_archive_manifest()
+    manifest[database.get_archive_key(db_path)] = entry
+    database.save_archive_manifest(manifest)
+    return entry
+
+def test_archive_replaces_file_atomically(use_workspace, seasons):
+    use_workspace()
+    ingest(BattleGenerator(seasons, player_count=50, seed=5).battles(300))
+    db_path = largest_structured_db()
+    rows_before = battle_ids(db_path)
+    inode_before = os.stat(db_path).st_ino
+
+    entry = archive(db_path)
+    assert entry['rows'] == len(rows_before)
+    assert os.stat(db_path).st_ino != inode_before
+    assert stat.S_IMODE(os.stat(db_path).st_mode) == 0o444
+    assert entry['sha256'] == database.file_sha256(db_path)
+    assert not os.path.exists(f"{db_path}.archive.tmp") and not os.path.exists(f"{db_path}.sorting")
+    assert battle_ids(db_path) == rows_before
+    assert database.is_archived_db(db_path)
+
+def test_archive_aborts_if_rows_arrive_during_copy(use_workspace, seasons, monkeypatch):
+    use_workspace()
+    generator = BattleGenerator(seasons, player_count=50, seed=6)
+    ingest(generator.battles(300))
+    db_path = largest_structured_db()
+    inode_before = os.stat(db_path).st_ino
+
+    build_sorted_copy = archive_seasons.build_sorted_copy
+    def build_with_late_battle(source_path, staging_path):
+        staging_conn = build_sorted_copy(source_path, staging_path)
+        # Un escritor confirma una batalla tardía mientras se prepara la copia
+        writer = sqlite3.connect(source_path)
+        columns = ', '.join(database.STRUCTURED_BATTLE_COLUMNS)
+        values = ', '.join("'tardia'" if column == 'battle_id' else column for column in database.STRUCTURED_BATTLE_COLUMNS)
+        writer.execute(f"INSERT INTO battles ({columns}) SELECT {values} FROM battles LIMIT 1")
+        writer.commit()
+        writer.close()
+        return staging_conn
+    monkeypatch.setattr(archive_seasons, 'build_sorted_copy', build_with_late_battle)
+
+    assert archive_seasons.archive_db_file(db_path) is None
+    assert os.stat(db_path).st_ino == inode_before
+    assert ('tardia',) in battle_ids(db_path)
+    assert not os.path.exists(f"{db_path}.archive.tmp")
+
+def test_compressed_archive_restores_with_same_checksum(use_workspace, seasons):
+    use_workspace()
+    ingest(BattleGenerator(seasons, player_count=50, seed=7).battles(200))
+    db_path = largest_structured_db()
+    rows_before = battle_ids(db_path)
+
+    entry = archive(db_path, compress=True)
+    assert not os.path.exists(db_path) and os.path.exists(f"{db_path}.gz")
+    assert archive_seasons.restore_compressed(database.get_archive_key(db_path))
+    assert database.file_sha256(db_path) == entry['sha256']
+    assert battle_ids(db_path) == rows_before
+    assert database.load_archive_manifest()[database.get_archive_key(db_path)]['compressed'] is False
+
+def test_late_battles_of_archived_season_are_quarantined(use_workspace, seasons):
+    use_workspace()
+    generator = BattleGenerator(seasons, player_count=50, seed=8)
+    ingest(generator.battles(300))
+    db_path = largest_structured_db()
+    entry = archive(db_path)
+    archived_key = database.get_archive_key(db_path)
+
+    seasons_data = process_raw_battles.load_season_data()
+    late_battles = generator.battles(200)
+    late_ids = set()
+    for battle in late_battles:
+        destination = process_raw_battles.build_structured_row(battle['battle_queue_id_1'], battle, seasons_data)
+        if destination and database.get_archive_key(database.get_structured_db_path(destination[0], destination[1])) == archived_key:
+            late_ids.add(battle['battle_queue_id_1'])
+    assert late_ids
+
+    archived_before = counter_total(process_raw_battles.PROCESSOR_BATTLES, result='archived')
+    ingest(late_battles)
+
+    # El archivo archivado no cambia y raw_battles queda vacío
+    assert database.file_sha256(db_path) == entry['sha256']
+    raw_conn = database.get_raw_battles_db_connection()
+    assert raw_conn.execute("SELECT COUNT(*) FROM raw_battles").fetchone()[0] == 0
+    quarantined = {row[0] for row in raw_conn.execute("SELECT battle_id FROM archived_season_battles")}
+    raw_conn.close()
+    assert quarantined == late_ids
+    assert counter_total(process_raw_battles.PROCESSOR_BATTLES, result='archived') - archived_before == len(late_ids)
@@ -0,0 +1,145 @@
+import sys
+import glob
+import sqlite3
+import types
+
+import pytest
+
+import backfill
+import database
+from benchmark.generator import BattleGenerator
+from process_raw_battles import build_structured_row, load_season_data
+
+PLAYER_COUNT = 12
+
+class FakeApi:
+    """
+    Sustituye a main (login e historial) dentro de run_backfill. Los historiales se
+    solapan: cada jugador comparte una batalla con el anterior, como dos rivales.
+    """
+
+    def __init__(self, seasons):
+        generator = BattleGenerator(seasons, player_count=200, seed=5)
+        self.players = generator.players[:PLAYER_COUNT]
+        self.histories = {player: generator.player_history(player, 30) for player in self.players}
+        for previous, player in zip(self.players, self.players[1:]):
+            self.histories[player].append(self.histories[previous][0])
+        self.calls = []
+        self.interrupt_at_call = None
+        self.failing_players = set()
+        self.module = types.ModuleType('main')
+        self.module.BattleHistoryError = type('BattleHistoryError', (Exception,), {})
+        self.module.AuthenticationError = type('AuthenticationError', (Exception,), {})
+        self.module.get_auth_token = lambda username, posting_key, force_login=False: ('user', 'token')
+        self.module.invalidate_cached_token = lambda: None
+        self.module.get_player_battle_history = self.get_player_battle_history
+
+    def get_player_battle_history(self, player, auth_user, auth_token, raise_on_failure=False):
+        self.calls.append(player)
+        if len(self.calls) == self.interrupt_at_call:
+            raise KeyboardInterrupt
+        if player in self.failing_players:
+            raise self.module.BattleHistoryError(f"HTTP 500 al consultar {player}.")
+        return self.histories[player]
+
+    def expected_battle_ids(self, seasons_data):
+        battles = {battle['battle_queue_id_1']: battle for history in self.histories.values() for battle in history}
+        return {battle_id for battle_id, battle in battles.items() if build_structured_row(battle_id, battle, seasons_data)}
+
+@pytest.fixture
+def api(use_workspace, seasons, monkeypatch):
+    root = use_workspace('primary')
+    fake = FakeApi(seasons)
+    monkeypatch.setitem(sys.modules, 'main', fake.module)
+    monkeypatch.setenv('HIVE_USERNAME', 'user')
+    monkeypatch.setenv('HIVE_POSTING_KEY', 'key')
+    fake.checkpoint_path = f"{root}/backfill_checkpoint.json"
+    return fake
+
+def run(api, checkpoint, **kwargs):
+    return backfill.run_backfill(checkpoint, api.checkpoint_path, None, None, max_rps=0,
+                                 batch_rows=70, progress_every=100, **kwargs)
+
+def stored_battle_ids():
+    battle_ids = []
+    for db_path in glob.glob(database.STRUCTURED_BATTLES_DB_PATTERN):
+        conn = sqlite3.connect(db_path)
+        battle_ids.extend(row[0] for row in conn.execute("SELECT battle_id FROM battles"))
+        conn.close()
+    return battle_ids
+
+def test_backfill_resumes_after_interrupt(api):
+    checkpoint = backfill.new_checkpoint(api.players, None, None)
+    backfill.save_checkpoint(api.checkpoint_path, checkpoint)
+    api.interrupt_at_call = 6
+    run(api, checkpoint)
+
+    # Lo leído antes del Ctrl-C queda escrito y fuera de 'pending'; el jugador interrumpido sigue pendiente
+    checkpoint = backfill.load_checkpoint(api.checkpoint_path)
+    assert checkpoint['pending'] == api.players[5:]
+    assert 'completed_at' not in checkpoint
+    written_before_resume = set(stored_battle_ids())
+    assert written_before_resume
+
+    api.interrupt_at_call = None
+    run(api, checkpoint)
+    checkpoint = backfill.load_checkpoint(api.checkpoint_path)
+    assert checkpoint['pending'] == []
+    assert checkpoint.get('completed_at')
+    assert sorted(api.calls) == sorted(api.players + [api.players[5]]) # Nadie se consulta dos veces salvo el interrumpido
+
+    expected = api.expected_battle_ids(load_season_data())
+    stored = stored_battle_ids()
+    assert len(stored) == len(set(stored)) # Sin duplicados entre archivos
+    assert set(stored) == expected and written_before_resume < expected
+    assert checkpoint['stats']['written'] == len(expected)
+    index_conn = database.get_battle_index_connection()
+    assert {row[0] for row in index_conn.execute("SELECT battle_id FROM processed_battles")} == expected
+    index_conn.close()
+
+def test_backfill_keeps_failed_players_pending(api):
+    checkpoint = backfill.new_checkpoint(api.players, None, None)
+    backfill.save_checkpoint(api.checkpoint_path, checkpoint)
+    api.failing_players = {api.players[2], api.players[7]}
+    run(api, checkpoint, retry_passes=0)
+
+    checkpoint = backfill.load_checkpoint(api.checkpoint_path)
+    assert checkpoint['pending'] == [api.players[2], api.players[7]]
+    assert 'completed_at' not in checkpoint
+
+    api.failing_players = set()
+    run(api, checkpoint, retry_passes=0)
+    checkpoint = backfill.load_checkpoint(api.checkpoint_path)
+    assert checkpoint['pending'] == [] and checkpoint.get('completed_at')
+    assert set(stored_battle_ids()) == api.expected_battle_ids(load_season_data())
+
+def test_failed_final_flush_is_raised_and_not_completed(api, monkeypatch):
+    checkpoint = backfill.new_checkpoint(api.players, None, None)
+    backfill.save_checkpoint(api.checkpoint_path, checkpoint)
+
+    def failing_write(*args, **kwargs):
+        raise sqlite3.OperationalError('disk I/O error')
+    monkeypatch.setattr(backfill, 'write_destination_batch', failing_write)
+    with pytest.raises(sqlite3.OperationalError):
+        backfill.run_backfill(checkpoint, api.checkpoint_path, None, None, max_rps=0,
+                              batch_rows=10 ** 6, progress_every=100) # Todo queda para el flush final
+
+    checkpoint = backfill.load_checkpoint(api.checkpoint_path)
+    assert checkpoint['pending'] == api.players
+    assert 'completed_at' not in checkpoint
+
+def test_resume_compares_requested_tiers_not_the_live_query():
+    checkpoint = backfill.new_checkpoint(['a', 'b'], (150, 160), {'wild'}, ['saturated', 'active'])
+    assert backfill.resume_mismatch(checkpoint, (150, 160), {'wild'}) is None
+    assert backfill.resume_mismatch(checkpoint, (150, 160), {'wild'}, ['active', 'saturated']) is None
+    assert backfill.resume_mismatch(checkpoint, (150, 160), {'wild'}, ['idle'])
+    assert backfill.resume_mismatch(checkpoint, (150, 161), {'wild'})
+
+    listed = backfill.new_checkpoint(['a', 'b'], None, None)
+    assert backfill.resume_mismatch(listed, None, None, requested_players=['b', 'a']) is None
+    assert backfill.resume_mismatch(listed, None, None, requested_players=['a', 'c'])
+    assert backfill.resume_mismatch(listed, None, None, ['active']) # Checkpoint de una lista, no de niveles
+
+    legacy = {key: value for key, value in listed.items()}
+    legacy['scope'] = {'seasons': None, 'formats': None} # Checkpoint anterior a guardar los niveles
+    assert backfill.resume_mismatch(legacy, None, None) is None
@@ -0,0 +1,108 @@
+import glob
+import json
+import sqlite3
+from collections import Counter
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import card_meta
+import database
+import process_raw_battles
+from benchmark.generator import BattleGenerator
+
+def ingest(battles, extract_card_usage_rows):
+    raw_conn = database.get_raw_battles_db_connection()
+    database.insert_raw_battles_batch(raw_conn, battles)
+    raw_conn.close()
+    process_raw_battles.process_raw_battles(extract_card_usage_rows)
+
+def card_usage_rows():
+    """(formato, ruleset, side, slot, card_id, level, won, mana_cap, battle_id) de todos los archivos."""
+    rows = []
+    for db_path in glob.glob(database.STRUCTURED_BATTLES_DB_PATTERN):
+        db_format = db_path.rsplit('/', 1)[-1][:-len('.db')]
+        conn = sqlite3.connect(db_path)
+        rows.extend((db_format,) + row for row in conn.execute('''
+            SELECT IFNULL(b.ruleset, ''), c.side, c.slot, c.card_id, c.level, c.won, IFNULL(c.mana_cap, 0), c.battle_id
+            FROM card_usage c JOIN battles b ON b.battle_id = c.battle_id
+        '''))
+        conn.close()
+    return rows
+
+def brute_force_stats(rows, group_by):
+    context_of = {
+        'card': lambda row: None,
+        'format': lambda row: row[0],
+        'ruleset': lambda row: row[1],
+        'mana_cap': lambda row: row[7],
+    }[group_by]
+    teams = Counter(context_of(row) for row in rows if row[3] == 0)
+    picks = Counter((context_of(row), row[4]) for row in rows)
+    wins = Counter()
+    for row in rows:
+        wins[(context_of(row), row[4])] += row[6]
+    return {key: (count, wins[key], round(count / teams[key[0]], 4) if teams[key[0]] else 0.0)
+            for key, count in picks.items()}
+
+@pytest.fixture
+def ingested(use_workspace, seasons):
+    use_workspace()
+    battles = BattleGenerator(seasons, player_count=40, seed=31).battles(250)
+    ingest(battles, True)
+    return battles
+
+@pytest.mark.parametrize('group_by', card_meta.GROUP_BY_OPTIONS)
+def test_aggregation_matches_brute_force(ingested, group_by):
+    rows = card_usage_rows()
+    assert rows
+    columns = card_meta.load_card_usage_columns(with_ruleset=group_by == 'ruleset')
+    results = card_meta.aggregate_card_stats(columns, group_by)
+
+    expected = brute_force_stats(rows, group_by)
+    got = {(row.get(group_by), row['card_id']): (row['picks'], row['wins'], row['pick_rate']) for row in results}
+    assert got == expected
+    for row in results:
+        assert row['win_rate'] == round(row['wins'] / row['picks'], 4)
+
+def test_min_picks_and_filters(ingested):
+    columns = card_meta.load_card_usage_columns()
+    results = card_meta.aggregate_card_stats(columns, min_picks=5)
+    assert results and all(row['picks'] >= 5 for row in results)
+
+    wild = card_meta.load_card_usage_columns(formats='wild')
+    assert wild['formats'] == ['wild']
+    assert wild['card_id'].size == sum(1 for row in card_usage_rows() if row[0] == 'wild')
+
+    with pytest.raises(ValueError):
+        card_meta.aggregate_card_stats(columns, group_by='player')
+
+def test_backfill_matches_processor_extraction(use_workspace, seasons):
+    battles = BattleGenerator(seasons, player_count=40, seed=32).battles(150)
+    use_workspace('primary')
+    ingest(battles, True)
+    expected = sorted(card_usage_rows())
+
+    use_workspace('backfill')
+    ingest(battles, False)
+    card_meta.backfill_card_usage(chunk_size=17)
+    assert sorted(card_usage_rows()) == expected
+    card_meta.backfill_card_usage() # Idempotente
+    assert sorted(card_usage_rows()) == expected
+
+def test_extract_card_usage(seasons):
+    battle = BattleGenerator(seasons, player_count=10, seed=33).battle()
+    details = json.loads(battle['details'])
+    rows = process_raw_battles.extract_card_usage('b1', battle)
+
+    assert len(rows) == 2 + len(details['team1']['monsters']) + len(details['team2']['monsters'])
+    for battle_id, side, slot, card_id, level, won, mana_cap in rows:
+        team = details['team1' if side == 1 else 'team2']
+        card = team['summoner'] if slot == 0 else team['monsters'][slot - 1]
+        assert (battle_id, card_id, level, mana_cap) == ('b1', card['card_detail_id'], card.get('level'), battle['mana_cap'])
+        assert won == (team['player'] == battle['winner'])
+
+    # Rendición antes de enviar equipos o details inválido: sin filas
+    assert process_raw_battles.extract_card_usage('b2', dict(battle, details=json.dumps({'winner': battle['winner']}))) == []
+    assert process_raw_battles.extract_card_usage('b3', dict(battle, details='{no es json')) == []
@@ -0,0 +1,110 @@
+import glob
+import sqlite3
+
+import pytest
+
+import database
+import federated_query
+import process_raw_battles
+from benchmark.generator import BattleGenerator
+
+def ingest(battles):
+    raw_conn = database.get_raw_battles_db_connection()
+    database.insert_raw_battles_batch(raw_conn, battles)
+    raw_conn.close()
+    process_raw_battles.process_raw_battles(False)
+
+@pytest.fixture
+def federated(use_workspace, seasons):
+    use_workspace()
+    ingest(BattleGenerator(seasons, player_count=40, seed=21).battles(200))
+    federated = federated_query.FederatedQuery(max_workers=2)
+    yield federated
+    federated.close()
+
+def count_all(sql, params=()):
+    total = 0
+    for db_path in glob.glob(database.STRUCTURED_BATTLES_DB_PATTERN):
+        conn = sqlite3.connect(db_path)
+        total += conn.execute(sql, params).fetchone()[0]
+        conn.close()
+    return total
+
+def test_parse_params():
+    assert federated_query.parse_params(None) == ()
+    assert federated_query.parse_params('') == ()
+    assert federated_query.parse_params('[1, "quigua"]') == (1, 'quigua')
+    assert federated_query.parse_params(b'[2]') == (2,)
+    assert federated_query.parse_params(['a']) == ('a',)
+    for invalid in ('{"player": "quigua"}', '"quigua"', '[1,', 5):
+        with pytest.raises(ValueError):
+            federated_query.parse_params(invalid)
+
+def test_query_binds_params(federated):
+    conn = sqlite3.connect(glob.glob(database.STRUCTURED_BATTLES_DB_PATTERN)[0])
+    player = conn.execute("SELECT player_1 FROM battles LIMIT 1").fetchone()[0]
+    conn.close()
+
+    sql = "SELECT COUNT(*) FROM battles WHERE player_1 = ? OR player_2 = ?"
+    result = federated.query(sql, f'["{player}", "{player}"]')
+    assert result['errors'] == []
+    assert sum(row[2] for row in result['rows']) == count_all(sql, (player, player))
+
+@pytest.mark.parametrize('sql', [
+    "DELETE FROM battles",
+    "UPDATE battles SET winner = 'x'",
+    "INSERT INTO battles (battle_id) VALUES ('x')",
+    "ATTACH DATABASE ':memory:' AS extra",
+    "PRAGMA journal_mode = DELETE",
+    "PRAGMA query_only = 0",
+    "CREATE TEMP TABLE copia AS SELECT * FROM battles",
+])
+def test_authorizer_rejects_anything_but_reads(federated, sql):
+    rows_before = count_all("SELECT COUNT(*) FROM battles")
+    with pytest.raises(federated_query.ReadOnlyQueryError):
+        federated.query(sql, use_cache=False)
+    assert count_all("SELECT COUNT(*) FROM battles") == rows_before
+
+def test_authorizer_allows_reads_and_table_info(federated):
+    rows = count_all("SELECT COUNT(*) FROM battles")
+    result = federated.query("WITH t AS (SELECT battle_id FROM battles) SELECT COUNT(*) FROM t")
+    assert sum(row[2] for row in result['rows']) == rows
+    columns = federated.query("PRAGMA table_info(battles)")
+    assert 'battle_id' in {row[3] for row in columns['rows']}
+
+def test_read_only_authorizer_policy():
+    authorize = federated_query.read_only_authorizer
+    assert authorize(sqlite3.SQLITE_SELECT, None, None, None, None) == sqlite3.SQLITE_OK
+    assert authorize(sqlite3.SQLITE_READ, 'battles', 'winner', 'main', None) == sqlite3.SQLITE_OK
+    assert authorize(sqlite3.SQLITE_PRAGMA, 'index_list', 'battles', None, None) == sqlite3.SQLITE_OK
+    assert authorize(sqlite3.SQLITE_PRAGMA, 'journal_mode', 'WAL', None, None) == sqlite3.SQLITE_DENY
+    assert authorize(sqlite3.SQLITE_ATTACH, ':memory:', None, None, None) == sqlite3.SQLITE_DENY
+    assert authorize(sqlite3.SQLITE_INSERT, 'battles', None, 'main', None) == sqlite3.SQLITE_DENY
+
+def test_pool_discards_connections_when_file_identity_changes(federated):
+    db_path = glob.glob(database.STRUCTURED_BATTLES_DB_PATTERN)[0]
+    pool = federated_query.ConnectionPool()
+    first = pool.acquire(db_path, (False, 1))
+    pool.release(db_path, first, (False, 1))
+    assert pool.acquire(db_path, (False, 1)) is first # Reutiliza la conexión ociosa
+    pool.release(db_path, first, (False, 1))
+
+    second = pool.acquire(db_path, (False, 2)) # p. ej. archive_seasons reemplazó el archivo
+    assert second is not first
+    with pytest.raises(sqlite3.ProgrammingError):
+        first.execute("SELECT 1")
+
+    # Una conexión devuelta con la identidad vieja se cierra en lugar de volver al pool
+    pool.release(db_path, second, (False, 1))
+    with pytest.raises(sqlite3.ProgrammingError):
+        second.execute("SELECT 1")
+    pool.close_all()
+
+def test_cache_is_invalidated_by_new_rows(federated, seasons):
+    sql = "SELECT COUNT(*) FROM battles"
+    first = federated.query(sql)
+    assert federated.query(sql) is first
+    ingest(BattleGenerator(seasons, player_count=40, seed=22).battles(50))
+    second = federated.query(sql)
+    assert sum(row[2] for row in second['rows']) == count_all(sql)
+    assert second is not first
@@ -0,0 +1,89 @@
+import glob
+import sqlite3
+import threading
+
+import database
+import process_raw_battles
+from benchmark.generator import BattleGenerator
+from hot_cache import HotCache, get_current_season_id
+
+def ingest(battles):
+    raw_conn = database.get_raw_battles_db_connection()
+    database.insert_raw_battles_batch(raw_conn, battles)
+    raw_conn.close()
+    process_raw_battles.process_raw_battles(False)
+
+def current_season_files(seasons):
+    return glob.glob(f"{database.STRUCTURED_BATTLES_ROOT}/{get_current_season_id(seasons)}/*.db")
+
+def expected_formats(seasons, player):
+    """Agregados por formato del jugador leídos directamente de los archivos de la temporada actual."""
+    formats = {}
+    for db_path in current_season_files(seasons):
+        conn = sqlite3.connect(db_path)
+        for game_format, battles, wins in conn.execute(
+            "SELECT format, COUNT(*), SUM(winner = ?1) FROM battles WHERE player_1 = ?1 OR player_2 = ?1 GROUP BY format", (player,)
+        ):
+            formats[game_format] = (formats.get(game_format, (0, 0))[0] + battles, formats.get(game_format, (0, 0))[1] + wins)
+        conn.close()
+    return formats
+
+def cached_formats(summary):
+    return {game_format: (stats['battles'], stats['wins']) for game_format, stats in summary['formats'].items()}
+
+def active_players(seasons, limit):
+    counts = {}
+    for db_path in current_season_files(seasons):
+        conn = sqlite3.connect(db_path)
+        for player, battles in conn.execute(
+            "SELECT player, COUNT(*) FROM (SELECT player_1 AS player FROM battles UNION ALL SELECT player_2 FROM battles) GROUP BY player"
+        ):
+            counts[player] = counts.get(player, 0) + battles
+        conn.close()
+    return sorted(counts, key=counts.get, reverse=True)[:limit]
+
+def test_refresh_counts_each_battle_once(use_workspace, seasons):
+    use_workspace()
+    generator = BattleGenerator(seasons, player_count=40, seed=21, recent_season_weight=10.0)
+    ingest(generator.battles(400))
+    players = active_players(seasons, 15)
+    cache = HotCache(refresh_interval=0)
+
+    for player in players[:8]:
+        assert cache.get_player_summary(player)['source'] == 'disk'
+    ingest(generator.battles(200)) # Filas nuevas: las sigue el refresco para los jugadores en caché
+    for player in players[:8]:
+        summary = cache.get_player_summary(player)
+        assert summary['source'] == 'cache'
+        assert cached_formats(summary) == expected_formats(seasons, player)
+
+def test_concurrent_misses_and_ingest_count_each_battle_once(use_workspace, seasons):
+    use_workspace()
+    generator = BattleGenerator(seasons, player_count=40, seed=22, recent_season_weight=10.0)
+    ingest(generator.battles(300))
+    players = active_players(seasons, 20)
+    cache = HotCache(refresh_interval=0)
+    errors = []
+    done = threading.Event()
+
+    def reader(offset):
+        try:
+            while not done.is_set():
+                for player in players[offset::4]:
+                    cache.get_player_summary(player)
+        except Exception as e: # Se reporta en el hilo principal
+            errors.append(e)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for _ in range(5): # Cargas, seguimiento e inserciones entrelazados
+        ingest(generator.battles(60))
+    done.set()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+    for player in players:
+        summary = cache.get_player_summary(player)
+        assert cached_formats(summary) == expected_formats(seasons, player), player
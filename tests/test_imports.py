@@ -0,0 +1,26 @@
+import os
+import sys
+import subprocess
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Módulos que otros scripts o los tests importan. Importarlos no debe abrir los logs
+# de producción (/mnt/ssd/...): eso solo lo hace cada script en su bloque __main__.
+IMPORTED_MODULES = (
+    'database', 'metrics', 'profiling', 'ratings', 'main', 'process_raw_battles', 'create_battle_index',
+    'archive_seasons', 'federated_query', 'card_meta', 'hot_cache', 'migrate_generated_columns',
+    'replicate', 'scan_freshness', 'backfill', 'benchmark.scenarios',
+)
+
+def test_imports_do_not_open_log_files():
+    code = (
+        "import logging\n"
+        "class ForbiddenFileHandler(logging.Handler):\n"
+        "    def __init__(self, filename, *args, **kwargs):\n"
+        "        raise AssertionError(f'FileHandler abierto al importar: {filename}')\n"
+        "logging.FileHandler = ForbiddenFileHandler\n"
+        f"for name in {IMPORTED_MODULES!r}:\n"
+        "    __import__(name)\n"
+    )
+    result = subprocess.run([sys.executable, '-c', code], cwd=PROJECT_ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,120 @@
+import glob
+import json
+import os
+import sqlite3
+import stat
+
+import archive_seasons
+import database
+import migrate_generated_columns
+import process_raw_battles
+from benchmark.generator import BattleGenerator
+
+GENERATED_NAMES = [column['name'] for column in database.STRUCTURED_GENERATED_COLUMNS]
+
+def ingest(battles):
+    raw_conn = database.get_raw_battles_db_connection()
+    database.insert_raw_battles_batch(raw_conn, battles)
+    raw_conn.close()
+    process_raw_battles.process_raw_battles(False)
+
+def make_legacy_copy(db_path):
+    """Reescribe db_path con el esquema anterior: sin columnas generadas ni índices por jugador."""
+    legacy_path = f"{db_path}.legacy"
+    columns = ', '.join(database.STRUCTURED_BATTLE_COLUMNS)
+    conn = sqlite3.connect(legacy_path)
+    conn.execute(f"CREATE TABLE battles ({columns}, PRIMARY KEY (battle_id))")
+    conn.execute("ATTACH DATABASE ? AS src", (db_path,))
+    conn.execute(f"INSERT INTO battles ({columns}) SELECT {columns} FROM src.battles")
+    conn.commit()
+    conn.execute("DETACH DATABASE src")
+    conn.close()
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    os.replace(legacy_path, db_path)
+
+def read_battles(db_path, columns):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(f"SELECT {', '.join(columns)} FROM battles ORDER BY battle_id").fetchall()
+    conn.close()
+    return rows
+
+def season_and_format(db_path):
+    return int(os.path.basename(os.path.dirname(db_path))), os.path.splitext(os.path.basename(db_path))[0]
+
+def expected_generated_values(full_battle_json):
+    battle = json.loads(full_battle_json)
+    dec_info = json.loads(battle['dec_info'])
+    settings = json.loads(battle['settings'])
+    primary, _, secondary = battle['ruleset'].partition('|')
+    return (
+        dec_info.get('reward'), dec_info.get('glints'), settings.get('tournament_id'),
+        primary, secondary or None,
+        battle['player_1_rating_final'] - battle['player_1_rating_initial'],
+        battle['player_2_rating_final'] - battle['player_2_rating_initial'],
+    )
+
+def test_live_file_is_migrated_in_place(use_workspace, seasons):
+    use_workspace()
+    ingest(BattleGenerator(seasons, player_count=40, seed=41).battles(200))
+    db_path = max(glob.glob(database.STRUCTURED_BATTLES_DB_PATTERN), key=os.path.getsize)
+    make_legacy_copy(db_path)
+    base_rows = read_battles(db_path, database.STRUCTURED_BATTLE_COLUMNS)
+
+    conn = sqlite3.connect(db_path)
+    missing = database.missing_generated_columns(conn)
+    assert set(GENERATED_NAMES) <= set(missing)
+    database.initialize_structured_battle_table(conn) # Solo avisa: no altera un archivo existente
+    assert database.missing_generated_columns(conn) == missing
+    conn.close()
+
+    migrate_generated_columns.migrate_all()
+    conn = sqlite3.connect(db_path)
+    assert database.missing_generated_columns(conn) == []
+    assert database.missing_player_indexes(conn) == []
+    conn.close()
+    assert read_battles(db_path, database.STRUCTURED_BATTLE_COLUMNS) == base_rows
+    for row in read_battles(db_path, GENERATED_NAMES + ['full_battle_json']):
+        assert row[:-1] == expected_generated_values(row[-1])
+
+    # Ya migrado: no hay nada que crear
+    assert migrate_generated_columns.migrate_live_db(*season_and_format(db_path)) == []
+
+def test_archived_file_is_replaced_with_a_migrated_copy(use_workspace, seasons):
+    use_workspace()
+    ingest(BattleGenerator(seasons, player_count=40, seed=42).battles(200))
+    db_path = max(glob.glob(database.STRUCTURED_BATTLES_DB_PATTERN), key=os.path.getsize)
+    key = database.get_archive_key(db_path)
+    manifest = database.load_archive_manifest()
+    manifest[key] = archive_seasons.archive_db_file(db_path)
+
+    # Un archivo archivado antes de que existieran las columnas generadas
+    os.chmod(db_path, 0o644)
+    make_legacy_copy(db_path)
+    os.chmod(db_path, 0o444)
+    manifest[key]['sha256'] = database.file_sha256(db_path)
+    database.save_archive_manifest(manifest)
+    base_rows = read_battles(db_path, database.STRUCTURED_BATTLE_COLUMNS)
+    legacy_sha = manifest[key]['sha256']
+    inode_before = os.stat(db_path).st_ino
+
+    migrate_generated_columns.migrate_all() # Sin --include-archived no se toca
+    assert database.file_sha256(db_path) == legacy_sha
+
+    migrate_generated_columns.migrate_all(include_archived=True)
+    entry = database.load_archive_manifest()[key]
+    assert os.stat(db_path).st_ino != inode_before
+    assert stat.S_IMODE(os.stat(db_path).st_mode) == 0o444
+    assert entry['sha256'] == database.file_sha256(db_path) != legacy_sha
+    assert 'migrated_at' in entry
+    assert not os.path.exists(f"{db_path}.migrate.tmp")
+    assert read_battles(db_path, database.STRUCTURED_BATTLE_COLUMNS) == base_rows
+    conn = database.get_archived_db_connection(db_path)
+    assert database.missing_generated_columns(conn) == [] and database.missing_player_indexes(conn) == []
+    conn.close()
+
+    # Ya migrado: el archivo no se vuelve a reemplazar
+    inode_after = os.stat(db_path).st_ino
+    assert migrate_generated_columns.migrate_archived_db(db_path, database.load_archive_manifest()) == []
+    assert os.stat(db_path).st_ino == inode_after
@@ -0,0 +1,43 @@
+import glob
+import sqlite3
+
+import database
+import process_raw_battles
+from benchmark.generator import BattleGenerator
+
+def counter_total(metric, **labels):
+    return sum(sample['value'] for sample in metric.snapshot()['samples']
+               if all(sample['labels'].get(name) == value for name, value in labels.items()))
+
+def ingest(battles):
+    raw_conn = database.get_raw_battles_db_connection()
+    database.insert_raw_battles_batch(raw_conn, battles)
+    raw_conn.close()
+    process_raw_battles.process_raw_battles(False)
+
+def structured_rows():
+    total = 0
+    for db_path in glob.glob(database.STRUCTURED_BATTLES_DB_PATTERN):
+        conn = sqlite3.connect(db_path)
+        total += conn.execute("SELECT COUNT(*) FROM battles").fetchone()[0]
+        conn.close()
+    return total
+
+def test_destination_metrics_count_only_new_rows(use_workspace, seasons):
+    use_workspace()
+    battles = BattleGenerator(seasons, player_count=50, seed=3).battles(200)
+    rows_before = counter_total(process_raw_battles.PROCESSOR_DESTINATION_ROWS)
+    written_before = counter_total(database.DB_ROWS_WRITTEN, db='structured')
+    duplicate_before = counter_total(process_raw_battles.PROCESSOR_BATTLES, result='duplicate')
+
+    ingest(battles)
+    first_rows = structured_rows()
+    assert counter_total(process_raw_battles.PROCESSOR_DESTINATION_ROWS) - rows_before == first_rows
+    assert counter_total(database.DB_ROWS_WRITTEN, db='structured') - written_before == first_rows
+
+    # Las mismas batallas vuelven a raw_battles (p. ej. índice reconstruido a medias): nada nuevo
+    ingest(battles[:80])
+    assert structured_rows() == first_rows
+    assert counter_total(process_raw_battles.PROCESSOR_DESTINATION_ROWS) - rows_before == first_rows
+    assert counter_total(database.DB_ROWS_WRITTEN, db='structured') - written_before == first_rows
+    assert counter_total(process_raw_battles.PROCESSOR_BATTLES, result='duplicate') - duplicate_before > 0
@@ -0,0 +1,45 @@
+import logging
+import tracemalloc
+
+import pytest
+
+import profiling
+
+@pytest.fixture
+def unwritable_profile_dir(tmp_path, monkeypatch):
+    blocker = tmp_path / 'profiles'
+    blocker.write_text('') # Un archivo donde debería ir el directorio: os.makedirs falla
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(blocker))
+    yield
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    monkeypatch.setattr(profiling, '_previous_memory_snapshot', None)
+
+def test_sigusr1_logs_dump_errors_instead_of_raising(unwritable_profile_dir, monkeypatch, caplog):
+    monkeypatch.setattr(profiling, '_cpu_profiler', None)
+    profiling._handle_sigusr1(None, None) # Inicia el muestreo
+    assert profiling._cpu_profiler is not None
+    with caplog.at_level(logging.ERROR):
+        profiling._handle_sigusr1(None, None) # Detiene y no puede escribir el perfil
+    assert profiling._cpu_profiler is None
+    assert 'SIGUSR1' in caplog.text
+
+def test_sigusr1_runs_every_queued_action_even_if_one_fails(monkeypatch, caplog):
+    monkeypatch.setattr(profiling, '_cpu_profiler', None)
+    ran = []
+    def failing():
+        raise OSError('sin espacio')
+    profiling._main_thread_actions.put(failing)
+    profiling._main_thread_actions.put(lambda: ran.append(True))
+    with caplog.at_level(logging.ERROR):
+        profiling._handle_sigusr1(None, None)
+    assert ran == [True]
+    assert profiling._cpu_profiler is None # Con acciones encoladas no alterna el perfilado
+    assert 'sin espacio' in caplog.text
+
+def test_sigusr2_logs_snapshot_errors_instead_of_raising(unwritable_profile_dir, caplog):
+    profiling._handle_sigusr2(None, None) # Inicia tracemalloc
+    assert tracemalloc.is_tracing()
+    with caplog.at_level(logging.ERROR):
+        profiling._handle_sigusr2(None, None) # El snapshot no se puede escribir
+    assert 'SIGUSR2' in caplog.text
@@ -0,0 +1,112 @@
+import random
+import sqlite3
+from array import array
+from datetime import datetime, timezone
+
+import database
+import ratings
+from ratings import merge_points
+
+def as_points(series):
+    return list(zip(series[0::2], series[1::2]))
+
+def test_merge_points_appends_to_empty_series():
+    series = array('q')
+    assert merge_points(series, [(20, 1100), (10, 1000)])
+    assert as_points(series) == [(10, 1000), (20, 1100)]
+
+def test_merge_points_inserts_late_points_in_order():
+    series = array('q', (10, 1000, 30, 1200))
+    assert merge_points(series, [(20, 1100), (5, 900), (40, 1300)])
+    assert as_points(series) == [(5, 900), (10, 1000), (20, 1100), (30, 1200), (40, 1300)]
+
+def test_merge_points_ignores_reprocessed_points():
+    series = array('q', (10, 1000, 20, 1100))
+    assert not merge_points(series, [(10, 1000), (20, 1100)])
+    assert as_points(series) == [(10, 1000), (20, 1100)]
+
+def test_merge_points_orders_equal_timestamps_by_rating():
+    series = array('q', (10, 1000, 10, 1200))
+    assert merge_points(series, [(10, 1100), (10, 900), (10, 1300)])
+    assert as_points(series) == [(10, 900), (10, 1000), (10, 1100), (10, 1200), (10, 1300)]
+
+def test_merge_points_matches_sorted_set_for_any_batching():
+    # Igual que rebuild_ratings: serie ordenada por (ts, rating) y sin repetidos,
+    # sin importar en qué lotes ni en qué orden lleguen los puntos
+    rng = random.Random(7)
+    for _ in range(50):
+        points = [(rng.randint(0, 40), rng.choice((900, 1000, 1100))) for _ in range(rng.randint(1, 60))]
+        series = array('q')
+        remaining = list(points)
+        rng.shuffle(remaining)
+        while remaining:
+            size = rng.randint(1, 8)
+            merge_points(series, remaining[:size] + rng.sample(points, min(2, len(points))))
+            remaining = remaining[size:]
+        assert as_points(series) == sorted(set(points))
+
+def battle_row(battle_id, ts, player_1, rating_1, player_2, rating_2):
+    row = dict.fromkeys(database.STRUCTURED_BATTLE_COLUMNS)
+    row.update(battle_id=battle_id, player_1=player_1, player_2=player_2, created_date=datetime.fromtimestamp(ts, timezone.utc).isoformat(),
+               player_1_rating_final=rating_1, player_2_rating_final=rating_2)
+    return tuple(row[column] for column in database.STRUCTURED_BATTLE_COLUMNS)
+
+def open_rating_db(season_id=160, db_format='wild'):
+    conn = database.get_structured_db_connection(season_id, db_format)
+    database.initialize_structured_battle_table(conn)
+    database.initialize_rating_tables(conn)
+    return conn
+
+def brute_force_rank(conn, player):
+    rating = conn.execute("SELECT rating FROM player_ratings WHERE player = ?", (player,)).fetchone()[0]
+    higher = conn.execute("SELECT COUNT(*) FROM player_ratings WHERE rating > ?", (rating,)).fetchone()[0]
+    return {'rank': higher + 1, 'rating': rating, 'players': conn.execute("SELECT COUNT(*) FROM player_ratings").fetchone()[0]}
+
+def assert_histogram_consistent(conn):
+    assert conn.execute("SELECT rating, players FROM rating_histogram ORDER BY rating").fetchall() == \
+        conn.execute("SELECT rating, COUNT(*) FROM player_ratings GROUP BY rating ORDER BY rating").fetchall()
+
+def test_player_rank_follows_rating_updates(use_workspace):
+    use_workspace()
+    conn = open_rating_db()
+    rng = random.Random(9)
+    players = [f"player_{i}" for i in range(30)]
+    for batch in range(20):
+        rows = []
+        for i in range(15):
+            player_1, player_2 = rng.sample(players, 2)
+            rows.append(battle_row(f"b{batch}_{i}", 1_700_000_000 + batch * 100 + i, player_1, rng.randint(0, 60) * 25,
+                                   player_2, rng.randint(0, 60) * 25))
+        ratings.update_ratings(conn, rows)
+        conn.commit()
+        assert_histogram_consistent(conn)
+    conn.close()
+
+    conn = open_rating_db()
+    for player in players:
+        if conn.execute("SELECT 1 FROM player_ratings WHERE player = ?", (player,)).fetchone():
+            assert ratings.get_player_rank(160, 'wild', player) == brute_force_rank(conn, player)
+    assert ratings.get_player_rank(160, 'wild', 'nobody') is None
+    conn.close()
+
+def test_rating_histogram_migrates_existing_files(use_workspace):
+    use_workspace()
+    conn = open_rating_db()
+    ratings.update_ratings(conn, [battle_row(f"b{i}", 1_700_000_000 + i, f"p{i}", 1000 + 10 * (i % 4), f"q{i}", 1200) for i in range(12)])
+    conn.commit()
+    # Archivo anterior al histograma: se puebla una vez desde player_ratings
+    conn.execute("DROP TRIGGER player_ratings_insert")
+    conn.execute("DROP TRIGGER player_ratings_delete")
+    conn.execute("DROP TRIGGER player_ratings_update")
+    conn.execute("DROP TABLE rating_histogram")
+    conn.commit()
+    database.initialize_rating_tables(conn)
+    assert_histogram_consistent(conn)
+    assert ratings.get_player_rank(160, 'wild', 'q0') == {'rank': 1, 'rating': 1200, 'players': 24}
+    conn.close()
+
+def test_getters_handle_missing_files(use_workspace):
+    use_workspace()
+    assert ratings.get_rating_series(999, 'wild', 'player') == []
+    assert ratings.get_leaderboard(999, 'wild') == []
+    assert ratings.get_player_rank(999, 'wild', 'player') is None
@@ -0,0 +1,63 @@
+import glob
+import sqlite3
+
+import database
+import process_raw_battles
+import replicate
+from benchmark.generator import BattleGenerator
+
+def ingest(battles):
+    raw_conn = database.get_raw_battles_db_connection()
+    database.insert_raw_battles_batch(raw_conn, battles)
+    raw_conn.close()
+    process_raw_battles.process_raw_battles(False)
+
+def read_contents():
+    """Filas de batallas, series de rating e índice de cada archivo del directorio actual."""
+    contents = {}
+    for db_path in glob.glob(database.STRUCTURED_BATTLES_DB_PATTERN):
+        conn = sqlite3.connect(db_path)
+        contents[database.get_archive_key(db_path)] = (
+            conn.execute(f"SELECT {', '.join(replicate.BATTLES_COLUMNS)} FROM battles ORDER BY battle_id").fetchall(),
+            conn.execute("SELECT player, points FROM rating_series ORDER BY player").fetchall(),
+            conn.execute("SELECT player, rating, updated_at, battles FROM player_ratings ORDER BY player").fetchall(),
+        )
+        conn.close()
+    conn = sqlite3.connect(replicate.get_battle_index_path())
+    contents[replicate.BATTLE_INDEX_KEY] = conn.execute("SELECT battle_id FROM processed_battles ORDER BY battle_id").fetchall()
+    conn.close()
+    return contents
+
+def test_export_apply_is_idempotent(use_workspace, seasons, tmp_path):
+    feed_dir = str(tmp_path / 'feed')
+    generator = BattleGenerator(seasons, player_count=60, seed=11)
+
+    use_workspace('primary')
+    ingest(generator.battles(300))
+    assert replicate.export_changes(feed_dir, batch_rows=40) > 0
+    assert replicate.export_changes(feed_dir, batch_rows=40) == 0 # Nada nuevo desde la marca de agua
+    primary = read_contents()
+
+    use_workspace('replica')
+    assert replicate.apply_feed(feed_dir)['batch'] > 0
+    assert replicate.apply_feed(feed_dir) == {'batch': 0, 'snapshot': 0, 'file': 0}
+    assert read_contents() == primary
+
+    # Segunda ronda: solo las filas nuevas, y reaplicar todo el feed no cambia nada
+    use_workspace('primary')
+    ingest(generator.battles(120))
+    assert replicate.export_changes(feed_dir, batch_rows=40) > 0
+    primary = read_contents()
+
+    use_workspace('replica')
+    assert replicate.apply_feed(feed_dir)['batch'] > 0
+    assert read_contents() == primary
+
+    # Registro de entradas aplicadas perdido: todos los lotes se reaplican sin duplicar nada
+    for db_path in glob.glob(database.STRUCTURED_BATTLES_DB_PATTERN) + [replicate.get_battle_index_path()]:
+        replica_conn = sqlite3.connect(db_path)
+        replica_conn.execute("DELETE FROM replication_applied")
+        replica_conn.commit()
+        replica_conn.close()
+    replicate.apply_feed(feed_dir)
+    assert read_contents() == primary
@@ -0,0 +1,90 @@
+import random
+import sqlite3
+
+import pytest
+
+import database
+import scan_freshness
+
+@pytest.fixture
+def players_conn(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'players.db'))
+    yield conn
+    conn.close()
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Reloj controlado para last_scanned_timestamp (database usa time.time())."""
+    now = [1_700_000_000]
+    monkeypatch.setattr(database.time, 'time', lambda: now[0])
+    return now
+
+def assert_scan_buckets_consistent(conn):
+    expected = conn.execute(f'''
+        SELECT last_scanned_timestamp - (last_scanned_timestamp % {database.SCAN_BUCKET_SECONDS}), activity_tier, scan_lane, COUNT(*)
+        FROM players GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+    ''').fetchall()
+    actual = conn.execute(
+        "SELECT bucket_ts, activity_tier, scan_lane, players FROM scan_buckets ORDER BY 1, 2, 3"
+    ).fetchall()
+    assert actual == expected
+    assert database.get_total_players(conn) == conn.execute("SELECT COUNT(*) FROM players").fetchone()[0]
+
+def test_scan_buckets_follow_upserts_and_deletes(players_conn, clock):
+    database.initialize_players_table(players_conn)
+    rng = random.Random(3)
+    names = [f"player_{i}" for i in range(40)]
+    for _ in range(200):
+        clock[0] += rng.choice((1, 30, 299, 300, 301, 3600))
+        action = rng.random()
+        if action < 0.6:
+            database.add_or_update_players_batch(
+                players_conn, rng.sample(names, rng.randint(1, 10)),
+                lane=rng.choice(database.SCAN_LANES), activity_tier=rng.choice(database.ACTIVITY_TIERS + (None,))
+            )
+        elif action < 0.9:
+            database.add_or_update_player(players_conn, rng.choice(names), lane='rotation',
+                                          activity_tier=database.classify_activity_tier(rng.randint(0, 50)))
+            players_conn.commit()
+        else:
+            players_conn.execute("DELETE FROM players WHERE player_name = ?", (rng.choice(names),))
+            players_conn.commit()
+        assert_scan_buckets_consistent(players_conn)
+
+def test_scan_buckets_migration_counts_existing_players(players_conn, clock):
+    # Tabla anterior a los carriles/niveles: la migración debe poblar el resumen una vez
+    players_conn.execute("CREATE TABLE players (player_name TEXT PRIMARY KEY, last_scanned_timestamp INTEGER DEFAULT 0)")
+    players_conn.executemany("INSERT INTO players VALUES (?, ?)", [(f"old_{i}", 1_600_000_000 + 97 * i) for i in range(25)])
+    players_conn.commit()
+
+    database.initialize_players_table(players_conn)
+    assert_scan_buckets_consistent(players_conn)
+
+    database.initialize_players_table(players_conn) # Ya migrada: no debe duplicar el resumen
+    database.add_or_update_players_batch(players_conn, ['old_0', 'old_1', 'new_0'], lane='priority', activity_tier='active')
+    assert_scan_buckets_consistent(players_conn)
+
+def test_crawl_rate_counts_recorded_scans_not_players(players_conn, clock):
+    database.initialize_players_table(players_conn)
+    start = clock[0] - clock[0] % database.SCAN_BUCKET_SECONDS
+    # El mismo jugador escaneado 30 veces: scan_buckets tiene 1 jugador, scan_counts 30 escaneos
+    for i in range(30):
+        clock[0] = start + i * 20
+        database.add_or_update_player(players_conn, 'player_0', lane='rotation', activity_tier='active')
+        players_conn.commit()
+        database.record_scan(players_conn, 'rotation')
+    assert database.get_total_players(players_conn) == 1
+
+    now = start + 600
+    # Ventana de 600 s alineada al borde de cubeta: 30 escaneos en [start, now)
+    assert scan_freshness.crawl_rate(players_conn, now, window=600) == pytest.approx(30 / 600)
+    # Ventana que empieza a mitad de la primera cubeta: se extiende hasta su borde
+    assert scan_freshness.crawl_rate(players_conn, now, window=450) == pytest.approx(30 / 600)
+    # Escaneos fuera de la ventana no cuentan
+    assert scan_freshness.crawl_rate(players_conn, start + 3600, window=600) == 0
+
+def test_record_scan_prunes_old_buckets(players_conn, clock):
+    database.initialize_players_table(players_conn)
+    database.record_scan(players_conn, 'priority', now=clock[0] - database.SCAN_COUNT_RETENTION_SECONDS - 3600)
+    database.record_scan(players_conn, 'priority', now=clock[0])
+    assert players_conn.execute("SELECT SUM(scans) FROM scan_counts").fetchone()[0] == 1
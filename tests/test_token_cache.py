@@ -0,0 +1,81 @@
+import json
+import os
+import stat
+
+import pytest
+
+import main
+
+def counter_total(metric, **labels):
+    return sum(sample['value'] for sample in metric.snapshot()['samples']
+               if all(sample['labels'].get(name) == value for name, value in labels.items()))
+
+@pytest.fixture
+def token_cache(tmp_path, monkeypatch):
+    cache_file = tmp_path / 'token_cache.json'
+    monkeypatch.setattr(main, 'TOKEN_CACHE_FILE', str(cache_file))
+    monkeypatch.setattr(main, 'TOKEN_CACHE_ENABLED', True)
+    return cache_file
+
+@pytest.fixture
+def logins(monkeypatch):
+    """Sustituye el login real: cada llamada devuelve un token nuevo."""
+    calls = []
+    def fake_login(username, posting_key):
+        calls.append(username)
+        return username, f"token-{len(calls)}"
+    monkeypatch.setattr(main, 'login_to_splinterlands', fake_login)
+    return calls
+
+def test_saved_token_is_private_and_reloaded(token_cache):
+    main.save_cached_token('quigua', 'abc')
+    assert stat.S_IMODE(os.stat(token_cache).st_mode) == 0o600
+    assert not os.path.exists(f"{token_cache}.tmp")
+    assert main.load_cached_token('quigua') == 'abc'
+    assert main.load_cached_token('otro') is None # Token de otra cuenta
+
+def test_expired_or_unreadable_token_is_ignored(token_cache, monkeypatch):
+    monkeypatch.setattr(main, 'TOKEN_TTL_SECONDS', -1)
+    main.save_cached_token('quigua', 'abc')
+    assert main.load_cached_token('quigua') is None
+
+    token_cache.write_text('{no es json')
+    assert main.load_cached_token('quigua') is None
+
+def test_token_with_insecure_permissions_is_ignored(token_cache):
+    main.save_cached_token('quigua', 'abc')
+    os.chmod(token_cache, 0o644)
+    assert main.load_cached_token('quigua') is None
+
+def test_invalidate_removes_the_cache(token_cache):
+    main.save_cached_token('quigua', 'abc')
+    main.invalidate_cached_token()
+    assert not token_cache.exists()
+    main.invalidate_cached_token() # Sin archivo no falla
+    assert main.load_cached_token('quigua') is None
+
+def test_get_auth_token_logs_in_once_and_then_uses_the_cache(token_cache, logins):
+    cache_before = counter_total(main.AUTH_LOGINS, source='cache')
+    assert main.get_auth_token('quigua', 'clave') == ('quigua', 'token-1')
+    assert json.loads(token_cache.read_text())['token'] == 'token-1'
+    assert main.get_auth_token('quigua', 'clave') == ('quigua', 'token-1')
+    assert logins == ['quigua']
+    assert counter_total(main.AUTH_LOGINS, source='cache') - cache_before == 1
+
+    # Token rechazado por el API: se invalida y se fuerza el login
+    main.invalidate_cached_token()
+    assert main.get_auth_token('quigua', 'clave', force_login=True) == ('quigua', 'token-2')
+    assert main.load_cached_token('quigua') == 'token-2'
+    assert len(logins) == 2
+
+def test_get_auth_token_without_cache(token_cache, logins, monkeypatch):
+    monkeypatch.setattr(main, 'TOKEN_CACHE_ENABLED', False)
+    main.get_auth_token('quigua', 'clave')
+    main.get_auth_token('quigua', 'clave')
+    assert len(logins) == 2
+    assert not token_cache.exists()
+
+def test_failed_login_is_not_cached(token_cache, monkeypatch):
+    monkeypatch.setattr(main, 'login_to_splinterlands', lambda username, posting_key: (None, None))
+    assert main.get_auth_token('quigua', 'clave') == (None, None)
+    assert not token_cache.exists()